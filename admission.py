@@ -0,0 +1,218 @@
+"""
+Информационная система учёта аудиторного фонда
+Контроль допуска запросов к дорогим маршрутам
+
+Дорогие маршруты разбиты на пулы (поиск, отчёты), у каждого пула:
+    * предел одновременно выполняемых запросов и ограниченная очередь
+      ожидания: если очередь полна или ожидание затянулось — сразу 503
+      с Retry-After вместо того, чтобы занимать соединения БД;
+    * ограничение частоты для каждого клиента (token bucket): при
+      превышении — 429 с Retry-After.
+
+Пулы изолированы: отчёты не могут занять больше своих мест, поэтому
+дешёвые маршруты (они не ограничиваются) и поиск остаются отзывчивыми
+при перегрузке отчётами. Фоновая работа вне запросов занимает место в
+пуле через slot().
+"""
+
+import contextlib
+import functools
+import math
+import threading
+import time
+
+from flask import jsonify, request
+
+
+class ConcurrencyLimiter:
+    """Не более limit одновременных запросов, не более queue_size ждущих"""
+
+    def __init__(self, limit, queue_size=0, queue_timeout=1.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """True — место получено; False — очередь полна или ожидание истекло"""
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue_size:
+                return False
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def try_acquire(self):
+        """Место, если оно свободно прямо сейчас, без ожидания в очереди"""
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return True
+            return False
+
+    def acquire_wait(self):
+        """Место без ограничения очереди и времени ожидания (для фоновых задач)"""
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class TokenBucket:
+    """Ограничение частоты запросов по ключу клиента: rate в секунду, запас burst"""
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """0 — запрос разрешён; иначе — сколько секунд ждать следующего токена"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                if len(self._buckets) > self.max_clients:
+                    self._prune(now)
+                return 0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        # Клиенты, чьи корзины уже наполнились бы до конца, ничем не отличаются от новых
+        full_after = self.burst / self.rate
+        for key in [k for k, (_, last) in self._buckets.items() if now - last >= full_after]:
+            del self._buckets[key]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class Pool:
+    """Пул маршрутов: общий предел одновременности и частота на клиента"""
+
+    def __init__(self, name, concurrency, queue=0, queue_timeout=1.0, rate=None, burst=None):
+        self.name = name
+        self.limiter = ConcurrencyLimiter(concurrency, queue, queue_timeout)
+        self.bucket = TokenBucket(rate, burst or max(1, int(rate))) if rate else None
+        self.rejected = 0
+        self.throttled = 0
+        # Скользящее среднее времени обработки — для оценки Retry-After
+        self._avg_seconds = 0.5
+
+    def observe(self, seconds):
+        self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * seconds
+
+    def retry_after(self):
+        """Через сколько секунд освободится место с учётом очереди"""
+        backlog = self.limiter.waiting + self.limiter.active
+        return max(1, math.ceil(self._avg_seconds * backlog / self.limiter.limit))
+
+    def stats(self):
+        return {
+            'active': self.limiter.active,
+            'waiting': self.limiter.waiting,
+            'limit': self.limiter.limit,
+            'queue': self.limiter.queue_size,
+            'rejected': self.rejected,
+            'throttled': self.throttled,
+            'avg_ms': round(self._avg_seconds * 1000, 1),
+        }
+
+
+class AdmissionControl:
+    """Пулы маршрутов и декоратор limit(имя пула) для представлений Flask"""
+
+    def __init__(self, pools, enabled=True):
+        self.enabled = enabled
+        self.pools = {name: Pool(name, **options) for name, options in pools.items()}
+
+    @staticmethod
+    def client_key():
+        return request.remote_addr or 'unknown'
+
+    @staticmethod
+    def _reject(status, message, retry_after):
+        response = jsonify({'error': message, 'retry_after': retry_after})
+        response.status_code = status
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def limit(self, pool_name):
+        """Декоратор: маршрут выполняется только при наличии места в пуле"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                pool = self.pools.get(pool_name)
+                if not self.enabled or pool is None:
+                    return view(*args, **kwargs)
+
+                if pool.bucket is not None:
+                    wait = pool.bucket.take(self.client_key())
+                    if wait:
+                        pool.throttled += 1
+                        return self._reject(429, 'Слишком много запросов, повторите позже', math.ceil(wait))
+
+                if not pool.limiter.acquire():
+                    pool.rejected += 1
+                    return self._reject(503, 'Сервер перегружен, повторите позже', pool.retry_after())
+                started = time.monotonic()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    pool.limiter.release()
+                    pool.observe(time.monotonic() - started)
+            return wrapper
+        return decorator
+
+    @contextlib.contextmanager
+    def slot(self, pool_name):
+        """
+        Место в пуле для фоновой работы вне запроса (например, задачи отчёта):
+        она ждёт своей очереди без отказа и занимает место наравне с запросами.
+        """
+        pool = self.pools.get(pool_name)
+        if not self.enabled or pool is None:
+            yield
+            return
+        pool.limiter.acquire_wait()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            pool.limiter.release()
+            pool.observe(time.monotonic() - started)
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    def reset(self):
+        """Сброс ограничений частоты (например, между тестами)"""
+        for pool in self.pools.values():
+            if pool.bucket is not None:
+                pool.bucket.clear()
+            pool.rejected = pool.throttled = 0
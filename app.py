@@ -3,14 +3,50 @@
 Основной файл приложения
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+import sys
+
+if __name__ == '__main__':
+    # python app.py: главным модулем становится лёгкий serve.py, а приложение импортируется
+    # из него как модуль app — дочерние процессы пула моделирования (spawn) не выполняют его заново
+    import runpy
+    runpy.run_module('serve', run_name='__main__', alter_sys=True)
+    sys.exit()
+
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort
 from flask_sqlalchemy import SQLAlchemy
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, time, timedelta, date
+import atexit
 import csv
+import functools
+import hmac
 import io
+import multiprocessing
 import os
-import sys
-from sqlalchemy import text
+import threading
+from sqlalchemy import case, event, func, inspect, select, text
+
+import admission
+import capacity_simulation
+import change_feed
+import classroom_batch
+import fragment_cache
+import lesson_archive
+import lesson_dictionary
+import lesson_search
+import recurring_search
+import report_jobs
+import room_ranking
+import serialization
+import sharding
+import request_profiler
+import slow_query
+import sqlite_mode
+import startup
+
+# Тяжёлые библиотеки отчётов (NumPy) загружаются при первом отчёте, а не при старте воркера
+heatmap = startup.lazy_import('heatmap')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
@@ -24,8 +60,158 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_pre_ping': True,
 }
 
+# Кэш отрендеренных фрагментов шаблонов: memory — в процессе (ключи сверяются с курсором
+# журнала изменений, поэтому запись в другом воркере его тоже сбрасывает), disk — общий для воркеров
+app.config['FRAGMENT_CACHE'] = os.getenv('FRAGMENT_CACHE', 'memory')
+app.config['FRAGMENT_CACHE_DIR'] = os.getenv('FRAGMENT_CACHE_DIR', os.path.join(app.instance_path, 'fragments'))
+
 db = SQLAlchemy(app)
 
+if app.config['FRAGMENT_CACHE'] == 'disk':
+    fragments = fragment_cache.FragmentCache(fragment_cache.DiskBackend(app.config['FRAGMENT_CACHE_DIR']))
+else:
+    fragments = fragment_cache.FragmentCache(fragment_cache.MemoryBackend(),
+                                             shared_version=lambda: fragment_data_version())
+app.jinja_env.add_extension(fragment_cache.FragmentCacheExtension)
+app.jinja_env.fragment_cache = fragments
+
+# Фоновые отчёты: ограниченный пул потоков, результаты на диске с истечением срока
+app.config['REPORT_JOBS_DIR'] = os.getenv('REPORT_JOBS_DIR', os.path.join(app.instance_path, 'report_jobs'))
+app.config['REPORT_JOBS_WORKERS'] = int(os.getenv('REPORT_JOBS_WORKERS', 2))
+app.config['REPORT_JOBS_TTL'] = int(os.getenv('REPORT_JOBS_TTL', 3600))
+report_queue = report_jobs.ReportJobs(
+    app.config['REPORT_JOBS_DIR'],
+    max_workers=app.config['REPORT_JOBS_WORKERS'],
+    ttl=app.config['REPORT_JOBS_TTL']
+)
+
+# Рабочий режим SQLite: WAL, PRAGMA соединений и единственный поток-писатель
+app.config['SQLITE_PRODUCTION'] = os.getenv('SQLITE_PRODUCTION', '0') == '1'
+app.config['SQLITE_WRITE_TIMEOUT'] = float(os.getenv('SQLITE_WRITE_TIMEOUT', 30))
+write_queue = None
+if app.config['SQLITE_PRODUCTION'] and app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    with app.app_context():
+        sqlite_mode.configure_engine(db.engine)
+    write_queue = sqlite_mode.WriteQueue(db.session, context_factory=app.app_context)
+
+
+def run_write(func):
+    """
+    Выполнение записи func (без commit внутри) и её фиксация: в рабочем режиме
+    SQLite — через очередь писателя, иначе сразу в сессии запроса.
+    Возвращает результат func; ошибка записи пробрасывается вызывающему.
+    """
+    if write_queue is not None:
+        return write_queue.submit(func).result(timeout=app.config['SQLITE_WRITE_TIMEOUT'])
+    try:
+        result = func()
+        db.session.commit()
+        return result
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+# Журнал медленных запросов: порог в миллисекундах, файл с ротацией
+app.config['SLOW_QUERY_MS'] = float(os.getenv('SLOW_QUERY_MS', 200))
+app.config['SLOW_QUERY_LOG'] = os.getenv('SLOW_QUERY_LOG', os.path.join(app.instance_path, 'slow_queries.log'))
+os.makedirs(os.path.dirname(app.config['SLOW_QUERY_LOG']) or '.', exist_ok=True)
+slow_queries = slow_query.SlowQueryLog(app.config['SLOW_QUERY_MS'], app.config['SLOW_QUERY_LOG'])
+with app.app_context():
+    slow_queries.install(db.engine)
+
+# Токен страниц администратора — только в заголовке X-Admin-Token: параметр адреса
+# попал бы в журналы доступа, медленных запросов и профилей.
+# Без токена страницы доступны только в режиме отладки и тестирования.
+app.config['ADMIN_TOKEN'] = os.getenv('ADMIN_TOKEN', '')
+
+
+def admin_denied():
+    """Причина отказа в доступе администратора к текущему запросу или None"""
+    token = app.config['ADMIN_TOKEN']
+    if token:
+        given = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(given.encode('utf-8'), token.encode('utf-8')):
+            return 'Нет доступа'
+    elif not (app.debug or app.testing):
+        return 'Страницы администратора отключены: задайте ADMIN_TOKEN'
+    return None
+
+
+def admin_required(view):
+    """Доступ к служебным страницам только администратору"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        denied = admin_denied()
+        if denied:
+            return jsonify({'error': denied}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# Профилирование отдельных запросов: администратор добавляет заголовок X-Profile: 1
+# или параметр profile=1, в памяти хранятся последние PROFILE_KEEP профилей
+app.config['PROFILE_KEEP'] = int(os.getenv('PROFILE_KEEP', 50))
+profiler = request_profiler.RequestProfiler(app.root_path, keep=app.config['PROFILE_KEEP'])
+with app.app_context():
+    profiler.install(db.engine)
+
+
+@app.before_request
+def start_profile():
+    if request_profiler.requested(request.headers, request.args) and admin_denied() is None:
+        profiler.start(request.method, request.full_path.rstrip('?'))
+
+
+@app.after_request
+def finish_profile(response):
+    if profiler.active():
+        response.headers['X-Profile-Id'] = str(profiler.stop(response.status_code))
+    return response
+
+
+@app.teardown_request
+def abort_profile(exc):
+    # Необработанная ошибка: after_request не вызывался, профиль всё равно сохраняется
+    if profiler.active():
+        profiler.stop(500)
+
+# Асинхронный путь чтения (asgi.py): пул соединений asyncio-движка; нет свободного
+# соединения за ASYNC_POOL_TIMEOUT секунд — ответ 503
+app.config['ASYNC_POOL_SIZE'] = int(os.getenv('ASYNC_POOL_SIZE', 10))
+app.config['ASYNC_POOL_TIMEOUT'] = float(os.getenv('ASYNC_POOL_TIMEOUT', 2))
+
+# Шардирование по корпусам (sharding.py): карта шардов в JSON, пусто — одна общая БД.
+# Аудитории, занятия и архив читаются и пишутся в шардах, журнал изменений остаётся в общей БД
+app.config['SHARDS'] = os.getenv('SHARDS', '')
+shard_map = sharding.ShardMap.from_config(app.config['SHARDS']) if app.config['SHARDS'] else None
+
+# Моделирование фонда «что если»: пары (сценарий, день) считаются на пуле процессов,
+# 1 — последовательно в процессе запроса
+app.config['SIMULATION_WORKERS'] = int(os.getenv('SIMULATION_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Контроль допуска: дорогие маршруты разбиты на пулы с пределом одновременности,
+# очередью ожидания (503 при переполнении) и частотой на клиента (429).
+# Фоновые задачи отчётов (REPORT_JOBS_WORKERS потоков) занимают место в пуле reports
+# на время построения, поэтому все ограниченные пулы вместе держат не больше
+# 3 + 1 = 4 соединений из pool_size = 5: дешёвым маршрутам всегда остаётся соединение.
+app.config['ADMISSION_CONTROL'] = os.getenv('ADMISSION_CONTROL', '1') == '1'
+app.config['ADMISSION_POOLS'] = {
+    'search': {'concurrency': 3, 'queue': 20, 'queue_timeout': 2.0, 'rate': 10, 'burst': 20},
+    'reports': {'concurrency': 1, 'queue': 4, 'queue_timeout': 5.0, 'rate': 2, 'burst': 10},
+}
+admission_control = admission.AdmissionControl(
+    app.config['ADMISSION_POOLS'], enabled=app.config['ADMISSION_CONTROL']
+)
+
+
+# Пересоздание таблиц делает недействительными все закэшированные фрагменты и id справочников
+@event.listens_for(db.metadata, 'after_create')
+@event.listens_for(db.metadata, 'after_drop')
+def reset_fragments(target, connection, **kw):
+    fragments.bump('classrooms', 'lessons')
+    names.clear()
+
 
 # Модели базы данных
 class Classroom(db.Model):
@@ -64,17 +250,70 @@ class Classroom(db.Model):
         }
 
 
-class Lesson(db.Model):
-    __tablename__ = 'lessons'
+class Teacher(db.Model):
+    """Справочник преподавателей"""
+    __tablename__ = 'teachers'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+
+
+class Group(db.Model):
+    """Справочник учебных групп"""
+    __tablename__ = 'student_groups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+
+
+class Subject(db.Model):
+    """Справочник дисциплин"""
+    __tablename__ = 'subjects'
     
     id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+
+
+# Кэш интернирования имён: id справочника без запроса к БД для встречавшихся имён
+names = lesson_dictionary.NameDictionary()
+names.install(db.session)
+
+# Поле занятия -> таблица справочника (колонки ссылок — в lesson_dictionary.DICTIONARIES)
+LESSON_DICTIONARY_TABLES = {
+    'group_name': Group.__table__,
+    'teacher_name': Teacher.__table__,
+    'subject_name': Subject.__table__,
+}
+
+
+def dictionary_name(field):
+    """Свойство занятия: имя из справочника вместо строковой колонки (чтение и запись)"""
+    fk_column, _ = lesson_dictionary.DICTIONARIES[field]
+    table = LESSON_DICTIONARY_TABLES[field]
+    
+    def getter(self):
+        return names.name_of(db.session, table, getattr(self, fk_column))
+    
+    def setter(self, value):
+        setattr(self, fk_column, names.intern(db.session, table, value))
+    
+    return property(getter, setter)
+
+
+class LessonFields:
+    """Общие колонки занятия для горячей таблицы и архива прошедших семестров"""
     classroom_id = db.Column(db.Integer, db.ForeignKey('classrooms.id'), nullable=False)
-    lesson_date = db.Column(db.Date, nullable=False)
+    lesson_date = db.Column(db.Date, nullable=False, index=True)
     start_time = db.Column(db.Time, nullable=False)
     end_time = db.Column(db.Time, nullable=False)
-    group_name = db.Column(db.String(50))
-    teacher_name = db.Column(db.String(100))
-    subject_name = db.Column(db.String(100))
+    group_id = db.Column(db.Integer, db.ForeignKey('student_groups.id'), index=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), index=True)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), index=True)
+    
+    # Имена по-прежнему читаются и задаются строками (формы, шаблоны, to_dict)
+    group_name = dictionary_name('group_name')
+    teacher_name = dictionary_name('teacher_name')
+    subject_name = dictionary_name('subject_name')
     
     def __repr__(self):
         return f'<Lesson {self.subject_name} {self.lesson_date}>'
@@ -93,6 +332,152 @@ class Lesson(db.Model):
         }
 
 
+class Lesson(LessonFields, db.Model):
+    __tablename__ = 'lessons'
+    # AUTOINCREMENT в SQLite: id не переиспользуются после переноса занятий в архив
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)
+
+
+class ArchivedLesson(LessonFields, db.Model):
+    """Занятие прошедшего семестра (только чтение, см. lesson_archive.py)"""
+    __tablename__ = lesson_archive.ARCHIVE_TABLE
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    
+    classroom = db.relationship('Classroom', viewonly=True)
+
+
+class ChangeLog(db.Model):
+    """Журнал изменений аудиторий и занятий для синхронизации клиентов (см. change_feed.py)"""
+    __tablename__ = 'change_log'
+    # AUTOINCREMENT в SQLite: курсоры не переиспользуются после сжатия журнала;
+    # индекс по сущности нужен сжатию (поиск более поздней записи той же сущности)
+    __table_args__ = (
+        db.Index('ix_change_log_entity', 'entity', 'entity_id', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    data = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class ChangeLogMeta(db.Model):
+    """Служебные значения журнала изменений (граница сжатия)"""
+    __tablename__ = 'change_log_meta'
+    
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
+
+
+# Поля JSON API (как в to_dict) для выборки простыми строками без ORM-объектов
+CLASSROOM_FIELDS = [
+    'id', 'number', 'floor', 'building', 'capacity', 'area',
+    'has_projector', 'has_computers', 'has_board', 'has_air_conditioner', 'computers_count'
+]
+
+LESSON_FIELDS = [
+    'id', 'classroom_id', 'classroom_number', 'lesson_date', 'start_time', 'end_time',
+    'group_name', 'teacher_name', 'subject_name'
+]
+
+LESSON_FORMATTERS = {
+    'lesson_date': serialization.format_date,
+    'start_time': serialization.format_time,
+    'end_time': serialization.format_time,
+}
+
+
+def lesson_select(model, fields):
+    """
+    Запрос занятий нужными колонками. Номер аудитории и имена из справочников
+    присоединяются, только если они запрошены.
+    """
+    joins = {}
+    columns = []
+    for f in fields:
+        if f == 'classroom_number':
+            columns.append(Classroom.number)
+        elif f == 'classroom_building':
+            columns.append(Classroom.building)
+        elif f in LESSON_DICTIONARY_TABLES:
+            fk_column, _ = lesson_dictionary.DICTIONARIES[f]
+            table = LESSON_DICTIONARY_TABLES[f].alias(f'{f}_dictionary')
+            joins[f] = (table, table.c.id == getattr(model, fk_column))
+            columns.append(table.c.name)
+        else:
+            columns.append(getattr(model, f))
+    query = select(*columns).select_from(model)
+    if 'classroom_number' in fields or 'classroom_building' in fields:
+        query = query.join(Classroom, Classroom.id == model.classroom_id)
+    for table, condition in joins.values():
+        query = query.outerjoin(table, condition)
+    return query
+
+
+def lesson_models(date_from, connection=None):
+    """
+    Модели занятий для чтения диапазона дат с date_from: архив только если он задет.
+    connection — соединение шарда (по умолчанию — сессия общей БД).
+    """
+    if lesson_archive.needs_archive(db.session if connection is None else connection,
+                                    ArchivedLesson.__table__, date_from):
+        return [Lesson, ArchivedLesson]
+    return [Lesson]
+
+
+def is_archived_date(day):
+    """Дата относится к семестру, уже перенесённому в архив (в том числе после его последнего занятия)"""
+    boundary = lesson_archive.archive_boundary(db.session, ArchivedLesson.__table__)
+    return boundary is not None and day < lesson_archive.term_bounds(boundary)[1]
+
+
+# Поисковый индекс по справочникам преподавателей, групп и дисциплин
+lesson_search.install(LESSON_DICTIONARY_TABLES.values())
+
+
+def change_data(obj, fields, formatters=None):
+    """Снимок полей объекта для журнала изменений"""
+    formatters = formatters or {}
+    return {f: formatters[f](getattr(obj, f)) if f in formatters else getattr(obj, f) for f in fields}
+
+
+# Журнал изменений пишется в той же транзакции, что и сами изменения
+change_feed.install(db.session, ChangeLog.__table__, {
+    Classroom: ('classroom', lambda obj: change_data(obj, CLASSROOM_FIELDS)),
+    Lesson: ('lesson', lambda obj: change_data(
+        obj, [f for f in LESSON_FIELDS if f != 'classroom_number'], LESSON_FORMATTERS)),
+})
+
+
+def fragment_data_version():
+    """Курсор журнала изменений — общая для всех воркеров версия данных кэша фрагментов в памяти"""
+    return change_feed.latest_cursor(db.session.connection(), ChangeLog.__table__, ChangeLogMeta.__table__)
+
+
+def record_shard_changes(entity, changes):
+    """
+    Журнал изменений для записей в шарды: журнал остаётся в общей БД и
+    пишется после фиксации транзакции шарда. changes — [(id, op, data)].
+    """
+    if changes:
+        run_write(lambda: change_feed.record(db.session.connection(), ChangeLog.__table__, entity, changes))
+
+
+def shard_classroom(classroom_id):
+    """Строка аудитории из её шарда; 404, если её нет ни в одном шарде"""
+    name = shard_map.locate(Classroom.__table__, classroom_id)
+    if name is None:
+        abort(404)
+    query = select(Classroom.__table__).where(Classroom.id == classroom_id)
+    return shard_map.fan_out(lambda connection: connection.execute(query).one(), [name])[name]
+
+
 # Контекстный процессор для передачи функций в шаблоны
 @app.context_processor
 def utility_processor():
@@ -108,9 +493,18 @@ def utility_processor():
 def index():
     """Главная страница с общей статистикой"""
     try:
-        total_classrooms = Classroom.query.count()
-        total_lessons = Lesson.query.count()
-        busy_today = Lesson.query.filter(Lesson.lesson_date == datetime.now().date()).count()
+        if shard_map is not None:
+            today = datetime.now().date()
+            counts = shard_map.fan_out(lambda connection: [connection.execute(query).scalar() for query in (
+                select(func.count(Classroom.id)),
+                select(func.count(Lesson.id)),
+                select(func.count(Lesson.id)).where(Lesson.lesson_date == today),
+            )])
+            total_classrooms, total_lessons, busy_today = [sum(c) for c in zip(*counts.values())]
+        else:
+            total_classrooms = Classroom.query.count()
+            total_lessons = Lesson.query.count()
+            busy_today = Lesson.query.filter(Lesson.lesson_date == datetime.now().date()).count()
         
         stats = {
             'total_classrooms': total_classrooms,
@@ -147,7 +541,7 @@ def add_classroom():
                 flash('Заполните все обязательные поля!', 'danger')
                 return redirect(url_for('add_classroom'))
             
-            classroom = Classroom(
+            values = dict(
                 number=request.form['number'],
                 floor=int(request.form.get('floor', 1)),
                 building=request.form['building'],
@@ -160,8 +554,12 @@ def add_classroom():
                 computers_count=int(request.form.get('computers_count', 0))
             )
             
-            db.session.add(classroom)
-            db.session.commit()
+            if shard_map is not None:
+                _, classroom_id = sharding.add_classroom(shard_map, Classroom.__table__, values)
+                record_shard_changes('classroom', [(classroom_id, change_feed.UPSERT, dict(values, id=classroom_id))])
+            else:
+                run_write(lambda: db.session.add(Classroom(**values)))
+            fragments.bump('classrooms')
             flash('Аудитория успешно добавлена!', 'success')
             return redirect(url_for('classrooms'))
             
@@ -175,22 +573,37 @@ def add_classroom():
 @app.route('/classrooms/edit/<int:id>', methods=['GET', 'POST'])
 def edit_classroom(id):
     """Редактирование аудитории"""
-    classroom = Classroom.query.get_or_404(id)
+    classroom = shard_classroom(id) if shard_map is not None else Classroom.query.get_or_404(id)
     
     if request.method == 'POST':
         try:
-            classroom.number = request.form['number']
-            classroom.floor = int(request.form['floor'])
-            classroom.building = request.form['building']
-            classroom.capacity = int(request.form['capacity'])
-            classroom.area = float(request.form['area'])
-            classroom.has_projector = 'has_projector' in request.form
-            classroom.has_computers = 'has_computers' in request.form
-            classroom.has_board = 'has_board' in request.form
-            classroom.has_air_conditioner = 'has_air_conditioner' in request.form
-            classroom.computers_count = int(request.form.get('computers_count', 0))
+            values = dict(
+                number=request.form['number'],
+                floor=int(request.form['floor']),
+                building=request.form['building'],
+                capacity=int(request.form['capacity']),
+                area=float(request.form['area']),
+                has_projector='has_projector' in request.form,
+                has_computers='has_computers' in request.form,
+                has_board='has_board' in request.form,
+                has_air_conditioner='has_air_conditioner' in request.form,
+                computers_count=int(request.form.get('computers_count', 0))
+            )
             
-            db.session.commit()
+            def write():
+                target = db.session.get(Classroom, id)
+                for field, value in values.items():
+                    setattr(target, field, value)
+            
+            if shard_map is None:
+                run_write(write)
+            elif sharding.update_classroom(shard_map, Classroom.__table__, [Lesson.__table__, ArchivedLesson.__table__],
+                                           id, values) == 'busy':
+                flash('Нельзя перенести в корпус другого шарда аудиторию, в которой есть занятия!', 'warning')
+                return redirect(url_for('edit_classroom', id=id))
+            else:
+                record_shard_changes('classroom', [(id, change_feed.UPSERT, dict(values, id=id))])
+            fragments.bump('classrooms')
             flash('Аудитория успешно обновлена!', 'success')
             return redirect(url_for('classrooms'))
             
@@ -204,16 +617,26 @@ def edit_classroom(id):
 @app.route('/classrooms/delete/<int:id>')
 def delete_classroom(id):
     """Удаление аудитории"""
-    classroom = Classroom.query.get_or_404(id)
+    if shard_map is not None:
+        return delete_sharded_classroom(id)
+    Classroom.query.get_or_404(id)
     
-    # Проверяем, есть ли занятия в этой аудитории
-    if classroom.lessons:
-        flash('Нельзя удалить аудиторию, в которой есть занятия!', 'warning')
-        return redirect(url_for('classrooms'))
+    def write():
+        # Проверяем, есть ли занятия в этой аудитории (в том числе в архиве), не загружая их
+        has_lessons = db.session.query(
+            Lesson.query.filter_by(classroom_id=id).exists()
+            | ArchivedLesson.query.filter_by(classroom_id=id).exists()
+        ).scalar()
+        if has_lessons:
+            return False
+        db.session.delete(db.session.get(Classroom, id))
+        return True
     
     try:
-        db.session.delete(classroom)
-        db.session.commit()
+        if not run_write(write):
+            flash('Нельзя удалить аудиторию, в которой есть занятия!', 'warning')
+            return redirect(url_for('classrooms'))
+        fragments.bump('classrooms')
         flash('Аудитория успешно удалена!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -222,6 +645,76 @@ def delete_classroom(id):
     return redirect(url_for('classrooms'))
 
 
+def delete_sharded_classroom(id):
+    """Удаление аудитории в её шарде (проверка занятий — там же)"""
+    try:
+        status = sharding.delete_classroom(shard_map, Classroom.__table__,
+                                           [Lesson.__table__, ArchivedLesson.__table__], id)
+    except Exception as e:
+        flash(f'Ошибка при удалении: {str(e)}', 'danger')
+        return redirect(url_for('classrooms'))
+    
+    if status == 'not_found':
+        abort(404)
+    if status == 'busy':
+        flash('Нельзя удалить аудиторию, в которой есть занятия!', 'warning')
+        return redirect(url_for('classrooms'))
+    record_shard_changes('classroom', [(id, change_feed.DELETE, None)])
+    fragments.bump('classrooms')
+    flash('Аудитория успешно удалена!', 'success')
+    return redirect(url_for('classrooms'))
+
+
+@app.route('/api/classrooms/batch', methods=['POST'])
+def batch_classrooms():
+    """
+    API пакетного изменения аудиторий: создания, обновления и удаления в одной
+    транзакции (см. classroom_batch.py). Возвращает результат по каждой операции.
+    При atomic=true пакет с хотя бы одной ошибкой не применяется целиком.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        creates, updates, deletes, results = classroom_batch.validate(data.get('operations'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    atomic = bool(data.get('atomic'))
+    if atomic and results:
+        return jsonify({'applied': False, 'results': results}), 400
+
+    def write():
+        connection = db.session.connection()
+        applied, changes = classroom_batch.apply(
+            connection, Classroom.__table__, [Lesson.__table__, ArchivedLesson.__table__],
+            creates, updates, deletes
+        )
+        merged = sorted(results + applied, key=lambda r: r['index'])
+        if atomic and any(r['status'] in ('error', 'not_found') for r in merged):
+            raise classroom_batch.BatchRejected(merged)
+        change_feed.record(connection, ChangeLog.__table__, 'classroom', changes)
+        return merged, bool(changes)
+
+    try:
+        if shard_map is not None:
+            applied, changes = sharding.apply_batch(
+                shard_map, Classroom.__table__, [Lesson.__table__, ArchivedLesson.__table__],
+                creates, updates, deletes, atomic
+            )
+            record_shard_changes('classroom', changes)
+            results, changed = sorted(results + applied, key=lambda r: r['index']), bool(changes)
+        else:
+            results, changed = run_write(write)
+    except classroom_batch.BatchRejected as e:
+        return jsonify({'applied': False, 'results': e.results}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    # Кэши и производные данные обновляются один раз на пакет
+    if changed:
+        fragments.bump('classrooms')
+    return jsonify({'applied': True, 'results': results})
+
+
 # Расписание занятий
 @app.route('/schedule')
 def schedule():
@@ -232,12 +725,73 @@ def schedule():
     except ValueError:
         selected_date = datetime.now().date()
     
+    def load_lessons():
+        if shard_map is not None:
+            return [schedule_page_lesson(row) for row in sharded_schedule(selected_date, SCHEDULE_PAGE_FIELDS)]
+        lessons = []
+        for model in lesson_models(selected_date):
+            lessons += model.query.filter_by(lesson_date=selected_date).order_by(model.start_time).all()
+        lessons.sort(key=lambda l: l.start_time)
+        return lessons
+    
     try:
-        lessons = Lesson.query.filter_by(lesson_date=selected_date).order_by(Lesson.start_time).all()
-        return render_template('schedule.html', lessons=lessons, selected_date=selected_date)
+        # Запрос выполнится, только если таблица не взята из кэша фрагментов
+        return render_template('schedule.html', lessons=fragment_cache.Lazy(load_lessons), selected_date=selected_date)
     except Exception as e:
+        db.session.rollback()
         flash(f'Ошибка загрузки расписания: {str(e)}', 'danger')
-        return render_template('schedule.html', lessons=[], selected_date=selected_date)
+        return render_template('schedule.html', lessons=[], selected_date=selected_date, cache_disabled=True)
+
+
+def schedule_select(model, day, fields):
+    """Занятия дня; первая колонка — время начала для слияния моделей по порядку"""
+    return lesson_select(model, ['start_time'] + fields).where(model.lesson_date == day).order_by(model.start_time)
+
+
+def sharded_schedule(day, fields):
+    """Строки schedule_select из всех шардов (с архивом шарда, если день в нём), слитые по времени начала"""
+    def load(connection):
+        rows = []
+        for model in lesson_models(day, connection):
+            rows += connection.execute(schedule_select(model, day, fields)).all()
+        rows.sort(key=lambda row: row[0])
+        return rows
+    return sharding.merge_sorted(shard_map.fan_out(load).values(), key=lambda row: row[0])
+
+
+# Занятие страницы расписания из строки шарда: атрибуты, которые читает шаблон
+ScheduleRoom = namedtuple('ScheduleRoom', 'number building')
+ScheduleLesson = namedtuple('ScheduleLesson', 'start_time id end_time classroom group_name teacher_name subject_name')
+SCHEDULE_PAGE_FIELDS = ['id', 'end_time', 'classroom_number', 'classroom_building',
+                        'group_name', 'teacher_name', 'subject_name']
+
+
+def schedule_page_lesson(row):
+    start_time, lesson_id, end_time, number, building, *lesson_names = row
+    return ScheduleLesson(start_time, lesson_id, end_time, ScheduleRoom(number, building), *lesson_names)
+
+
+@app.route('/api/schedule')
+def schedule_api():
+    """API расписания на день: date=ГГГГ-ММ-ДД, fields= — какие поля вернуть"""
+    try:
+        selected_date = datetime.strptime(request.args.get('date', ''), '%Y-%m-%d').date()
+        fields = serialization.parse_fields(request.args.get('fields'), LESSON_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        if shard_map is not None:
+            rows = sharded_schedule(selected_date, fields)
+        else:
+            rows = []
+            for model in lesson_models(selected_date):
+                rows += db.session.execute(schedule_select(model, selected_date, fields)).all()
+            rows.sort(key=lambda row: row[0])
+        return serialization.json_response(
+            serialization.rows_to_dicts([row[1:] for row in rows], fields, LESSON_FORMATTERS))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 
 @app.route('/schedule/add', methods=['GET', 'POST'])
@@ -254,30 +808,52 @@ def add_lesson():
                 flash('Ошибка: Время начала должно быть меньше времени окончания!', 'warning')
                 return redirect(url_for('add_lesson'))
             
-            # Проверка на пересечение
-            conflicting = Lesson.query.filter(
-                Lesson.classroom_id == classroom_id,
-                Lesson.lesson_date == lesson_date,
-                Lesson.start_time < end_time,
-                Lesson.end_time > start_time
-            ).first()
+            names_form = {f: request.form[f] for f in ('group_name', 'teacher_name', 'subject_name')}
+            
+            def write():
+                # Проверки выполняются вместе с записью: между ними никто не займёт это время
+                if is_archived_date(lesson_date):
+                    return 'archived'
+                
+                # Проверка на пересечение
+                conflicting = Lesson.query.filter(
+                    Lesson.classroom_id == classroom_id,
+                    Lesson.lesson_date == lesson_date,
+                    Lesson.start_time < end_time,
+                    Lesson.end_time > start_time
+                ).first()
+                if conflicting:
+                    return 'conflict'
+                
+                db.session.add(Lesson(
+                    classroom_id=classroom_id,
+                    lesson_date=lesson_date,
+                    start_time=start_time,
+                    end_time=end_time,
+                    **names_form
+                ))
+                return 'added'
             
-            if conflicting:
+            if shard_map is not None:
+                values = dict(classroom_id=classroom_id, lesson_date=lesson_date,
+                              start_time=start_time, end_time=end_time, **names_form)
+                status, lesson_id = sharding.book_lesson(
+                    shard_map, Classroom.__table__, Lesson.__table__, ArchivedLesson.__table__,
+                    LESSON_DICTIONARY_TABLES, values)
+                if status == 'added':
+                    data = dict(values, id=lesson_id)
+                    data.update({f: lesson_dictionary.normalize_name(v) for f, v in names_form.items()})
+                    data.update({f: format_value(data[f]) for f, format_value in LESSON_FORMATTERS.items()})
+                    record_shard_changes('lesson', [(lesson_id, change_feed.UPSERT, data)])
+            else:
+                status = run_write(write)
+            if status == 'archived':
+                flash('Семестр с этой датой уже перенесён в архив!', 'warning')
+                return redirect(url_for('add_lesson'))
+            if status == 'conflict':
                 flash('Это время уже занято в выбранной аудитории!', 'warning')
                 return redirect(url_for('add_lesson'))
-            
-            lesson = Lesson(
-                classroom_id=classroom_id,
-                lesson_date=lesson_date,
-                start_time=start_time,
-                end_time=end_time,
-                group_name=request.form['group_name'],
-                teacher_name=request.form['teacher_name'],
-                subject_name=request.form['subject_name']
-            )
-            
-            db.session.add(lesson)
-            db.session.commit()
+            fragments.bump('lessons')
             flash('Занятие успешно добавлено!', 'success')
             return redirect(url_for('schedule'))
             
@@ -286,21 +862,36 @@ def add_lesson():
             flash(f'Ошибка при добавлении: {str(e)}', 'danger')
     
     try:
-        classrooms = Classroom.query.all()
+        # Список аудиторий загрузится, только если выпадающий список не взят из кэша
+        if shard_map is not None:
+            query = select(Classroom.id, Classroom.number, Classroom.building, Classroom.capacity)
+            classrooms = fragment_cache.Lazy(lambda: sharded_classroom_rows(query))
+        else:
+            classrooms = fragment_cache.Lazy(Classroom.query.all)
+        return render_template('add_lesson.html', classrooms=classrooms, today=datetime.now().date())
     except:
-        classrooms = []
-    return render_template('add_lesson.html', classrooms=classrooms, today=datetime.now().date())
+        db.session.rollback()
+        return render_template('add_lesson.html', classrooms=[], today=datetime.now().date(), cache_disabled=True)
 
 
 @app.route('/schedule/delete/<int:id>')
 def delete_lesson(id):
     """Удаление занятия"""
+    if shard_map is not None:
+        lesson_date = sharding.delete_lesson(shard_map, Lesson.__table__, id)
+        if lesson_date is None:
+            abort(404)
+        record_shard_changes('lesson', [(id, change_feed.DELETE, None)])
+        fragments.bump('lessons')
+        flash('Занятие успешно удалено!', 'success')
+        return redirect(url_for('schedule', date=lesson_date.strftime('%Y-%m-%d')))
+    
     lesson = Lesson.query.get_or_404(id)
     return_date = lesson.lesson_date.strftime('%Y-%m-%d')
     
     try:
-        db.session.delete(lesson)
-        db.session.commit()
+        run_write(lambda: db.session.delete(db.session.get(Lesson, id)))
+        fragments.bump('lessons')
         flash('Занятие успешно удалено!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -317,54 +908,406 @@ def search():
 
 
 @app.route('/api/search-free-classrooms', methods=['POST'])
+@admission_control.limit('search')
 def search_free_classrooms():
     """API для поиска свободных аудиторий"""
-    data = request.json
+    try:
+        params = parse_free_search(request.json, request.args.get('fields'))
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
     
     try:
-        search_date = datetime.strptime(data['date'], '%Y-%m-%d').date()
+        if params['start_time'] >= params['end_time']:
+            return jsonify({'error': 'Время начала должно быть меньше времени окончания'}), 400
+        
+        if shard_map is not None:
+            return serialization.json_response(sharded_free_search(params))
+        
+        if params['recommend']:
+            busy_ids = busy_classroom_ids(params['date'], params['start_time'], params['end_time'])
+            return serialization.json_response(recommend_items(room_index(), params, busy_ids))
+        
+        # Базовый запрос: только нужные колонки, без ORM-объектов
+        query = db.session.query(*[getattr(Classroom, f) for f in params['fields']]).filter(
+            *classroom_conditions(params))
+        
+        # Исключаем занятые аудитории в самом запросе (NOT EXISTS)
+        for model in lesson_models(params['date']):
+            query = query.filter(~busy_select(model, params['date'], params['start_time'], params['end_time'])
+                                 .where(model.classroom_id == Classroom.id).exists())
+        
+        rows = query.order_by(Classroom.id).all()
+        return serialization.json_response(serialization.rows_to_dicts(rows, params['fields']))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def sharded_free_search(params):
+    """
+    Поиск свободных аудиторий в шарде корпуса или во всех шардах параллельно;
+    архив шарда проверяется, если дата его задевает
+    """
+    day, start_time, end_time = params['date'], params['start_time'], params['end_time']
+    names = shard_map.shards_for(params['building'] or None)
+    
+    if params['recommend']:
+        def load(connection):
+            busy_ids = set()
+            for model in lesson_models(day, connection):
+                busy_ids.update(connection.execute(busy_select(model, day, start_time, end_time)).scalars())
+            return connection.execute(room_index_select()).all(), busy_ids
+        results = list(shard_map.fan_out(load, names).values())
+        rows = [row for shard_rows, _ in results for row in shard_rows]
+        busy_ids = set().union(*(ids for _, ids in results))
+        return recommend_items(room_ranking.RoomIndex(rows), params, busy_ids)
+    
+    def search(connection):
+        query = select(Classroom.id, *[getattr(Classroom, f) for f in params['fields']]).where(
+            *classroom_conditions(params))
+        for model in lesson_models(day, connection):
+            query = query.where(~busy_select(model, day, start_time, end_time)
+                                .where(model.classroom_id == Classroom.id).exists())
+        return connection.execute(query.order_by(Classroom.id)).all()
+    
+    rows = sharding.merge_sorted(shard_map.fan_out(search, names).values(), key=lambda row: row[0])
+    return serialization.rows_to_dicts([row[1:] for row in rows], params['fields'])
+
+
+def sharded_rows(query):
+    """Строки упорядоченного по id аудитории запроса из всех шардов, слитые в один список"""
+    results = shard_map.fan_out(lambda connection: connection.execute(query.add_columns(Classroom.id)).all())
+    return [row[:-1] for row in sharding.merge_sorted(results.values(), key=lambda row: row[-1])]
+
+
+def read_rows(query):
+    """Строки упорядоченного по id аудитории запроса: из всех шардов или из общей БД"""
+    return sharded_rows(query) if shard_map is not None else db.session.execute(query).all()
+
+
+def sharded_classroom_rows(query):
+    """Строки запроса по аудиториям с первой колонкой id из всех шардов по порядку id (с именами колонок)"""
+    query = query.order_by(Classroom.id)
+    results = shard_map.fan_out(lambda connection: connection.execute(query).all())
+    return sharding.merge_sorted(results.values(), key=lambda row: row[0])
+
+
+def parse_free_search(data, fields_arg=None):
+    """Параметры поиска свободных аудиторий из JSON запроса (общие для WSGI и ASGI)"""
+    return {
+        'date': datetime.strptime(data['date'], '%Y-%m-%d').date(),
+        'start_time': datetime.strptime(data['start_time'], '%H:%M').time(),
+        'end_time': datetime.strptime(data['end_time'], '%H:%M').time(),
+        'min_capacity': int(data.get('min_capacity', 0)),
+        'building': data.get('building', ''),
+        'has_projector': data.get('has_projector', False),
+        'has_computers': data.get('has_computers', False),
+        'fields': serialization.parse_fields(data.get('fields') or fields_arg, CLASSROOM_FIELDS),
+        'recommend': bool(data.get('recommend', False)),
+        'top_k': min(max(int(data.get('top_k', 5)), 1), 100),
+        'preferred_building': data.get('preferred_building') or None,
+        'preferred_floor': int(data['preferred_floor']) if data.get('preferred_floor') not in (None, '') else None,
+    }
+
+
+def classroom_conditions(params):
+    """Условия отбора аудиторий по вместимости, корпусу и оборудованию"""
+    conditions = []
+    if params['min_capacity'] > 0:
+        conditions.append(Classroom.capacity >= params['min_capacity'])
+    if params['building']:
+        conditions.append(Classroom.building == params['building'])
+    if params['has_projector']:
+        conditions.append(Classroom.has_projector == True)
+    if params['has_computers']:
+        conditions.append(Classroom.has_computers == True)
+    return conditions
+
+
+def busy_select(model, search_date, start_time, end_time):
+    """Запрос id аудиторий с занятиями, пересекающими промежуток времени"""
+    return select(model.classroom_id).where(
+        model.lesson_date == search_date,
+        model.start_time < end_time,
+        model.end_time > start_time
+    )
+
+
+def recommend_items(index, params, busy_ids):
+    """Режим подбора: лучшие top_k аудиторий по оценке соответствия"""
+    required = [flag for flag in ('has_projector', 'has_computers') if params[flag]]
+    ranked, _ = room_ranking.recommend(
+        index, params['min_capacity'], busy_ids, params['top_k'],
+        required=required, building=params['building'] or None,
+        preferred_building=params['preferred_building'], preferred_floor=params['preferred_floor']
+    )
+    result = []
+    for score, details, room in ranked:
+        item = {f: getattr(room, f) for f in params['fields']}
+        item['fit_score'] = round(score, 3)
+        item['fit'] = details
+        result.append(item)
+    return result
+
+
+@app.route('/api/search-recurring-free-classrooms', methods=['POST'])
+@admission_control.limit('search')
+def search_recurring_free_classrooms():
+    """
+    API поиска аудиторий, свободных в повторяющееся окно: дни недели weekdays
+    (Пн=0 … Вс=6) с date_from по date_to, время start_time–end_time.
+    min_free_percent < 100 добавляет аудитории, свободные не реже чем в этой
+    доле повторений, с датами конфликтов.
+    """
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        date_from = datetime.strptime(data['date_from'], '%Y-%m-%d').date()
+        date_to = datetime.strptime(data['date_to'], '%Y-%m-%d').date()
+        weekdays = recurring_search.parse_weekdays(data.get('weekdays'))
         start_time = datetime.strptime(data['start_time'], '%H:%M').time()
         end_time = datetime.strptime(data['end_time'], '%H:%M').time()
         min_capacity = int(data.get('min_capacity', 0))
         building = data.get('building', '')
         has_projector = data.get('has_projector', False)
         has_computers = data.get('has_computers', False)
+        min_free_percent = float(data.get('min_free_percent', 100))
+        fields = serialization.parse_fields(data.get('fields') or request.args.get('fields'), CLASSROOM_FIELDS)
+    except KeyError as e:
+        return jsonify({'error': f'Не указан параметр {e.args[0]}'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if start_time >= end_time:
+        return jsonify({'error': 'Время начала должно быть меньше времени окончания'}), 400
+    if date_from > date_to:
+        return jsonify({'error': 'Начало периода должно быть не позже его окончания'}), 400
+    if (date_to - date_from).days >= recurring_search.MAX_RANGE_DAYS:
+        return jsonify({'error': 'Период поиска не может быть длиннее года'}), 400
+    if not 0 < min_free_percent <= 100:
+        return jsonify({'error': 'min_free_percent должен быть от 0 до 100'}), 400
+    
+    try:
+        days = recurring_search.occurrences(date_from, date_to, weekdays)
         
-        if start_time >= end_time:
-            return jsonify({'error': 'Время начала должно быть меньше времени окончания'}), 400
-        
-        # Базовый запрос
-        query = Classroom.query
-        
+        room_query = select(Classroom.id, *[getattr(Classroom, f) for f in fields])
         if min_capacity > 0:
-            query = query.filter(Classroom.capacity >= min_capacity)
-        
+            room_query = room_query.where(Classroom.capacity >= min_capacity)
         if building:
-            query = query.filter(Classroom.building == building)
-        
+            room_query = room_query.where(Classroom.building == building)
         if has_projector:
-            query = query.filter(Classroom.has_projector == True)
-        
+            room_query = room_query.where(Classroom.has_projector == True)
         if has_computers:
-            query = query.filter(Classroom.has_computers == True)
+            room_query = room_query.where(Classroom.has_computers == True)
         
-        all_classrooms = query.all()
-        
-        # Находим занятые аудитории
-        busy_classroom_ids = db.session.query(Lesson.classroom_id).filter(
-            Lesson.lesson_date == search_date,
-            Lesson.start_time < end_time,
-            Lesson.end_time > start_time
-        ).all()
+        def load(connection):
+            rooms = {row[0]: row[1:] for row in connection.execute(room_query.order_by(Classroom.id))}
+            # Один запрос по диапазону дат на таблицу занятий вместо запроса на каждую дату
+            busy_rows = []
+            if days and rooms:
+                for model in lesson_models(date_from, connection):
+                    busy_rows += connection.execute(select(model.classroom_id, model.lesson_date).where(
+                        model.lesson_date >= date_from,
+                        model.lesson_date <= date_to,
+                        model.lesson_date.in_(days),
+                        model.start_time < end_time,
+                        model.end_time > start_time
+                    ).distinct()).all()
+            return rooms, busy_rows
         
-        busy_ids = [c[0] for c in busy_classroom_ids]
+        if shard_map is not None:
+            # id аудиторий уникальны во всех шардах: аудитории и их занятия объединяются
+            rooms, busy_rows = {}, []
+            results = shard_map.fan_out(load, shard_map.shards_for(building or None))
+            for shard_rooms, shard_busy_rows in results.values():
+                rooms.update(shard_rooms)
+                busy_rows += shard_busy_rows
+        else:
+            rooms, busy_rows = load(db.session)
         
-        # Свободные аудитории
-        free_classrooms = [c for c in all_classrooms if c.id not in busy_ids]
-        result = [c.to_dict() for c in free_classrooms]
+        found = recurring_search.availability(
+            rooms, recurring_search.clash_dates(busy_rows), len(days), min_free_percent
+        )
+        found.sort(key=lambda item: (-item[1], item[0]))
         
-        return jsonify(result)
+        result = []
+        for room_id, free, clashes in found:
+            item = dict(zip(fields, rooms[room_id]))
+            item['free_count'] = free
+            item['free_percent'] = round(free * 100 / len(days), 1)
+            item['clash_dates'] = [serialization.format_date(day) for day in clashes]
+            result.append(item)
         
+        return serialization.json_response({
+            'occurrences': [serialization.format_date(day) for day in days],
+            'classrooms': result
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def busy_classroom_ids(search_date, start_time, end_time):
+    """id аудиторий, занятых в указанный промежуток времени"""
+    busy_ids = set()
+    for model in lesson_models(search_date):
+        busy_ids.update(db.session.execute(busy_select(model, search_date, start_time, end_time)).scalars())
+    return busy_ids
+
+
+_room_index = {'version': None, 'index': None}
+_room_index_lock = threading.Lock()
+
+
+def room_index_version_select():
+    """
+    Версия аудиторий в БД: число строк, наибольший id и последняя запись журнала
+    изменений аудиторий. Одна и та же во всех процессах, меняется при любой
+    записи через ORM или пакетный API и при вставке/удалении строк в обход них.
+    """
+    return select(
+        select(func.count(Classroom.id)).scalar_subquery(),
+        select(func.max(Classroom.id)).scalar_subquery(),
+        select(func.max(ChangeLog.id)).where(ChangeLog.entity == 'classroom').scalar_subquery(),
+    )
+
+
+def room_index(rows=None, version=None):
+    """
+    Индекс аудиторий, отсортированный по вместимости. Перестраивается, только
+    когда меняется версия аудиторий в БД (room_index_version_select).
+    rows и version — уже выбранные вызывающим строки room_index_select() и версия.
+    """
+    if version is None:
+        version = tuple(db.session.execute(room_index_version_select()).one())
+    with _room_index_lock:
+        if _room_index['index'] is None or _room_index['version'] != version:
+            if rows is None:
+                rows = db.session.execute(room_index_select()).all()
+            _room_index['index'] = room_ranking.RoomIndex(rows)
+            _room_index['version'] = version
+        return _room_index['index']
+
+
+def room_index_select():
+    return select(*[getattr(Classroom, f) for f in CLASSROOM_FIELDS])
+
+
+def cached_room_index(version):
+    """Индекс аудиторий из кэша или None, если он построен для другой версии"""
+    with _room_index_lock:
+        if _room_index['index'] is not None and _room_index['version'] == version:
+            return _room_index['index']
+    return None
+
+
+# Поиск занятий по преподавателю, группе и дисциплине
+@app.route('/api/lessons/search')
+@admission_control.limit('search')
+def search_lessons():
+    """
+    API для поиска занятий по преподавателю, группе и дисциплине в диапазоне дат.
+    by=teacher,group,subject — где искать, fields= — какие поля вернуть.
+    Прежняя форма fields=teacher,group,subject (где искать) по-прежнему
+    принимается: имена областей поиска не совпадают с полями занятия.
+    """
+    try:
+        by, fields = request.args.get('by'), request.args.get('fields')
+        if by is None and fields and all(f.strip() in lesson_search.SEARCH_FIELDS for f in fields.split(',')):
+            by, fields = fields, None
+        search_fields = serialization.parse_fields(by, lesson_search.SEARCH_FIELDS)
+        fields = serialization.parse_fields(fields, LESSON_FIELDS)
+        mode = request.args.get('mode', 'prefix')
+        if mode not in ('prefix', 'fuzzy'):
+            return jsonify({'error': 'Режим поиска должен быть prefix или fuzzy'}), 400
+        date_from = request.args.get('date_from')
+        date_to = request.args.get('date_to')
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None
+        limit = min(int(request.args.get('limit', 50)), 500)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = request.args.get('q', '')
+    
+    def search(connection):
+        # Колонки сортировки (дата, время начала, id) идут первыми — по ним сливаются шарды
+        models = lesson_models(date_from, connection)
+        ids = lesson_search.search_lesson_ids(
+            connection, query, fields=search_fields, mode=mode,
+            date_from=date_from, date_to=date_to, limit=limit,
+            include_archive=ArchivedLesson in models
+        )
+        rows = []
+        if ids:
+            for model in models:
+                rows += connection.execute(lesson_select(model, ['lesson_date', 'start_time', 'id'] + fields)
+                                           .where(model.id.in_(ids))).all()
+        rows.sort(key=lambda row: tuple(row[:3]))
+        return rows
+
+    try:
+        if shard_map is not None:
+            rows = sharding.merge_sorted(shard_map.fan_out(search).values(), key=lambda row: tuple(row[:3]))[:limit]
+        else:
+            rows = search(db.session)
+        return serialization.json_response(
+            serialization.rows_to_dicts([row[3:] for row in rows], fields, LESSON_FORMATTERS))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/lessons/suggest')
+@admission_control.limit('search')
+def suggest_lessons():
+    """API автодополнения: преподаватели, группы или дисциплины по началу строки"""
+    field = request.args.get('field', 'teacher')
+    mode = request.args.get('mode', 'prefix')
+    if field not in lesson_search.SEARCH_FIELDS:
+        return jsonify({'error': 'Поле должно быть teacher, group или subject'}), 400
+    if mode not in ('prefix', 'fuzzy'):
+        return jsonify({'error': 'Режим поиска должен быть prefix или fuzzy'}), 400
+
+    try:
+        limit = min(int(request.args.get('limit', 10)), 50)
+        query = request.args.get('q', '')
+        if shard_map is not None:
+            # Справочники шардов пополняются независимо: подсказки объединяются без повторов
+            results = shard_map.fan_out(
+                lambda connection: lesson_search.matching_names(connection, field, query, mode))
+            return jsonify(lesson_search.merge_suggestions(results.values(), query, mode=mode, limit=limit))
+        return jsonify(lesson_search.suggest(db.session, query, field, mode=mode, limit=limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/changes')
+def get_changes():
+    """
+    API инкрементальной синхронизации: изменения после курсора since по порядку.
+    Клиент применяет changes и повторяет запрос с cursor, пока has_more.
+    Если курсор старше границы сжатия журнала — 410 и resync_required:
+    клиент загружает данные целиком и продолжает с возвращённого cursor.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+        limit = min(int(request.args.get('limit', 500)), 5000)
+        if since < 0 or limit < 1:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'since и limit должны быть неотрицательными целыми числами'}), 400
+
+    try:
+        connection = db.session.connection()
+        result = change_feed.read_changes(
+            connection, ChangeLog.__table__, ChangeLogMeta.__table__, since, limit=limit
+        )
+        if result.get('resync_required'):
+            return serialization.json_response(result, status=410)
+        return serialization.json_response(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -376,56 +1319,75 @@ def reports():
     return render_template('reports.html')
 
 
+def occupancy_rate(lessons_count):
+    """Условная загруженность: 40 занятий — 100%"""
+    return min(round((lessons_count / 40) * 100, 1), 100)
+
+
+REPORT_TYPES = ('occupancy', 'equipment')
+
+
+def build_report(report_type):
+    """Построение отчёта в CSV: (имя файла, содержимое в UTF-8 с BOM)"""
+    if report_type not in REPORT_TYPES:
+        raise ValueError('Неверный тип отчёта')
+    
+    # Создаем CSV файл в памяти
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';', quoting=csv.QUOTE_MINIMAL)
+    
+    if report_type == 'occupancy':
+        # Отчёт по загруженности: число занятий по всем аудиториям одним запросом
+        writer.writerow(['Аудитория', 'Корпус', 'Этаж', 'Вместимость', 'Кол-во занятий', 'Загруженность (%)'])
+        
+        counts = select(
+            Lesson.classroom_id, func.count(Lesson.id).label('lessons_count')
+        ).group_by(Lesson.classroom_id).subquery()
+        rows = read_rows(select(
+            Classroom.number, Classroom.building, Classroom.floor, Classroom.capacity,
+            func.coalesce(counts.c.lessons_count, 0)
+        ).outerjoin(counts, counts.c.classroom_id == Classroom.id).order_by(Classroom.id))
+        
+        for number, building, floor, capacity, lessons_count in rows:
+            writer.writerow([
+                number, building, floor, capacity,
+                lessons_count, f"{occupancy_rate(lessons_count)}%"
+            ])
+        
+    else:
+        # Отчёт по оборудованию
+        writer.writerow(['Аудитория', 'Корпус', 'Проектор', 'Компьютеры', 'Доска', 'Кондиционер'])
+        
+        rows = read_rows(select(
+            Classroom.number, Classroom.building, Classroom.has_projector, Classroom.has_computers,
+            Classroom.computers_count, Classroom.has_board, Classroom.has_air_conditioner
+        ).order_by(Classroom.id))
+        for number, building, has_projector, has_computers, computers_count, has_board, has_air_conditioner in rows:
+            writer.writerow([
+                number, building,
+                'Да' if has_projector else 'Нет',
+                f'{computers_count} шт.' if has_computers else 'Нет',
+                'Да' if has_board else 'Нет',
+                'Да' if has_air_conditioner else 'Нет'
+            ])
+    
+    filename = f'{report_type}_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    return filename, output.getvalue().encode('utf-8-sig')
+
+
 @app.route('/api/generate-report')
+@admission_control.limit('reports')
 def generate_report():
     """Генерация отчёта в CSV"""
     report_type = request.args.get('type', 'occupancy')
+    if report_type not in REPORT_TYPES:
+        return jsonify({'error': 'Неверный тип отчёта'}), 400
     
     try:
-        # Создаем CSV файл в памяти
-        output = io.StringIO()
-        writer = csv.writer(output, delimiter=';', quoting=csv.QUOTE_MINIMAL)
-        
-        if report_type == 'occupancy':
-            # Отчёт по загруженности
-            writer.writerow(['Аудитория', 'Корпус', 'Этаж', 'Вместимость', 'Кол-во занятий', 'Загруженность (%)'])
-            
-            classrooms = Classroom.query.all()
-            for c in classrooms:
-                lessons_count = Lesson.query.filter_by(classroom_id=c.id).count()
-                occupancy_rate = min(round((lessons_count / 40) * 100, 1), 100)
-                
-                writer.writerow([
-                    c.number, c.building, c.floor, c.capacity, 
-                    lessons_count, f"{occupancy_rate}%"
-                ])
-            
-            filename = f'occupancy_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-            
-        elif report_type == 'equipment':
-            # Отчёт по оборудованию
-            writer.writerow(['Аудитория', 'Корпус', 'Проектор', 'Компьютеры', 'Доска', 'Кондиционер'])
-            
-            classrooms = Classroom.query.all()
-            for c in classrooms:
-                writer.writerow([
-                    c.number, c.building,
-                    'Да' if c.has_projector else 'Нет',
-                    f'{c.computers_count} шт.' if c.has_computers else 'Нет',
-                    'Да' if c.has_board else 'Нет',
-                    'Да' if c.has_air_conditioner else 'Нет'
-                ])
-            
-            filename = f'equipment_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-        
-        else:
-            return jsonify({'error': 'Неверный тип отчёта'}), 400
-        
-        # Подготавливаем файл для отправки
-        output.seek(0)
+        filename, data = build_report(report_type)
         
         return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8-sig')),
+            io.BytesIO(data),
             download_name=filename,
             as_attachment=True,
             mimetype='text/csv'
@@ -436,51 +1398,296 @@ def generate_report():
         return redirect(url_for('reports'))
 
 
+# Фоновые отчёты
+def run_report_job(report_type):
+    """
+    Построение отчёта в потоке пула: собственный контекст приложения и сессия БД.
+    Соединение берётся только после получения места в пуле допуска reports.
+    """
+    with admission_control.slot('reports'), app.app_context():
+        return build_report(report_type)
+
+
+def _job_status(job):
+    return {
+        'id': job['id'],
+        'status': job['status'],
+        'error': job['error'],
+        'filename': job['filename'],
+        'status_url': url_for('report_job_status', job_id=job['id']),
+        'download_url': url_for('report_job_download', job_id=job['id']) if job['status'] == report_jobs.DONE else None,
+    }
+
+
+@app.route('/api/reports/jobs', methods=['POST'])
+@admission_control.limit('reports')
+def submit_report_job():
+    """API постановки отчёта в фоновую очередь; одинаковые запросы объединяются в одну задачу"""
+    data = request.get_json(silent=True) or request.form
+    report_type = data.get('type', 'occupancy')
+    if report_type not in REPORT_TYPES:
+        return jsonify({'error': 'Неверный тип отчёта'}), 400
+    
+    try:
+        job = report_queue.submit({'report_type': report_type}, run_report_job)
+        return jsonify(_job_status(job)), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/reports/jobs/<job_id>')
+def report_job_status(job_id):
+    """API статуса фоновой задачи отчёта"""
+    job = report_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена или срок хранения результата истёк'}), 404
+    return jsonify(_job_status(job))
+
+
+@app.route('/api/reports/jobs/<job_id>/download')
+def report_job_download(job_id):
+    """Скачивание результата готовой фоновой задачи"""
+    job = report_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена или срок хранения результата истёк'}), 404
+    if job['status'] != report_jobs.DONE:
+        return jsonify(_job_status(job)), 409
+    
+    return send_file(
+        report_queue.result_path(job_id),
+        download_name=job['filename'],
+        as_attachment=True,
+        mimetype='text/csv'
+    )
+
+
 # API для предпросмотра
+def _flag(value):
+    return '✅' if value else '❌'
+
+
+OCCUPANCY_PREVIEW_FIELDS = ['number', 'building', 'capacity', 'lessons_count', 'occupancy_rate']
+OCCUPANCY_FORMATTERS = {'occupancy_rate': occupancy_rate}
+EQUIPMENT_PREVIEW_FIELDS = ['number', 'building', 'has_projector', 'computers_count', 'has_board', 'has_air_conditioner']
+EQUIPMENT_FORMATTERS = {'has_projector': _flag, 'has_board': _flag, 'has_air_conditioner': _flag}
+
+
 @app.route('/api/classrooms/occupancy-preview')
+@admission_control.limit('reports')
 def occupancy_preview():
     """API для предпросмотра отчёта по загруженности"""
     try:
-        classrooms = Classroom.query.all()
-        result = []
-        
-        for c in classrooms:
-            lessons_count = Lesson.query.filter_by(classroom_id=c.id).count()
-            occupancy_rate = min(round((lessons_count / 40) * 100, 1), 100)
-            
-            result.append({
-                'number': c.number,
-                'building': c.building,
-                'capacity': c.capacity,
-                'lessons_count': lessons_count,
-                'occupancy_rate': occupancy_rate
-            })
-        
-        return jsonify(result)
+        fields = serialization.parse_fields(request.args.get('fields'), OCCUPANCY_PREVIEW_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        query = occupancy_preview_select(fields)
+        rows = read_rows(query)
+        return serialization.json_response(serialization.rows_to_dicts(rows, fields, OCCUPANCY_FORMATTERS))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+def occupancy_preview_select(fields):
+    """Число занятий по всем аудиториям одним запросом с группировкой"""
+    counts = select(
+        Lesson.classroom_id, func.count(Lesson.id).label('lessons_count')
+    ).group_by(Lesson.classroom_id).subquery()
+    lessons_count = func.coalesce(counts.c.lessons_count, 0)
+    columns = {
+        'number': Classroom.number,
+        'building': Classroom.building,
+        'capacity': Classroom.capacity,
+        'lessons_count': lessons_count,
+        'occupancy_rate': lessons_count,
+    }
+    return select(*[columns[f] for f in fields]).select_from(Classroom).outerjoin(
+        counts, counts.c.classroom_id == Classroom.id
+    ).order_by(Classroom.id)
+
+
 @app.route('/api/classrooms/equipment-preview')
+@admission_control.limit('reports')
 def equipment_preview():
     """API для предпросмотра отчёта по оборудованию"""
     try:
-        classrooms = Classroom.query.all()
-        result = []
+        fields = serialization.parse_fields(request.args.get('fields'), EQUIPMENT_PREVIEW_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        query = equipment_preview_select(fields)
+        rows = read_rows(query)
+        return serialization.json_response(serialization.rows_to_dicts(rows, fields, EQUIPMENT_FORMATTERS))
         
-        for c in classrooms:
-            result.append({
-                'number': c.number,
-                'building': c.building,
-                'has_projector': '✅' if c.has_projector else '❌',
-                'computers_count': c.computers_count if c.has_computers else 0,
-                'has_board': '✅' if c.has_board else '❌',
-                'has_air_conditioner': '✅' if c.has_air_conditioner else '❌'
-            })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def equipment_preview_select(fields):
+    """Оборудование аудиторий; компьютеры считаются, только если они отмечены"""
+    columns = {
+        'number': Classroom.number,
+        'building': Classroom.building,
+        'has_projector': Classroom.has_projector,
+        'computers_count': case((Classroom.has_computers == True, Classroom.computers_count), else_=0),
+        'has_board': Classroom.has_board,
+        'has_air_conditioner': Classroom.has_air_conditioner,
+    }
+    return select(*[columns[f] for f in fields]).order_by(Classroom.id)
+
+
+_simulation_pool = {'executor': None}
+_simulation_pool_lock = threading.Lock()
+
+
+def simulation_executor():
+    """Пул процессов моделирования (создаётся при первом запросе) или None"""
+    workers = app.config['SIMULATION_WORKERS']
+    if workers <= 1:
+        return None
+    with _simulation_pool_lock:
+        if _simulation_pool['executor'] is None:
+            # spawn: дочерние процессы не наследуют потоки и соединения воркера
+            _simulation_pool['executor'] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _simulation_pool['executor']
+
+
+@atexit.register
+def shutdown_simulation_executor():
+    """Остановка пула процессов моделирования при завершении воркера"""
+    with _simulation_pool_lock:
+        executor, _simulation_pool['executor'] = _simulation_pool['executor'], None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+@app.route('/api/simulations/capacity', methods=['POST'])
+@admission_control.limit('reports')
+def simulate_capacity():
+    """
+    Моделирование «что если»: помещаются ли занятия семестра, содержащего date,
+    в фонд аудиторий, изменённый каждым из сценариев (поля — в capacity_simulation).
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        day = datetime.strptime(data['date'], '%Y-%m-%d').date() if data.get('date') else date.today()
+        raw_scenarios = data.get('scenarios')
+        if not isinstance(raw_scenarios, list) or not raw_scenarios:
+            raise ValueError('Нужен хотя бы один сценарий')
+        if len(raw_scenarios) > capacity_simulation.MAX_SCENARIOS:
+            raise ValueError(f'Не больше {capacity_simulation.MAX_SCENARIOS} сценариев за запрос')
+        scenarios = [capacity_simulation.parse_scenario(s, i) for i, s in enumerate(raw_scenarios)]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        term_start, term_end = lesson_archive.term_bounds(day)
+        
+        def load_lessons(connection):
+            rows = []
+            for model in lesson_models(term_start, connection):
+                rows += connection.execute(
+                    select(model.id, model.classroom_id, model.lesson_date, model.start_time, model.end_time)
+                    .where(model.lesson_date >= term_start, model.lesson_date < term_end)
+                ).all()
+            return rows
         
-        return jsonify(result)
+        if shard_map is not None:
+            rooms = capacity_simulation.make_rooms(sharded_classroom_rows(room_index_select()))
+            rows = [row for shard_rows in shard_map.fan_out(load_lessons).values() for row in shard_rows]
+        else:
+            rooms = capacity_simulation.make_rooms(db.session.execute(room_index_select()).all())
+            rows = load_lessons(db.session)
+        lessons = capacity_simulation.make_lessons(rows, rooms)
         
+        results = capacity_simulation.run(rooms, lessons, scenarios, term_start, term_end,
+                                          simulation_executor(), app.config['SIMULATION_WORKERS'])
+        return serialization.json_response({
+            'term_start': term_start.isoformat(),
+            'term_end': (term_end - timedelta(days=1)).isoformat(),
+            'scenarios': results,
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/reports/heatmap')
+@admission_control.limit('reports')
+def occupancy_heatmap():
+    """
+    API тепловой карты загруженности: аудитории (или корпуса) × день недели × слот времени.
+    Ответ компактный: подписи строк и плоский массив процентов загруженности
+    в порядке [строка][день недели][слот].
+    """
+    try:
+        date_from = datetime.strptime(request.args['date_from'], '%Y-%m-%d').date()
+        date_to_str = request.args.get('date_to')
+        date_to = datetime.strptime(date_to_str, '%Y-%m-%d').date() if date_to_str else date_from + timedelta(days=6)
+        group_by = request.args.get('group_by', 'room')
+        building = request.args.get('building', '')
+        slot_minutes = int(request.args.get('slot_minutes', 30))
+        day_start = datetime.strptime(request.args.get('day_start', '08:00'), '%H:%M')
+        day_end = datetime.strptime(request.args.get('day_end', '22:00'), '%H:%M')
+    except KeyError:
+        return jsonify({'error': 'Не указан параметр date_from'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    day_start_minutes = day_start.hour * 60 + day_start.minute
+    span_minutes = day_end.hour * 60 + day_end.minute - day_start_minutes
+    if date_from > date_to:
+        return jsonify({'error': 'Начало периода должно быть не позже его окончания'}), 400
+    if span_minutes <= 0:
+        return jsonify({'error': 'Время начала дня должно быть меньше времени окончания'}), 400
+    if group_by not in ('room', 'building'):
+        return jsonify({'error': 'Группировка должна быть room или building'}), 400
+    if not 5 <= slot_minutes <= span_minutes:
+        return jsonify({'error': 'Недопустимая длительность слота'}), 400
+
+    try:
+        room_query = select(Classroom.id, Classroom.number, Classroom.building)
+        if building:
+            room_query = room_query.where(Classroom.building == building)
+        room_query = room_query.order_by(Classroom.building, Classroom.floor, Classroom.number)
+        
+        def load_lessons(connection):
+            lessons = []
+            for model in lesson_models(date_from, connection):
+                lesson_query = select(
+                    model.classroom_id, model.lesson_date, model.start_time, model.end_time
+                ).where(model.lesson_date >= date_from, model.lesson_date <= date_to)
+                if building:
+                    lesson_query = lesson_query.join(Classroom, Classroom.id == model.classroom_id).where(
+                        Classroom.building == building)
+                lessons += connection.execute(lesson_query).all()
+            return lessons
+        
+        bounds = (day_start_minutes, span_minutes, slot_minutes)
+        if shard_map is not None:
+            names = shard_map.shards_for(building or None)
+            # Корпус целиком лежит в одном шарде: устойчивая сортировка по корпусу сохраняет порядок шарда
+            results = shard_map.fan_out(lambda connection: connection.execute(room_query).all(), names)
+            rooms = sorted((room for shard_rooms in results.values() for room in shard_rooms),
+                           key=lambda room: (room.building is not None, room.building or ''))
+            rows = heatmap.layout(rooms, group_by)
+            # Каждый шард раскладывает свои занятия по общим строкам карты, массивы складываются
+            minutes = sum(shard_map.fan_out(
+                lambda connection: heatmap.occupied_minutes(rows, load_lessons(connection), *bounds), names).values())
+            result = heatmap.report(rows, minutes, date_from, date_to, *bounds)
+        else:
+            rooms = db.session.execute(room_query).all()
+            result = heatmap.build(rooms, load_lessons(db.session), date_from, date_to, group_by, *bounds)
+        result.update({
+            'date_from': date_from.strftime('%Y-%m-%d'),
+            'date_to': date_to.strftime('%Y-%m-%d'),
+            'group_by': group_by,
+        })
+        return serialization.json_response(result)
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -500,11 +1707,24 @@ def check_conflict(classroom_id, lesson_date, start_time, end_time):
 
 # Инициализация базы данных
 def init_db():
-    """Создание таблиц и добавление тестовых данных"""
+    """
+    Создание таблиц и добавление тестовых данных. Выполняется однократной
+    командой `flask --app app init-db`, а не при каждом запуске сервера.
+    """
     with app.app_context():
         try:
             # Проверяем подключение
             db.create_all()
+            with db.engine.begin() as connection:
+                # Старые БД со строковыми колонками переводятся на справочники
+                lesson_dictionary.migrate(
+                    connection, [Lesson.__table__, ArchivedLesson.__table__], LESSON_DICTIONARY_TABLES
+                )
+                lesson_archive.setup_partitioning(connection, Lesson.__table__, ArchivedLesson.__table__)
+                lesson_search.ensure_index(connection)
+                # create_all не добавляет индексы в уже существующие таблицы
+                for index in ChangeLog.__table__.indexes:
+                    index.create(connection, checkfirst=True)
             print("✅ Таблицы созданы")
             
             # Проверяем, есть ли данные
@@ -569,16 +1789,77 @@ def init_db():
         return True
 
 
-if __name__ == '__main__':
-    print("=" * 60)
-    print("ЗАПУСК ПРИЛОЖЕНИЯ")
-    print("=" * 60)
-    
-    # Инициализация базы данных
-    if init_db():
-        print("\n" + "=" * 60)
-        print("🚀 Сервер запущен на http://127.0.0.1:5000")
-        print("=" * 60)
-        app.run(debug=True, host='127.0.0.1', port=5000)
-    else:
-        print("\n❌ Не удалось запустить приложение из-за ошибки инициализации БД")
\ No newline at end of file
+@app.cli.command('init-db')
+def init_db_command():
+    """Создание таблиц, миграции, поисковые индексы и тестовые данные"""
+    if not init_db():
+        sys.exit(1)
+
+
+def schema_ready():
+    """Созданы ли таблицы (одна дешёвая проверка перед запуском сервера разработки)"""
+    with app.app_context():
+        return inspect(db.engine).has_table(Classroom.__tablename__)
+
+
+# Служебные страницы
+@app.route('/admin/slow-queries')
+@admin_required
+def admin_slow_queries():
+    """Медленные запросы этого процесса по убыванию суммарного времени (format=json — в JSON)"""
+    shapes = slow_queries.stats()
+    if request.args.get('format') == 'json':
+        return serialization.json_response({
+            'threshold_ms': slow_queries.threshold_ms,
+            'shapes': shapes
+        })
+    return render_template('admin_slow_queries.html', shapes=shapes,
+                           threshold_ms=slow_queries.threshold_ms)
+
+
+@app.route('/admin/admission')
+@admin_required
+def admin_admission():
+    """Состояние пулов контроля допуска: занято, ждут, отклонено"""
+    return jsonify({'enabled': admission_control.enabled, 'pools': admission_control.stats()})
+
+
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    """Последние профили запросов; a= и b= — сравнение двух профилей (format=json — в JSON)"""
+    comparison = None
+    if request.args.get('a') and request.args.get('b'):
+        try:
+            a = profiler.get(int(request.args['a']))
+            b = profiler.get(int(request.args['b']))
+        except ValueError:
+            return jsonify({'error': 'Номер профиля должен быть числом'}), 400
+        if a is None or b is None:
+            return jsonify({'error': 'Профиль не найден'}), 404
+        comparison = request_profiler.diff(a, b)
+    profiles = profiler.recent()
+    if request.args.get('format') == 'json':
+        return serialization.json_response({'profiles': profiles, 'diff': comparison})
+    return render_template('admin_profiles.html', profiles=profiles, diff=comparison)
+
+
+@app.route('/admin/profiles/<int:profile_id>')
+@admin_required
+def admin_profile(profile_id):
+    """Дерево вызовов профиля с SQL, категории и самые затратные функции"""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Профиль не найден'}), 404
+    if request.args.get('format') == 'json':
+        return serialization.json_response(profile)
+    return render_template('admin_profile.html', profile=profile)
+
+
+@app.route('/admin/slow-queries/reset', methods=['POST'])
+@admin_required
+def reset_slow_queries():
+    """Сброс накопленной статистики медленных запросов"""
+    slow_queries.reset()
+    return jsonify({'success': True})
+
@@ -0,0 +1,270 @@
+"""
+Информационная система учёта аудиторного фонда
+Асинхронный путь чтения (ASGI)
+
+Самые нагруженные маршруты чтения — поиск свободных аудиторий, расписание
+дня и предпросмотры отчётов — обслуживаются асинхронно через asyncio-движок
+SQLAlchemy (aiosqlite для SQLite, asyncpg для PostgreSQL). Независимые
+запросы одного обращения идут параллельно на разных соединениях: отбор
+аудиторий, поиск занятых аудиторий и проверка архива не ждут друг друга.
+
+Запросы строятся теми же функциями, что и в синхронных маршрутах app.py,
+поэтому ответы совпадают. При шардировании по корпусам (SHARDS) маршруты
+читают шарды теми же функциями, что и app.py, в потоке: рассылка по шардам
+и так параллельна. Все остальные маршруты, в том числе записи, обслуживает
+прежнее приложение Flask, подключённое через WSGI-адаптер.
+
+Запуск: uvicorn asgi:application
+"""
+
+import asyncio
+import contextlib
+import gzip
+import math
+import time
+from datetime import datetime
+
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import exc, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+import app as flask_module
+import lesson_archive
+import serialization
+import sqlite_mode
+from app import (
+    app as flask_app, db, admission_control, slow_queries,
+    ArchivedLesson, Classroom, Lesson,
+    EQUIPMENT_FORMATTERS, EQUIPMENT_PREVIEW_FIELDS, LESSON_FIELDS, LESSON_FORMATTERS,
+    OCCUPANCY_FORMATTERS, OCCUPANCY_PREVIEW_FIELDS,
+    busy_select, cached_room_index, classroom_conditions, equipment_preview_select,
+    occupancy_preview_select, parse_free_search, read_rows, recommend_items, room_index,
+    room_index_select, room_index_version_select, schedule_select, sharded_free_search, sharded_schedule,
+)
+
+# Драйверы asyncio для диалектов синхронного движка
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+engine = None
+
+
+def async_url(url):
+    """URL синхронного движка с драйвером asyncio того же диалекта"""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'Нет асинхронного драйвера для {backend}')
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def create_engine():
+    with flask_app.app_context():
+        url = async_url(db.engine.url)
+    async_engine = create_async_engine(
+        url,
+        pool_size=flask_app.config['ASYNC_POOL_SIZE'],
+        pool_timeout=flask_app.config['ASYNC_POOL_TIMEOUT'],
+        pool_pre_ping=True,
+    )
+    if url.get_backend_name() == 'sqlite' and flask_app.config['SQLITE_PRODUCTION']:
+        sqlite_mode.configure_engine(async_engine.sync_engine)
+    slow_queries.install(async_engine.sync_engine)
+    return async_engine
+
+
+def sharded():
+    """Включено ли шардирование (карта шардов читается в момент запроса)"""
+    return flask_module.shard_map is not None
+
+
+async def fetch_all(statement):
+    async with engine.connect() as conn:
+        return (await conn.execute(statement)).all()
+
+
+async def fetch_ids(statement):
+    async with engine.connect() as conn:
+        return set((await conn.execute(statement)).scalars())
+
+
+async def needs_archive(day):
+    async with engine.connect() as conn:
+        return await conn.run_sync(lesson_archive.needs_archive, ArchivedLesson.__table__, day)
+
+
+def json_response(request, payload, status=200):
+    """Ответ JSON с тем же кодированием и сжатием, что и serialization.json_response"""
+    body = serialization.dumps(payload)
+    headers = {'Vary': 'Accept-Encoding'}
+    if (len(body) >= serialization.GZIP_MIN_SIZE
+            and serialization.accepts_gzip(request.headers.get('accept-encoding'))):
+        body = gzip.compress(body, compresslevel=serialization.GZIP_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, status_code=status, media_type='application/json', headers=headers)
+
+
+def error_response(status, message, retry_after=None):
+    payload = {'error': message}
+    headers = {}
+    if retry_after is not None:
+        payload['retry_after'] = retry_after
+        headers['Retry-After'] = str(retry_after)
+    return Response(serialization.dumps(payload), status_code=status,
+                    media_type='application/json', headers=headers)
+
+
+def limited(pool_name=None):
+    """
+    Контроль допуска тем же пулом, что и у синхронных маршрутов (без
+    pool_name — не ограничивается): частота на клиента (429), предел
+    одновременности и очередь ожидания (503 с Retry-After). Ожидание места
+    в очереди идёт в потоке, чтобы не останавливать цикл событий.
+    Нет свободного соединения движка за ASYNC_POOL_TIMEOUT — тоже 503.
+    """
+    def decorator(endpoint):
+        async def wrapper(request):
+            pool = admission_control.pools.get(pool_name)
+            if not admission_control.enabled:
+                pool = None
+            if pool is not None:
+                if pool.bucket is not None:
+                    wait = pool.bucket.take(request.client.host if request.client else 'unknown')
+                    if wait:
+                        pool.throttled += 1
+                        return error_response(429, 'Слишком много запросов, повторите позже', math.ceil(wait))
+                if not pool.limiter.try_acquire() and not await asyncio.to_thread(pool.limiter.acquire):
+                    pool.rejected += 1
+                    return error_response(503, 'Сервер перегружен, повторите позже', pool.retry_after())
+            started = time.monotonic()
+            try:
+                return await endpoint(request)
+            except exc.TimeoutError:
+                if pool is not None:
+                    pool.rejected += 1
+                return error_response(503, 'Сервер перегружен, повторите позже',
+                                      max(1, math.ceil(flask_app.config['ASYNC_POOL_TIMEOUT'])))
+            except Exception as e:
+                return error_response(500, str(e))
+            finally:
+                if pool is not None:
+                    pool.limiter.release()
+                    pool.observe(time.monotonic() - started)
+        return wrapper
+    return decorator
+
+
+@limited('search')
+async def search_free_classrooms(request):
+    """API для поиска свободных аудиторий (как POST /api/search-free-classrooms)"""
+    try:
+        params = parse_free_search(await request.json(), request.query_params.get('fields'))
+    except (KeyError, ValueError, TypeError) as e:
+        return error_response(400, str(e))
+    if params['start_time'] >= params['end_time']:
+        return error_response(400, 'Время начала должно быть меньше времени окончания')
+    if sharded():
+        return json_response(request, await asyncio.to_thread(sharded_free_search, params))
+
+    day, start_time, end_time = params['date'], params['start_time'], params['end_time']
+    version = index = None
+    if params['recommend']:
+        version = tuple((await fetch_all(room_index_version_select()))[0])
+        index = cached_room_index(version)
+    if not params['recommend']:
+        # Первая колонка — id: по ней отбрасываются занятые аудитории
+        rooms_query = select(Classroom.id, *[getattr(Classroom, f) for f in params['fields']]).where(
+            *classroom_conditions(params)).order_by(Classroom.id)
+    elif index is None:
+        rooms_query = room_index_select()
+    else:
+        rooms_query = None
+
+    # Отбор аудиторий, занятия текущих семестров и граница архива — параллельно
+    tasks = [fetch_ids(busy_select(Lesson, day, start_time, end_time)), needs_archive(day)]
+    if rooms_query is not None:
+        tasks.append(fetch_all(rooms_query))
+    busy_ids, archived, *rooms = await asyncio.gather(*tasks)
+    if archived:
+        busy_ids |= await fetch_ids(busy_select(ArchivedLesson, day, start_time, end_time))
+
+    if params['recommend']:
+        if index is None:
+            index = room_index(rooms[0], version)
+        return json_response(request, recommend_items(index, params, busy_ids))
+
+    rows = [row[1:] for row in rooms[0] if row[0] not in busy_ids]
+    return json_response(request, serialization.rows_to_dicts(rows, params['fields']))
+
+
+@limited()
+async def schedule(request):
+    """API расписания на день (как GET /api/schedule)"""
+    try:
+        day = datetime.strptime(request.query_params.get('date', ''), '%Y-%m-%d').date()
+        fields = serialization.parse_fields(request.query_params.get('fields'), LESSON_FIELDS)
+    except ValueError as e:
+        return error_response(400, str(e))
+    if sharded():
+        rows = await asyncio.to_thread(sharded_schedule, day, fields)
+        return json_response(request, serialization.rows_to_dicts(
+            [row[1:] for row in rows], fields, LESSON_FORMATTERS))
+
+    rows, archived = await asyncio.gather(
+        fetch_all(schedule_select(Lesson, day, fields)), needs_archive(day))
+    if archived:
+        rows += await fetch_all(schedule_select(ArchivedLesson, day, fields))
+    rows.sort(key=lambda row: row[0])
+    return json_response(request, serialization.rows_to_dicts(
+        [row[1:] for row in rows], fields, LESSON_FORMATTERS))
+
+
+@limited('reports')
+async def occupancy_preview(request):
+    """API для предпросмотра отчёта по загруженности"""
+    try:
+        fields = serialization.parse_fields(request.query_params.get('fields'), OCCUPANCY_PREVIEW_FIELDS)
+    except ValueError as e:
+        return error_response(400, str(e))
+    query = occupancy_preview_select(fields)
+    rows = await asyncio.to_thread(read_rows, query) if sharded() else await fetch_all(query)
+    return json_response(request, serialization.rows_to_dicts(rows, fields, OCCUPANCY_FORMATTERS))
+
+
+@limited('reports')
+async def equipment_preview(request):
+    """API для предпросмотра отчёта по оборудованию"""
+    try:
+        fields = serialization.parse_fields(request.query_params.get('fields'), EQUIPMENT_PREVIEW_FIELDS)
+    except ValueError as e:
+        return error_response(400, str(e))
+    query = equipment_preview_select(fields)
+    rows = await asyncio.to_thread(read_rows, query) if sharded() else await fetch_all(query)
+    return json_response(request, serialization.rows_to_dicts(rows, fields, EQUIPMENT_FORMATTERS))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(application):
+    global engine
+    engine = create_engine()
+    try:
+        yield
+    finally:
+        await engine.dispose()
+        engine = None
+
+
+routes = [
+    Route('/api/search-free-classrooms', search_free_classrooms, methods=['POST']),
+    Route('/api/schedule', schedule, methods=['GET']),
+    Route('/api/classrooms/occupancy-preview', occupancy_preview, methods=['GET']),
+    Route('/api/classrooms/equipment-preview', equipment_preview, methods=['GET']),
+    # Всё остальное, включая записи, — синхронное приложение Flask
+    Mount('/', app=WSGIMiddleware(flask_app)),
+]
+
+application = Starlette(routes=routes, lifespan=lifespan)
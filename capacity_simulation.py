@@ -0,0 +1,290 @@
+"""
+Информационная система учёта аудиторного фонда
+Моделирование аудиторного фонда «что если»
+
+Сценарий изменяет набор аудиторий (закрыть аудитории или корпус целиком,
+добавить новые, изменить вместимость), после чего занятия семестра заново
+раскладываются по изменённому фонду в памяти, не трогая таблицы БД:
+
+    * занятие остаётся в своей аудитории, если она есть в сценарии и
+      вмещает группу;
+    * остальные занятия (сначала самые большие) переносятся в лучшую
+      свободную аудиторию по оценке room_ranking с предпочтением прежнего
+      корпуса; если такой нет — занятие не размещено.
+
+Размер группы в БД не хранится: занятию нужна вместимость его нынешней
+аудитории, умноженная на seat_ratio сценария. Оборудование нынешней
+аудитории (проектор, компьютеры) обязательно, если keep_equipment.
+
+Сценарии и дни независимы: дни каждого сценария делятся на части, и части
+считаются параллельно на пуле процессов. Фонд сценария передаётся процессу
+один раз на часть, а не с каждым днём. Результат — число неразмещённых
+занятий и загрузка фонда.
+"""
+
+import math
+from collections import namedtuple
+from datetime import timedelta
+
+import room_ranking
+
+MAX_SCENARIOS = 50
+MAX_UNPLACEABLE = 100
+# Рабочий день аудитории для расчёта загрузки: 8:00–20:00, понедельник — суббота
+WORKDAY_MINUTES = 12 * 60
+TEACHING_WEEKDAYS = 6
+
+SCENARIO_KEYS = {'name', 'remove_rooms', 'remove_buildings', 'add_rooms', 'capacity',
+                 'seat_ratio', 'keep_equipment'}
+
+Room = namedtuple('Room', 'id number building floor capacity has_projector has_computers has_air_conditioner')
+SimLesson = namedtuple('SimLesson', 'id lesson_date start end classroom_id capacity required building')
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def make_rooms(rows):
+    """Аудитории из строк с атрибутами Classroom"""
+    return [Room(*(getattr(row, field) for field in Room._fields)) for row in rows]
+
+
+def make_lessons(rows, rooms):
+    """
+    Занятия из строк (id, classroom_id, lesson_date, start_time, end_time):
+    нужная вместимость и оборудование берутся из нынешней аудитории.
+    """
+    by_id = {room.id: room for room in rooms}
+    lessons = []
+    for row in rows:
+        room = by_id.get(row.classroom_id)
+        if room is None:
+            continue
+        required = tuple(flag for flag in ('has_projector', 'has_computers') if getattr(room, flag))
+        lessons.append(SimLesson(row.id, row.lesson_date, _minutes(row.start_time), _minutes(row.end_time),
+                                 row.classroom_id, room.capacity or 0, required, room.building))
+    return lessons
+
+
+def _list_field(data, key, position, check, expected):
+    """Поле-список сценария, каждый элемент которого проходит check; ValueError иначе"""
+    value = data.get(key)
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(check(item) for item in value):
+        raise ValueError(f'Некорректный сценарий {position + 1}: {key} должен быть списком {expected}')
+    return value
+
+
+def parse_scenario(data, position=0):
+    """Сценарий из JSON с проверкой; ValueError при ошибке"""
+    if not isinstance(data, dict):
+        raise ValueError('Сценарий должен быть объектом')
+    unknown = set(data) - SCENARIO_KEYS
+    if unknown:
+        raise ValueError(f'Неизвестные поля сценария: {", ".join(sorted(unknown))}')
+    remove_rooms = _list_field(data, 'remove_rooms', position,
+                               lambda item: isinstance(item, int) and not isinstance(item, bool), 'id аудиторий')
+    remove_buildings = _list_field(data, 'remove_buildings', position,
+                                   lambda item: isinstance(item, str), 'названий корпусов')
+    add_rooms = _list_field(data, 'add_rooms', position, lambda item: isinstance(item, dict), 'объектов аудиторий')
+    try:
+        seat_ratio = float(data.get('seat_ratio', 1.0))
+        capacity = {int(room_id): int(seats) for room_id, seats in (data.get('capacity') or {}).items()}
+        added = []
+        for i, room in enumerate(add_rooms):
+            added.append(Room(
+                id=-(i + 1), number=str(room.get('number') or f'new-{i + 1}'), building=room.get('building'),
+                floor=room.get('floor'), capacity=int(room['capacity']),
+                has_projector=bool(room.get('has_projector', False)),
+                has_computers=bool(room.get('has_computers', False)),
+                has_air_conditioner=bool(room.get('has_air_conditioner', False)),
+            ))
+        scenario = {
+            'name': str(data.get('name') or f'Сценарий {position + 1}'),
+            'remove_rooms': set(remove_rooms),
+            'remove_buildings': set(remove_buildings),
+            'add_rooms': added,
+            'capacity': capacity,
+            'seat_ratio': seat_ratio,
+            'keep_equipment': bool(data.get('keep_equipment', True)),
+        }
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        raise ValueError(f'Некорректный сценарий {position + 1}: {e}')
+    if not 0 < seat_ratio <= 1:
+        raise ValueError('seat_ratio должен быть в диапазоне (0, 1]')
+    if any(seats < 0 for seats in capacity.values()):
+        raise ValueError('Вместимость не может быть отрицательной')
+    return scenario
+
+
+def apply_scenario(rooms, scenario):
+    """Фонд аудиторий после изменений сценария"""
+    pool = []
+    for room in rooms:
+        if room.id in scenario['remove_rooms'] or room.building in scenario['remove_buildings']:
+            continue
+        if room.id in scenario['capacity']:
+            room = room._replace(capacity=scenario['capacity'][room.id])
+        pool.append(room)
+    return pool + scenario['add_rooms']
+
+
+class _Busy:
+    """«Множество» аудиторий, занятых в промежутке [start, end), для room_ranking.recommend"""
+
+    def __init__(self, bookings, start, end):
+        self.bookings = bookings
+        self.start = start
+        self.end = end
+
+    def __contains__(self, room_id):
+        return any(start < self.end and end > self.start for start, end in self.bookings.get(room_id, ()))
+
+
+def simulate_day(rooms, lessons, seat_ratio=1.0, keep_equipment=True, index=None):
+    """
+    Раскладка занятий одного дня по фонду rooms (index — готовый RoomIndex этого фонда).
+    Возвращает (осталось на месте, перенесено, id неразмещённых, {id аудитории: занято минут}).
+    """
+    pool = {room.id: room for room in rooms}
+    index = index or room_ranking.RoomIndex(rooms)
+    bookings = {}
+    kept = 0
+    displaced = []
+    for lesson in sorted(lessons, key=lambda l: (l.start, l.end, l.id)):
+        seats = math.ceil(lesson.capacity * seat_ratio)
+        room = pool.get(lesson.classroom_id)
+        if (room is not None and (room.capacity or 0) >= seats
+                and lesson.classroom_id not in _Busy(bookings, lesson.start, lesson.end)):
+            bookings.setdefault(room.id, []).append((lesson.start, lesson.end))
+            kept += 1
+        else:
+            displaced.append((seats, lesson))
+
+    moved = 0
+    unplaceable = []
+    # Большие группы первыми: для них подходящих аудиторий меньше всего
+    for seats, lesson in sorted(displaced, key=lambda item: (-item[0], item[1].start, item[1].id)):
+        ranked, _ = room_ranking.recommend(
+            index, seats, _Busy(bookings, lesson.start, lesson.end), 1,
+            required=lesson.required if keep_equipment else (), preferred_building=lesson.building
+        )
+        if ranked:
+            room = ranked[0][2]
+            bookings.setdefault(room.id, []).append((lesson.start, lesson.end))
+            moved += 1
+        else:
+            unplaceable.append(lesson.id)
+
+    booked = {room_id: sum(end - start for start, end in intervals) for room_id, intervals in bookings.items()}
+    return kept, moved, unplaceable, booked
+
+
+def simulate_days(rooms, days, seat_ratio=1.0, keep_equipment=True):
+    """simulate_day для нескольких дней (списков занятий) одного фонда; индекс фонда строится один раз"""
+    index = room_ranking.RoomIndex(rooms)
+    return [simulate_day(rooms, lessons, seat_ratio, keep_equipment, index) for lessons in days]
+
+
+def teaching_days(term_start, term_end):
+    """Число учебных дней (понедельник — суббота) в [term_start, term_end)"""
+    days = (term_end - term_start).days
+    weeks, rest = divmod(days, 7)
+    extra = sum(1 for i in range(rest) if (term_start + timedelta(days=weeks * 7 + i)).weekday() < TEACHING_WEEKDAYS)
+    return weeks * TEACHING_WEEKDAYS + extra
+
+
+def split_days(days, scenarios_count, workers):
+    """
+    Части дней одного сценария: столько, чтобы задач хватило на все процессы
+    (по две на процесс), но не больше числа дней
+    """
+    parts = max(1, min(len(days), math.ceil(2 * workers / max(1, scenarios_count))))
+    size = math.ceil(len(days) / parts) if days else 1
+    return [days[start:start + size] for start in range(0, len(days), size)]
+
+
+def run(rooms, lessons, scenarios, term_start, term_end, executor=None, workers=1):
+    """
+    Все сценарии по всем дням семестра. executor — пул процессов
+    (concurrent.futures) из workers процессов, None — последовательно в этом процессе.
+    Возвращает список результатов в порядке сценариев.
+    """
+    by_day = {}
+    for lesson in lessons:
+        by_day.setdefault(lesson.lesson_date, []).append(lesson)
+    days = sorted(by_day)
+    pools = [apply_scenario(rooms, scenario) for scenario in scenarios]
+
+    parts = split_days(days, len(scenarios), workers if executor is not None else 1)
+    tasks = [(i, part) for i in range(len(scenarios)) for part in parts]
+    arguments = (
+        [pools[i] for i, _ in tasks],
+        [[by_day[day] for day in part] for _, part in tasks],
+        [scenarios[i]['seat_ratio'] for i, _ in tasks],
+        [scenarios[i]['keep_equipment'] for i, _ in tasks],
+    )
+    if executor is None:
+        outcomes = map(simulate_days, *arguments)
+    else:
+        outcomes = executor.map(simulate_days, *arguments)
+
+    totals = [{'kept': 0, 'moved': 0, 'unplaceable': [], 'booked': {}} for _ in scenarios]
+    for (i, _), day_outcomes in zip(tasks, outcomes):
+        total = totals[i]
+        for kept, moved, unplaceable, booked in day_outcomes:
+            total['kept'] += kept
+            total['moved'] += moved
+            total['unplaceable'] += unplaceable
+            for room_id, minutes in booked.items():
+                total['booked'][room_id] = total['booked'].get(room_id, 0) + minutes
+
+    lesson_by_id = {lesson.id: lesson for lesson in lessons}
+    available_per_room = teaching_days(term_start, term_end) * WORKDAY_MINUTES
+    return [_report(scenario, pool, total, lesson_by_id, available_per_room)
+            for scenario, pool, total in zip(scenarios, pools, totals)]
+
+
+def _percent(booked, available):
+    return round(booked * 100.0 / available, 1) if available else 0.0
+
+
+def _report(scenario, pool, total, lesson_by_id, available_per_room):
+    buildings = {}
+    for room in pool:
+        entry = buildings.setdefault(room.building or '', [0, 0])
+        entry[0] += total['booked'].get(room.id, 0)
+        entry[1] += available_per_room
+    booked = sum(entry[0] for entry in buildings.values())
+    available = sum(entry[1] for entry in buildings.values())
+
+    unplaceable = sorted(total['unplaceable'], key=lambda lesson_id: (
+        lesson_by_id[lesson_id].lesson_date, lesson_by_id[lesson_id].start, lesson_id))
+    return {
+        'name': scenario['name'],
+        'rooms': len(pool),
+        'lessons': total['kept'] + total['moved'] + len(unplaceable),
+        'kept': total['kept'],
+        'moved': total['moved'],
+        'unplaceable_count': len(unplaceable),
+        'unplaceable': [_lesson_summary(lesson_by_id[lesson_id]) for lesson_id in unplaceable[:MAX_UNPLACEABLE]],
+        'utilization': {
+            'percent': _percent(booked, available),
+            'booked_hours': round(booked / 60, 1),
+            'available_hours': round(available / 60, 1),
+            'by_building': {name: _percent(b, a) for name, (b, a) in sorted(buildings.items())},
+        },
+    }
+
+
+def _lesson_summary(lesson):
+    return {
+        'id': lesson.id,
+        'lesson_date': lesson.lesson_date.strftime('%Y-%m-%d'),
+        'start_time': f'{lesson.start // 60:02d}:{lesson.start % 60:02d}',
+        'end_time': f'{lesson.end // 60:02d}:{lesson.end % 60:02d}',
+        'classroom_id': lesson.classroom_id,
+        'room_capacity': lesson.capacity,
+    }
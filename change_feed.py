@@ -0,0 +1,199 @@
+"""
+Информационная система учёта аудиторного фонда
+Журнал изменений аудиторий и занятий для инкрементальной синхронизации клиентов
+
+Каждая запись аудитории или занятия через ORM добавляет строку в журнал
+change_log в той же транзакции (событие after_flush сессии). Курсор — id
+строки журнала; клиент запрашивает изменения после своего курсора и
+получает следующий курсор.
+
+Сжатие журнала:
+    * удаляются записи, перекрытые более поздней записью той же сущности, —
+      это безопасно для любого курсора, клиент всё равно получит итог;
+    * записи старше срока хранения удаляются целиком, а граница удаления
+      (horizon) запоминается: клиенту с курсором ниже неё нужна полная
+      пересинхронизация.
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, event, func, select
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+HORIZON_KEY = 'horizon'
+
+# Пропуск в id моложе этого — транзакция с меньшим id ещё может зафиксироваться
+# (в PostgreSQL id выдаются до коммита); старые пропуски — это откаты
+GAP_GRACE_SECONDS = 5
+
+
+def _entry(entity, entity_id, op, data):
+    return {
+        'entity': entity,
+        'entity_id': entity_id,
+        'op': op,
+        'data': json.dumps(data, ensure_ascii=False, default=str) if data is not None else None,
+        'created_at': datetime.now(),
+    }
+
+
+def install(session, change_table, serializers):
+    """
+    Запись журнала при каждом flush сессии.
+    serializers: {класс модели: (имя сущности, функция объект -> dict)}.
+    """
+
+    @event.listens_for(session, 'after_flush')
+    def _log_changes(session, flush_context):
+        entries = []
+        for obj in session.new:
+            if type(obj) in serializers:
+                entity, to_data = serializers[type(obj)]
+                entries.append(_entry(entity, obj.id, UPSERT, to_data(obj)))
+        for obj in session.dirty:
+            if type(obj) in serializers and session.is_modified(obj, include_collections=False):
+                entity, to_data = serializers[type(obj)]
+                entries.append(_entry(entity, obj.id, UPSERT, to_data(obj)))
+        for obj in session.deleted:
+            if type(obj) in serializers:
+                entity, _ = serializers[type(obj)]
+                entries.append(_entry(entity, obj.id, DELETE, None))
+        if entries:
+            session.connection().execute(change_table.insert(), entries)
+
+
+def record(connection, change_table, entity, changes):
+    """Запись журнала для массовых операций в обход ORM: changes — [(id, op, data)]"""
+    entries = [_entry(entity, entity_id, op, data) for entity_id, op, data in changes]
+    if entries:
+        connection.execute(change_table.insert(), entries)
+
+
+def _horizon(connection, meta_table):
+    value = connection.execute(
+        select(meta_table.c.value).where(meta_table.c.key == HORIZON_KEY)
+    ).scalar()
+    return value or 0
+
+
+def latest_cursor(connection, change_table, meta_table):
+    """Курсор самого свежего изменения (для клиента, который только что загрузил всё целиком)"""
+    latest = connection.execute(select(func.max(change_table.c.id))).scalar()
+    return max(latest or 0, _horizon(connection, meta_table))
+
+
+def read_changes(connection, change_table, meta_table, since, limit=500):
+    """
+    Изменения после курсора since по порядку.
+    Возвращает dict: changes, cursor, has_more; или resync_required, если
+    since старше границы сжатия журнала.
+    """
+    if since < _horizon(connection, meta_table):
+        return {
+            'resync_required': True,
+            'cursor': latest_cursor(connection, change_table, meta_table),
+        }
+
+    rows = connection.execute(
+        select(change_table).where(change_table.c.id > since)
+        .order_by(change_table.c.id).limit(limit + 1)
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = []
+    cursor = since
+    settle_after = datetime.now() - timedelta(seconds=GAP_GRACE_SECONDS)
+    for row in rows:
+        # Свежий пропуск: ждём, пока транзакция с меньшим id зафиксируется или откатится
+        if row.id != cursor + 1 and row.created_at > settle_after:
+            has_more = True
+            break
+        changes.append({
+            'cursor': row.id,
+            'entity': row.entity,
+            'id': row.entity_id,
+            'op': row.op,
+            'data': json.loads(row.data) if row.data else None,
+        })
+        cursor = row.id
+
+    return {'changes': changes, 'cursor': cursor, 'has_more': has_more}
+
+
+def entity_changes(connection, change_table, meta_table, entity, since):
+    """
+    Все изменения сущностей entity после курсора since: [(id сущности, data)],
+    data — None для удалений. None, если since старше границы сжатия журнала.
+    """
+    if since < _horizon(connection, meta_table):
+        return None
+    rows = connection.execute(
+        select(change_table.c.entity_id, change_table.c.data)
+        .where(change_table.c.entity == entity, change_table.c.id > since)
+        .order_by(change_table.c.id)
+    )
+    return [(row.entity_id, json.loads(row.data) if row.data else None) for row in rows]
+
+
+def compact(connection, change_table, meta_table, retention_days=30):
+    """Сжатие журнала. Возвращает (удалено перекрытых, удалено устаревших)"""
+    # Записи, после которых есть более поздняя запись той же сущности
+    newer = change_table.alias('newer')
+    superseded = connection.execute(
+        delete(change_table).where(select(newer.c.id).where(and_(
+            newer.c.entity == change_table.c.entity,
+            newer.c.entity_id == change_table.c.entity_id,
+            newer.c.id > change_table.c.id,
+        )).exists())
+    ).rowcount
+
+    # Устаревшие записи: самая свежая запись журнала не удаляется никогда
+    latest = connection.execute(select(func.max(change_table.c.id))).scalar()
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    boundary = connection.execute(
+        select(func.max(change_table.c.id))
+        .where(change_table.c.created_at < cutoff, change_table.c.id < (latest or 0))
+    ).scalar()
+
+    truncated = 0
+    if boundary:
+        truncated = connection.execute(
+            delete(change_table).where(change_table.c.id <= boundary)
+        ).rowcount
+        updated = connection.execute(
+            meta_table.update()
+            .where(meta_table.c.key == HORIZON_KEY, meta_table.c.value < boundary)
+            .values(value=boundary)
+        ).rowcount
+        if not updated and _horizon(connection, meta_table) == 0:
+            connection.execute(meta_table.insert().values(key=HORIZON_KEY, value=boundary))
+
+    return superseded, truncated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сжатие журнала изменений')
+    parser.add_argument('--retention-days', type=int, default=30,
+                        help='сколько дней хранить записи журнала (по умолчанию 30)')
+    args = parser.parse_args(argv)
+
+    from app import app, db, ChangeLog, ChangeLogMeta
+
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            superseded, truncated = compact(
+                connection, ChangeLog.__table__, ChangeLogMeta.__table__, args.retention_days
+            )
+    print(f"✅ Удалено перекрытых записей: {superseded}, устаревших: {truncated}")
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,230 @@
+"""
+Информационная система учёта аудиторного фонда
+Пакетное изменение аудиторий в одной транзакции
+
+Операции пакета:
+    {"op": "create", "data": {...}}
+    {"op": "update", "id": 5, "data": {...}}
+    {"op": "delete", "id": 7}
+
+Выполнение идёт множествами, а не построчно: все создания — одним INSERT,
+обновления с одинаковыми значениями — одним UPDATE ... WHERE id IN (...),
+удаления — одним DELETE после одной проверки EXISTS на занятия. Порядок
+фаз: создания, обновления, удаления. Для каждой операции возвращается
+результат с её индексом в пакете.
+"""
+
+from sqlalchemy import exists, or_, select
+
+MAX_OPERATIONS = 1000
+
+
+class BatchRejected(Exception):
+    """Пакет с atomic=true содержит ошибки и откатывается целиком"""
+
+    def __init__(self, results):
+        super().__init__('Пакет отклонён')
+        self.results = results
+
+
+# Типы полей аудитории (как в форме добавления)
+FIELD_TYPES = {
+    'number': str,
+    'floor': int,
+    'building': str,
+    'capacity': int,
+    'area': float,
+    'has_projector': bool,
+    'has_computers': bool,
+    'has_board': bool,
+    'has_air_conditioner': bool,
+    'computers_count': int,
+}
+
+REQUIRED_FIELDS = ('number', 'building')
+
+CREATE_DEFAULTS = {
+    'floor': 1,
+    'capacity': 20,
+    'area': 30.0,
+    'has_projector': False,
+    'has_computers': False,
+    'has_board': True,
+    'has_air_conditioner': False,
+    'computers_count': 0,
+}
+
+
+def _coerce(data):
+    """Приведение значений полей к типам колонок; ValueError при ошибке"""
+    if not isinstance(data, dict) or not data:
+        raise ValueError('Не указаны поля аудитории')
+    unknown = [f for f in data if f not in FIELD_TYPES]
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+
+    values = {}
+    for field, value in data.items():
+        kind = FIELD_TYPES[field]
+        if value is None:
+            if field in REQUIRED_FIELDS:
+                raise ValueError(f'Поле {field} обязательно')
+            values[field] = None
+        elif kind is bool:
+            if not isinstance(value, bool):
+                raise ValueError(f'Поле {field} должно быть true или false')
+            values[field] = value
+        elif kind is str:
+            values[field] = str(value).strip()
+            if field in REQUIRED_FIELDS and not values[field]:
+                raise ValueError(f'Поле {field} обязательно')
+        else:
+            try:
+                values[field] = kind(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'Неверное значение поля {field}')
+    return values
+
+
+def _result(index, op, status, classroom_id=None, error=None):
+    result = {'index': index, 'op': op, 'status': status, 'id': classroom_id}
+    if error:
+        result['error'] = error
+    return result
+
+
+def rejected(index, op, classroom_id, error):
+    """Результат операции, отклонённой до выполнения пакета"""
+    return _result(index, op, 'error', classroom_id, error)
+
+
+def validate(operations):
+    """
+    Разбор пакета: (creates, updates, deletes, results) — допустимые операции
+    по фазам и результаты для недопустимых.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('Пакет операций пуст')
+    if len(operations) > MAX_OPERATIONS:
+        raise ValueError(f'Не более {MAX_OPERATIONS} операций в пакете')
+
+    creates, updates, deletes, results = [], [], [], []
+    for index, item in enumerate(operations):
+        op = item.get('op') if isinstance(item, dict) else None
+        try:
+            if op == 'create':
+                values = _coerce(item.get('data'))
+                missing = [f for f in REQUIRED_FIELDS if f not in values]
+                if missing:
+                    raise ValueError(f'Поле {missing[0]} обязательно')
+                creates.append((index, {**CREATE_DEFAULTS, **values}))
+            elif op in ('update', 'delete'):
+                classroom_id = item.get('id')
+                if not isinstance(classroom_id, int) or isinstance(classroom_id, bool):
+                    raise ValueError('Не указан id аудитории')
+                if op == 'update':
+                    updates.append((index, classroom_id, _coerce(item.get('data'))))
+                else:
+                    deletes.append((index, classroom_id))
+            else:
+                raise ValueError('Операция должна быть create, update или delete')
+        except ValueError as e:
+            results.append(rejected(index, op, item.get('id') if isinstance(item, dict) else None, str(e)))
+    return creates, updates, deletes, results
+
+
+def apply(connection, classrooms, lesson_tables, creates, updates, deletes, allocate_ids=None):
+    """
+    Выполнение разобранного пакета на соединении (в транзакции вызывающего).
+    allocate_ids(count) — id для созданий (шарды); None — id выдаёт БД.
+    Возвращает (результаты, изменения для журнала [(id, op, данные)]).
+    """
+    results = []
+    changes = []
+    touched = set()
+
+    # Существующие аудитории для обновлений и удалений — одним запросом
+    target_ids = {i for _, i, _ in updates} | {i for _, i in deletes}
+    existing = set()
+    if target_ids:
+        existing = set(connection.execute(
+            select(classrooms.c.id).where(classrooms.c.id.in_(target_ids))
+        ).scalars())
+
+    if creates:
+        if allocate_ids is not None:
+            rows = list(allocate_ids(len(creates)))
+            connection.execute(classrooms.insert(), [dict(values, id=row_id)
+                                                     for (_, values), row_id in zip(creates, rows)])
+        else:
+            rows = connection.execute(
+                classrooms.insert().returning(classrooms.c.id, sort_by_parameter_order=True),
+                [values for _, values in creates]
+            ).scalars().all()
+        for (index, _), classroom_id in zip(creates, rows):
+            results.append(_result(index, 'create', 'created', classroom_id))
+            touched.add(classroom_id)
+
+    # Несколько обновлений одной аудитории сводятся в одно в порядке пакета:
+    # поля объединяются, при повторе поля побеждает более позднее значение
+    merged = {}
+    for index, classroom_id, values in updates:
+        if classroom_id not in existing:
+            results.append(_result(index, 'update', 'not_found', classroom_id))
+            continue
+        indexes, merged_values = merged.setdefault(classroom_id, ([], {}))
+        indexes.append(index)
+        merged_values.update(values)
+
+    # Обновления с одинаковым набором значений — один UPDATE на группу
+    groups = {}
+    for classroom_id, (indexes, values) in merged.items():
+        key = tuple(sorted(values.items()))
+        groups.setdefault(key, []).append((indexes, classroom_id))
+    for key, items in groups.items():
+        connection.execute(
+            classrooms.update()
+            .where(classrooms.c.id.in_({classroom_id for _, classroom_id in items}))
+            .values(dict(key))
+        )
+        for indexes, classroom_id in items:
+            results.extend(_result(index, 'update', 'updated', classroom_id) for index in indexes)
+            touched.add(classroom_id)
+
+    # Аудитории с занятиями (в любой из таблиц занятий) не удаляются
+    delete_ids = {classroom_id for _, classroom_id in deletes if classroom_id in existing}
+    busy = set()
+    if delete_ids:
+        busy = set(connection.execute(
+            select(classrooms.c.id).where(
+                classrooms.c.id.in_(delete_ids),
+                or_(*[exists().where(table.c.classroom_id == classrooms.c.id) for table in lesson_tables])
+            )
+        ).scalars())
+        removable = delete_ids - busy
+        if removable:
+            connection.execute(classrooms.delete().where(classrooms.c.id.in_(removable)))
+
+    deleted = set()
+    for index, classroom_id in deletes:
+        if classroom_id not in existing or classroom_id in deleted:
+            results.append(_result(index, 'delete', 'not_found', classroom_id))
+        elif classroom_id in busy:
+            results.append(_result(index, 'delete', 'error', classroom_id,
+                                   'Нельзя удалить аудиторию, в которой есть занятия!'))
+        else:
+            results.append(_result(index, 'delete', 'deleted', classroom_id))
+            deleted.add(classroom_id)
+
+    # Снимки изменённых аудиторий для журнала — одним запросом
+    snapshot_ids = touched - deleted
+    if snapshot_ids:
+        for row in connection.execute(
+            select(classrooms).where(classrooms.c.id.in_(snapshot_ids)).order_by(classrooms.c.id)
+        ).mappings():
+            changes.append((row['id'], 'upsert', dict(row)))
+    changes.extend((classroom_id, 'delete', None) for classroom_id in sorted(deleted))
+
+    results.sort(key=lambda r: r['index'])
+    return results, changes
+
@@ -0,0 +1,237 @@
+"""
+Информационная система учёта аудиторного фонда
+Кэш отрендеренных фрагментов шаблонов Jinja
+
+Использование в шаблоне:
+
+    {% cache 'schedule_table', selected_date depends 'lessons', 'classrooms' %}
+        ... дорогой фрагмент ...
+    {% endcache %}
+
+Ключ фрагмента — имя, аргументы и текущие версии перечисленных областей
+данных. Маршруты записи после коммита вызывают bump('classrooms') или
+bump('lessons'), и все зависящие фрагменты перестают совпадать по ключу.
+
+Бэкенды: MemoryBackend — LRU в памяти процесса; DiskBackend — общий каталог
+на диске для нескольких процессов-воркеров (версии тоже хранятся на диске).
+Версии MemoryBackend видны только своему процессу, поэтому с ним кэшу
+передаётся shared_version — общий для воркеров признак версии данных
+(в приложении — курсор журнала изменений), и запись в одном воркере
+сбрасывает фрагменты во всех.
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class MemoryBackend:
+    """LRU-кэш в памяти процесса"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def get_version(self, scope):
+        return self._versions.get(scope, 0)
+
+    def bump_version(self, scope):
+        with self._lock:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class DiskBackend:
+    """
+    Общий кэш в каталоге на диске. Файлы пишутся через временное имя и
+    os.replace, поэтому воркеры не видят полузаписанных фрагментов.
+    Версия области — случайный токен в файле: ей достаточно измениться,
+    поэтому межпроцессные блокировки не нужны.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, directory, max_entries=5000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, name, data):
+        path = self._path(name)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        try:
+            with open(self._path(key + '.html'), 'rb') as f:
+                return f.read().decode('utf-8')
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        self._write(key + '.html', value.encode('utf-8'))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def get_version(self, scope):
+        try:
+            with open(self._path(f'version-{scope}'), 'r') as f:
+                return f.read()
+        except FileNotFoundError:
+            return ''
+
+    def bump_version(self, scope):
+        self._write(f'version-{scope}', uuid.uuid4().hex.encode('ascii'))
+
+    def prune(self):
+        """Удаление самых старых фрагментов сверх max_entries"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.html'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        entries.sort()
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.html'):
+                os.remove(entry.path)
+
+
+class FragmentCache:
+    """
+    Кэш фрагментов поверх бэкенда: ключи с версиями областей данных.
+    shared_version — функция без аргументов, значение которой входит в ключ
+    каждого фрагмента (None — только версии бэкенда).
+    """
+
+    def __init__(self, backend, shared_version=None):
+        self.backend = backend
+        self.shared_version = shared_version
+
+    def make_key(self, parts, depends):
+        versions = [f'{scope}={self.backend.get_version(scope)}' for scope in depends]
+        if self.shared_version is not None:
+            versions.append(f'shared={self.shared_version()}')
+        raw = '\x1f'.join([str(p) for p in parts] + versions)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def bump(self, *scopes):
+        """Данные областей изменились: зависящие фрагменты будут отрендерены заново"""
+        for scope in scopes:
+            self.backend.bump_version(scope)
+
+
+class FragmentCacheExtension(Extension):
+    """Тег {% cache ... depends ... %}...{% endcache %} для Jinja"""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+
+        depends = []
+        if parser.stream.skip_if('name:depends'):
+            depends.append(parser.parse_expression())
+            while parser.stream.skip_if('comma'):
+                depends.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        # Переменная шаблона cache_disabled отключает кэш (например, при ошибке загрузки данных)
+        call = self.call_method('_render', [
+            nodes.List(parts), nodes.List(depends), nodes.Name('cache_disabled', 'load')
+        ])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, depends, disabled, caller):
+        cache = self.environment.fragment_cache
+        if cache is None or disabled:
+            return caller()
+
+        key = cache.make_key(parts, depends)
+        value = cache.get(key)
+        if value is None:
+            value = str(caller())
+            cache.set(key, value)
+        return Markup(value)
+
+
+class Lazy:
+    """
+    Список, который загружается при первом обращении. Позволяет не выполнять
+    запрос к БД, если использующий его фрагмент шаблона взят из кэша.
+    """
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._items = None
+
+    def _load(self):
+        if self._items is None:
+            self._items = list(self._loader())
+        return self._items
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __bool__(self):
+        return bool(self._load())
+
+    def __getitem__(self, index):
+        return self._load()[index]
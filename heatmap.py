@@ -0,0 +1,150 @@
+"""
+Информационная система учёта аудиторного фонда
+Тепловая карта загруженности: аудитория (или корпус) × день недели × время суток
+
+Интервалы занятий раскладываются по временным слотам векторно через NumPy,
+без циклов Python по занятиям.
+"""
+
+import numpy as np
+
+WEEKDAY_LABELS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+
+
+def weekday_counts(date_from, date_to):
+    """Сколько раз каждый день недели (Пн=0) встречается в диапазоне дат включительно"""
+    days = np.arange(np.datetime64(date_from, 'D'), np.datetime64(date_to, 'D') + 1)
+    return np.bincount(weekdays_of(days), minlength=7)
+
+
+def weekdays_of(days):
+    """День недели (Пн=0) для массива datetime64[D]; 1970-01-01 — четверг"""
+    return (days.astype('int64') + 3) % 7
+
+
+def to_minutes(times):
+    """Массив минут от полуночи для последовательности datetime.time"""
+    return np.fromiter((t.hour * 60 + t.minute for t in times), dtype=np.int64, count=len(times))
+
+
+def accumulate(row_index, weekday, start_minutes, end_minutes, n_rows, slot_minutes, span_minutes):
+    """
+    Занятые минуты в каждой ячейке (строка, день недели, слот).
+
+    Вклад интервала [s, e) в слот k равен G(e)[k] - G(s)[k], где
+    G(x)[k] = clip(x - k*w, 0, w): слоты до x // w заполнены целиком,
+    слот x // w — на x % w минут. Полные слоты накапливаются разностным
+    массивом и кумулятивной суммой, остатки — прямым np.add.at.
+    """
+    w = slot_minutes
+    n_slots = -(-span_minutes // w)
+
+    start = np.clip(start_minutes, 0, span_minutes)
+    end = np.clip(end_minutes, 0, span_minutes)
+    keep = end > start
+    cell = (row_index[keep] * 7 + weekday[keep]).astype(np.int64)
+    start, end = start[keep], end[keep]
+
+    full = np.zeros((n_rows * 7, n_slots + 1), dtype=np.int64)
+    partial = np.zeros((n_rows * 7, n_slots + 1), dtype=np.int64)
+
+    for points, sign in ((end, 1), (start, -1)):
+        slot, rest = np.divmod(points, w)
+        np.add.at(full, (cell, 0), sign * w)
+        np.add.at(full, (cell, slot), -sign * w)
+        np.add.at(partial, (cell, slot), sign * rest)
+
+    minutes = np.cumsum(full, axis=1) + partial
+    return minutes[:, :n_slots].reshape(n_rows, 7, n_slots)
+
+
+def slot_widths(slot_minutes, span_minutes):
+    """Длительность каждого слота (последний может быть короче)"""
+    n_slots = -(-span_minutes // slot_minutes)
+    widths = np.full(n_slots, slot_minutes, dtype=np.int64)
+    widths[-1] = span_minutes - slot_minutes * (n_slots - 1)
+    return widths
+
+
+def occupancy_percent(minutes, rooms_per_row, days_per_weekday, widths):
+    """Загруженность ячеек в процентах от доступного времени"""
+    capacity = (rooms_per_row[:, None, None]
+                * days_per_weekday[None, :, None]
+                * widths[None, None, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = np.where(capacity > 0, minutes * 100.0 / capacity, 0.0)
+    return np.rint(np.minimum(percent, 100.0)).astype(np.int64)
+
+
+def slot_labels(day_start_minutes, slot_minutes, span_minutes):
+    """Подписи начала слотов в формате ЧЧ:ММ"""
+    starts = range(day_start_minutes, day_start_minutes + span_minutes, slot_minutes)
+    return [f'{m // 60:02d}:{m % 60:02d}' for m in starts]
+
+
+def layout(rooms, group_by):
+    """
+    Строки карты по аудиториям (id, number, building): подписи строк, массив
+    id аудиторий, строка карты каждой аудитории и число аудиторий в строке.
+    """
+    room_ids = np.array([r.id for r in rooms], dtype=np.int64)
+    if group_by == 'building':
+        labels = sorted({r.building or '' for r in rooms})
+        positions = {label: i for i, label in enumerate(labels)}
+        room_row = np.array([positions[r.building or ''] for r in rooms], dtype=np.int64)
+        rooms_per_row = np.bincount(room_row, minlength=len(labels))
+    else:
+        labels = [f'{r.building}-{r.number}' for r in rooms]
+        room_row = np.arange(len(rooms), dtype=np.int64)
+        rooms_per_row = np.ones(len(rooms), dtype=np.int64)
+    return labels, room_ids, room_row, rooms_per_row
+
+
+def occupied_minutes(rows, lessons, day_start_minutes, span_minutes, slot_minutes):
+    """
+    Занятые минуты [строка][день недели][слот] для занятий (classroom_id,
+    lesson_date, start_time, end_time) при строках карты rows из layout().
+    Массивы для разных частей занятий (например, шардов) складываются.
+    """
+    labels, room_ids, room_row, _ = rows
+
+    # classroom_id -> строка карты через отсортированный индекс id
+    # (занятия выбраны по тем же аудиториям, поэтому каждый id найдётся)
+    order = np.argsort(room_ids)
+    lesson_rooms = np.fromiter((l.classroom_id for l in lessons), dtype=np.int64, count=len(lessons))
+    row_index = room_row[order][np.searchsorted(room_ids[order], lesson_rooms)]
+
+    days = np.array([l.lesson_date for l in lessons], dtype='datetime64[D]')
+    return accumulate(
+        row_index,
+        weekdays_of(days),
+        to_minutes([l.start_time for l in lessons]) - day_start_minutes,
+        to_minutes([l.end_time for l in lessons]) - day_start_minutes,
+        len(labels), slot_minutes, span_minutes
+    )
+
+
+def report(rows, minutes, date_from, date_to, day_start_minutes, span_minutes, slot_minutes):
+    """Подписи строк и плоский массив процентов [строка][день недели][слот] по занятым минутам"""
+    labels, _, _, rooms_per_row = rows
+    widths = slot_widths(slot_minutes, span_minutes)
+    percent = occupancy_percent(minutes, rooms_per_row, weekday_counts(date_from, date_to), widths)
+
+    return {
+        'rows': labels,
+        'weekdays': WEEKDAY_LABELS,
+        'slots': slot_labels(day_start_minutes, slot_minutes, span_minutes),
+        'shape': [len(labels), 7, len(widths)],
+        'values': percent.ravel().tolist(),
+    }
+
+
+def build(rooms, lessons, date_from, date_to, group_by, day_start_minutes, span_minutes, slot_minutes):
+    """
+    Тепловая карта по строкам аудиторий (id, number, building) и занятий
+    (classroom_id, lesson_date, start_time, end_time) из одного запроса по диапазону.
+    Возвращает подписи строк и плоский массив процентов [строка][день недели][слот].
+    """
+    rows = layout(rooms, group_by)
+    minutes = occupied_minutes(rows, lessons, day_start_minutes, span_minutes, slot_minutes)
+    return report(rows, minutes, date_from, date_to, day_start_minutes, span_minutes, slot_minutes)
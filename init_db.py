@@ -124,7 +124,10 @@ def create_tables():
     try:
         # Проверяем наличие Flask и SQLAlchemy
         try:
-            from app import app, db, Classroom, Lesson
+            from app import app, db, Classroom, Lesson, ArchivedLesson, ChangeLog, LESSON_DICTIONARY_TABLES
+            import lesson_archive
+            import lesson_dictionary
+            import lesson_search
         except ImportError as e:
             print_error(f"Не удалось импортировать модули приложения: {str(e)}")
             print("Убедитесь, что файл app.py существует в текущей директории")
@@ -135,6 +138,27 @@ def create_tables():
             db.create_all()
             print_success("Таблицы успешно созданы")
             
+            # Перевод строковых колонок занятий на справочники (для старых БД)
+            with db.engine.begin() as connection:
+                added = lesson_dictionary.migrate(
+                    connection, [Lesson.__table__, ArchivedLesson.__table__], LESSON_DICTIONARY_TABLES
+                )
+            if added:
+                print_success(f"Справочники преподавателей, групп и дисциплин заполнены: {added}")
+            
+            # Секционирование занятий по семестрам
+            with db.engine.begin() as connection:
+                lesson_archive.setup_partitioning(connection, Lesson.__table__, ArchivedLesson.__table__)
+            print_success("Секции занятий по семестрам созданы")
+            
+            # Поисковые индексы по справочникам преподавателей, групп и дисциплин
+            with db.engine.begin() as connection:
+                lesson_search.ensure_index(connection)
+                # Индексы журнала изменений для БД, созданных до их появления
+                for index in ChangeLog.__table__.indexes:
+                    index.create(connection, checkfirst=True)
+            print_success("Поисковые индексы созданы")
+            
             # Проверяем, есть ли уже данные
             if Classroom.query.count() == 0:
                 print_step("Добавление тестовых данных")
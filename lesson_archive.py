@@ -0,0 +1,253 @@
+"""
+Информационная система учёта аудиторного фонда
+Разбиение занятий по семестрам и архивирование прошедших семестров
+
+PostgreSQL: таблицы lessons и lessons_archive секционируются декларативно
+(PARTITION BY RANGE (lesson_date)) по семестрам. Архивирование — это
+DETACH секции из lessons и ATTACH к lessons_archive, без копирования строк.
+
+SQLite: прошедшие семестры переносятся в таблицу lessons_archive
+(INSERT ... SELECT + DELETE в одной транзакции).
+
+В обоих случаях проверки конфликтов в add_lesson и поиск свободных
+аудиторий работают только с «горячей» таблицей lessons, а чтение
+архива подключается, лишь когда запрошенный диапазон дат его задевает.
+
+Запуск: python lesson_archive.py [--before ГГГГ-ММ-ДД] [--setup]
+"""
+
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.schema import AddConstraint
+
+ARCHIVE_TABLE = 'lessons_archive'
+
+# Осенний семестр: 1 сентября — 31 января, весенний: 1 февраля — 31 августа
+FALL_START_MONTH = 9
+SPRING_START_MONTH = 2
+
+
+def term_bounds(day):
+    """Границы семестра, содержащего день: (первый день, первый день следующего)"""
+    if day.month >= FALL_START_MONTH:
+        return date(day.year, FALL_START_MONTH, 1), date(day.year + 1, SPRING_START_MONTH, 1)
+    if day.month < SPRING_START_MONTH:
+        return date(day.year - 1, FALL_START_MONTH, 1), date(day.year, SPRING_START_MONTH, 1)
+    return date(day.year, SPRING_START_MONTH, 1), date(day.year, FALL_START_MONTH, 1)
+
+
+def terms_between(first_day, last_day):
+    """Семестры, пересекающие диапазон дат включительно"""
+    terms = []
+    start, end = term_bounds(first_day)
+    while start <= last_day:
+        terms.append((start, end))
+        start, end = term_bounds(end)
+    return terms
+
+
+def partition_name(table_name, start):
+    season = 'fall' if start.month == FALL_START_MONTH else 'spring'
+    return f'{table_name}_{start.year}_{season}'
+
+
+# ---------------------------------------------------------------------------
+# Секционирование PostgreSQL
+# ---------------------------------------------------------------------------
+
+def _is_partitioned(connection, table_name):
+    return connection.execute(text(
+        'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+        'WHERE c.relname = :name'
+    ), {'name': table_name}).first() is not None
+
+
+def _convert_to_partitioned(connection, table_name):
+    """
+    Пересоздание обычной таблицы как секционированной по lesson_date с переносом строк.
+    Индексы и внешние ключи модели добавляет затем _ensure_indexes_and_keys.
+    """
+    legacy = f'{table_name}_unpartitioned'
+    connection.execute(text(f'ALTER TABLE {table_name} RENAME TO {legacy}'))
+    connection.execute(text(
+        f'CREATE TABLE {table_name} (LIKE {legacy} INCLUDING DEFAULTS) '
+        f'PARTITION BY RANGE (lesson_date)'
+    ))
+    # Первичный ключ секционированной таблицы обязан включать ключ секционирования
+    connection.execute(text(f'ALTER TABLE {table_name} ADD PRIMARY KEY (id, lesson_date)'))
+    connection.execute(text(f'CREATE TABLE {table_name}_default PARTITION OF {table_name} DEFAULT'))
+
+    # Последовательность id должна пережить удаление старой таблицы
+    sequence = connection.execute(text(
+        "SELECT pg_get_serial_sequence(:table, 'id')"
+    ), {'table': legacy}).scalar()
+    if sequence:
+        connection.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY {table_name}.id'))
+
+    bounds = connection.execute(text(f'SELECT MIN(lesson_date), MAX(lesson_date) FROM {legacy}')).first()
+    if bounds[0] is not None:
+        for start, end in terms_between(bounds[0], bounds[1]):
+            ensure_term_partition(connection, table_name, start, end)
+    connection.execute(text(f'INSERT INTO {table_name} SELECT * FROM {legacy}'))
+    # Имена индексов уникальны в схеме: индексы модели создаются после удаления старой таблицы
+    connection.execute(text(f'DROP TABLE {legacy}'))
+
+
+def _ensure_indexes_and_keys(connection, table):
+    """
+    Индексы и внешние ключи модели table на секционированной таблице. Они
+    создаются на родительской таблице и действуют во всех секциях; недостающие
+    добавляются и в таблицы, секционированные без них.
+    """
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+    existing = {tuple(fk['constrained_columns']) for fk in inspect(connection).get_foreign_keys(table.name)}
+    for constraint in table.foreign_key_constraints:
+        if tuple(column.name for column in constraint.columns) not in existing:
+            # isolate_from_table=False: ограничение остаётся и в CREATE TABLE модели
+            connection.execute(AddConstraint(constraint, isolate_from_table=False))
+
+
+def ensure_term_partition(connection, table_name, start, end):
+    """
+    Секция семестра в PostgreSQL. Строки этого диапазона, успевшие попасть
+    в секцию по умолчанию, переносятся в новую секцию перед подключением.
+    Секция создаётся с индексами родительской таблицы (ATTACH связывает их
+    с индексами родителя), внешние ключи родителя ATTACH добавляет сам.
+    """
+    name = partition_name(table_name, start)
+    exists = connection.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar()
+    if exists:
+        return name
+    params = {'start': start, 'end': end}
+    connection.execute(text(f'CREATE TABLE {name} (LIKE {table_name} INCLUDING ALL)'))
+    connection.execute(text(
+        f'WITH moved AS (DELETE FROM {table_name}_default '
+        f'WHERE lesson_date >= :start AND lesson_date < :end RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved'
+    ), params)
+    connection.execute(text(
+        f"ALTER TABLE {table_name} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    return name
+
+
+def setup_partitioning(connection, lessons_table, archive_table):
+    """
+    Перевод lessons и lessons_archive на секционирование по семестрам (PostgreSQL).
+    Идемпотентно; заранее создаются секции текущего и следующего семестра.
+    Для SQLite ничего не делает — там используется только таблица архива.
+    """
+    if connection.dialect.name != 'postgresql':
+        return False
+
+    for table in (lessons_table, archive_table):
+        if not _is_partitioned(connection, table.name):
+            _convert_to_partitioned(connection, table.name)
+        _ensure_indexes_and_keys(connection, table)
+
+    current_start, current_end = term_bounds(date.today())
+    for start, end in (term_bounds(current_start), term_bounds(current_end)):
+        ensure_term_partition(connection, lessons_table.name, start, end)
+    return True
+
+
+# ---------------------------------------------------------------------------
+# Архивирование
+# ---------------------------------------------------------------------------
+
+def archive_before(connection, lessons_table, archive_table, cutoff):
+    """
+    Перенос в архив всех семестров, закончившихся до cutoff.
+    cutoff округляется вниз до начала семестра. Возвращает число перенесённых занятий.
+    """
+    cutoff = term_bounds(cutoff)[0]
+    first_day = connection.execute(
+        select(func.min(lessons_table.c.lesson_date)).where(lessons_table.c.lesson_date < cutoff)
+    ).scalar()
+    if first_day is None:
+        return 0
+
+    moved = connection.execute(
+        select(func.count()).select_from(lessons_table).where(lessons_table.c.lesson_date < cutoff)
+    ).scalar()
+
+    if connection.dialect.name == 'postgresql' and _is_partitioned(connection, lessons_table.name):
+        for start, end in terms_between(first_day, cutoff - timedelta(days=1)):
+            name = ensure_term_partition(connection, lessons_table.name, start, end)
+            connection.execute(text(f'ALTER TABLE {lessons_table.name} DETACH PARTITION {name}'))
+            archived_name = partition_name(archive_table.name, start)
+            connection.execute(text(f'ALTER TABLE {name} RENAME TO {archived_name}'))
+            connection.execute(text(
+                f"ALTER TABLE {archive_table.name} ATTACH PARTITION {archived_name} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            ))
+        return moved
+
+    columns = [archive_table.c[c.name] for c in lessons_table.c]
+    connection.execute(archive_table.insert().from_select(
+        columns, select(*lessons_table.c).where(lessons_table.c.lesson_date < cutoff)
+    ))
+    connection.execute(lessons_table.delete().where(lessons_table.c.lesson_date < cutoff))
+    return moved
+
+
+def archive_boundary(connection, archive_table):
+    """Последний день, попавший в архив, или None, если архив пуст"""
+    return connection.execute(select(func.max(archive_table.c.lesson_date))).scalar()
+
+
+def needs_archive(connection, archive_table, date_from):
+    """Нужно ли читать архив для диапазона, начинающегося с date_from (None — с начала времён)"""
+    boundary = archive_boundary(connection, archive_table)
+    if boundary is None:
+        return False
+    return date_from is None or date_from <= boundary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Архивирование прошедших семестров')
+    parser.add_argument('--before', help='перенести семестры, закончившиеся до этой даты (ГГГГ-ММ-ДД); '
+                                         'по умолчанию — до начала текущего семестра')
+    parser.add_argument('--setup', action='store_true', help='только настроить секционирование (PostgreSQL)')
+    args = parser.parse_args(argv)
+
+    cutoff = datetime.strptime(args.before, '%Y-%m-%d').date() if args.before else date.today()
+
+    from app import app, db, shard_map, Lesson, ArchivedLesson
+    import lesson_search
+
+    if shard_map is not None:
+        # Занятия хранятся в шардах по корпусам: семестры архивируются в каждом шарде
+        moved = 0
+        for name in shard_map.names:
+            with shard_map.begin(name) as connection:
+                if setup_partitioning(connection, Lesson.__table__, ArchivedLesson.__table__):
+                    print(f"✅ Секционирование по семестрам в шарде {name} настроено")
+                if not args.setup:
+                    moved += archive_before(connection, Lesson.__table__, ArchivedLesson.__table__, cutoff)
+        if not args.setup:
+            print(f"✅ Перенесено в архив занятий: {moved} (до {term_bounds(cutoff)[0].isoformat()})")
+        return True
+
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            if setup_partitioning(connection, Lesson.__table__, ArchivedLesson.__table__):
+                lesson_search.ensure_index(connection)
+                print("✅ Секционирование по семестрам настроено")
+        if args.setup:
+            return True
+
+        with db.engine.begin() as connection:
+            moved = archive_before(connection, Lesson.__table__, ArchivedLesson.__table__, cutoff)
+    print(f"✅ Перенесено в архив занятий: {moved} (до {term_bounds(cutoff)[0].isoformat()})")
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
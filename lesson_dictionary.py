@@ -0,0 +1,221 @@
+"""
+Информационная система учёта аудиторного фонда
+Справочники преподавателей, групп и дисциплин
+
+Занятие хранит не строки, а целочисленные ссылки на справочники: имя
+преподавателя, группы или дисциплины записано один раз, а фильтры и
+соединения идут по целым ключам.
+
+Запись идёт через кэш интернирования NameDictionary: имя -> id (и обратно)
+без запроса к БД для уже встречавшихся имён. Новые имена вставляются в
+справочник в транзакции занятия и попадают в общий кэш только после её
+коммита, поэтому откат не оставляет в кэше несуществующих id. Ожидающие
+имена привязаны к транзакции или точке сохранения (begin_nested), в которой
+вставлены: откат точки сохранения забывает только их, а освобождение точки
+сохранения не переносит их в кэш до коммита внешней транзакции.
+
+migrate() переводит существующую БД со строковых колонок на справочники.
+"""
+
+import argparse
+import sys
+import threading
+
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import scoped_session
+
+# Поле занятия -> (колонка ссылки, таблица справочника)
+DICTIONARIES = {
+    'group_name': ('group_id', 'student_groups'),
+    'teacher_name': ('teacher_id', 'teachers'),
+    'subject_name': ('subject_id', 'subjects'),
+}
+
+PENDING_KEY = 'name_dictionary_pending'
+
+
+def normalize_name(value):
+    """Имя для справочника: пробелы по краям убраны, внутренние схлопнуты; пустое -> None"""
+    if value is None:
+        return None
+    value = ' '.join(str(value).split())
+    return value or None
+
+
+class NameDictionary:
+    """Кэш интернирования имён справочников (общий для потоков процесса)"""
+
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._ids = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def install(self, session):
+        """Перенос новых имён в кэш после коммита и их забывание при откате"""
+
+        @event.listens_for(session, 'after_commit')
+        def _promote(session):
+            # after_commit срабатывает и при освобождении точки сохранения: имена ждут внешний коммит
+            if session.in_nested_transaction():
+                return
+            pending = session.info.pop(PENDING_KEY, None)
+            if pending:
+                for (table_name, name), (name_id, _) in pending.items():
+                    self._remember(table_name, name, name_id)
+
+        # Срабатывает и при откате точки сохранения, и при откате всей транзакции
+        @event.listens_for(session, 'after_soft_rollback')
+        def _discard(session, previous_transaction):
+            pending = session.info.get(PENDING_KEY)
+            if not pending:
+                return
+            for key, (_, transaction) in list(pending.items()):
+                while transaction is not None and transaction is not previous_transaction:
+                    transaction = transaction.parent
+                if transaction is not None:
+                    del pending[key]
+
+    def _remember(self, table_name, name, name_id):
+        with self._lock:
+            if len(self._ids) >= self.max_entries:
+                self._ids.clear()
+                self._names.clear()
+            self._ids[(table_name, name)] = name_id
+            self._names[(table_name, name_id)] = name
+
+    def intern(self, session, table, name):
+        """id имени в справочнике table; отсутствующее имя добавляется"""
+        name = normalize_name(name)
+        if name is None:
+            return None
+        key = (table.name, name)
+        name_id = self._ids.get(key)
+        if name_id is not None:
+            return name_id
+        pending = session.info.get(PENDING_KEY, {})
+        if key in pending:
+            return pending[key][0]
+
+        with session.no_autoflush:
+            # ON CONFLICT: параллельная вставка того же имени не ломает транзакцию
+            inserted = session.execute(text(
+                f'INSERT INTO {table.name} (name) VALUES (:name) ON CONFLICT (name) DO NOTHING'
+            ), {'name': name}).rowcount
+            name_id = session.execute(select(table.c.id).where(table.c.name == name)).scalar()
+
+        if inserted:
+            current = session() if isinstance(session, scoped_session) else session
+            transaction = current.get_nested_transaction() or current.get_transaction()
+            session.info.setdefault(PENDING_KEY, {})[key] = (name_id, transaction)
+        else:
+            self._remember(table.name, name, name_id)
+        return name_id
+
+    def name_of(self, session, table, name_id):
+        """Имя по id справочника"""
+        if name_id is None:
+            return None
+        name = self._names.get((table.name, name_id))
+        if name is not None:
+            return name
+        for (table_name, pending_name), (pending_id, _) in session.info.get(PENDING_KEY, {}).items():
+            if table_name == table.name and pending_id == name_id:
+                return pending_name
+
+        with session.no_autoflush:
+            name = session.execute(select(table.c.name).where(table.c.id == name_id)).scalar()
+        if name is not None:
+            self._remember(table.name, name, name_id)
+        return name
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+
+
+# ---------------------------------------------------------------------------
+# Миграция со строковых колонок
+# ---------------------------------------------------------------------------
+
+def _columns(connection, table_name):
+    return {column['name'] for column in inspect(connection).get_columns(table_name)}
+
+
+def migrate(connection, lesson_tables, dictionary_tables):
+    """
+    Перевод таблиц занятий со строковых колонок group_name, teacher_name,
+    subject_name на ссылки на справочники (идемпотентно).
+    dictionary_tables: {поле занятия: таблица справочника}.
+    Возвращает число добавленных в справочники имён.
+    """
+    existing_tables = set(inspect(connection).get_table_names())
+    legacy = [t for t in lesson_tables
+              if t.name in existing_tables and set(DICTIONARIES) & _columns(connection, t.name)]
+    if not legacy:
+        return 0
+
+    added = 0
+    for field, (fk_column, _) in DICTIONARIES.items():
+        table = dictionary_tables[field]
+        table.create(connection, checkfirst=True)
+        sources = [t for t in legacy if field in _columns(connection, t.name)]
+
+        # Различных значений мало по сравнению с числом занятий: дедупликация в Python
+        raw_values = set()
+        for t in sources:
+            raw_values.update(row[0] for row in connection.execute(text(
+                f'SELECT DISTINCT {field} FROM {t.name} WHERE {field} IS NOT NULL'
+            )))
+        names = {raw: normalize_name(raw) for raw in raw_values}
+
+        ids = dict(connection.execute(select(table.c.name, table.c.id)).all())
+        new_names = sorted({n for n in names.values() if n and n not in ids})
+        if new_names:
+            connection.execute(table.insert(), [{'name': n} for n in new_names])
+            added += len(new_names)
+            ids = dict(connection.execute(select(table.c.name, table.c.id)).all())
+
+        # Отображение «исходная строка -> id» во временной таблице: одно UPDATE на таблицу
+        connection.execute(text('DROP TABLE IF EXISTS name_map'))
+        connection.execute(text('CREATE TEMPORARY TABLE name_map (raw VARCHAR(200) PRIMARY KEY, id INTEGER)'))
+        mapping = [{'raw': raw, 'id': ids[name]} for raw, name in names.items() if name]
+        if mapping:
+            connection.execute(text('INSERT INTO name_map (raw, id) VALUES (:raw, :id)'), mapping)
+
+        for t in sources:
+            if fk_column not in _columns(connection, t.name):
+                connection.execute(text(
+                    f'ALTER TABLE {t.name} ADD COLUMN {fk_column} INTEGER REFERENCES {table.name}(id)'
+                ))
+            connection.execute(text(
+                f'UPDATE {t.name} SET {fk_column} = (SELECT id FROM name_map WHERE raw = {t.name}.{field})'
+            ))
+            connection.execute(text(f'ALTER TABLE {t.name} DROP COLUMN {field}'))
+            connection.execute(text(
+                f'CREATE INDEX IF NOT EXISTS ix_{t.name}_{fk_column} ON {t.name} ({fk_column})'
+            ))
+        connection.execute(text('DROP TABLE name_map'))
+
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Перевод занятий на справочники преподавателей, групп и дисциплин')
+    parser.parse_args(argv)
+
+    from app import app, db, Lesson, ArchivedLesson, LESSON_DICTIONARY_TABLES
+    import lesson_search
+
+    with app.app_context():
+        db.create_all()
+        with db.engine.begin() as connection:
+            added = migrate(connection, [Lesson.__table__, ArchivedLesson.__table__], LESSON_DICTIONARY_TABLES)
+            lesson_search.rebuild_index(connection)
+    print(f"✅ Справочники заполнены, добавлено имён: {added}")
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,291 @@
+"""
+Информационная система учёта аудиторного фонда
+Поиск занятий по преподавателю, группе и дисциплине
+
+Имена хранятся в справочниках (см. lesson_dictionary.py), поэтому
+триграммный индекс строится по небольшим таблицам справочников, а занятия
+отбираются по целочисленным ссылкам на найденные имена.
+
+PostgreSQL: триграммные GIN-индексы pg_trgm на колонке name справочников.
+SQLite: виртуальные таблицы FTS5 с триграммным токенизатором над
+справочниками; новые имена попадают в них триггером при вставке.
+"""
+
+from sqlalchemy import Connection, bindparam, event, text
+
+from lesson_dictionary import DICTIONARIES
+
+# Поле запроса -> поле занятия
+SEARCH_FIELDS = {
+    'teacher': 'teacher_name',
+    'group': 'group_name',
+    'subject': 'subject_name',
+}
+
+# Индекс по строковым колонкам занятий до перехода на справочники
+LEGACY_FTS_TABLE = 'lessons_fts'
+
+# Горячая таблица и архив прошедших семестров (см. lesson_archive.py)
+LESSON_TABLES = ('lessons', 'lessons_archive')
+
+# Триграммный индекс не помогает для запросов короче трёх символов
+MIN_QUERY_LENGTH = 3
+
+# Порог похожести для нечёткого поиска (как pg_trgm.similarity_threshold)
+SIMILARITY_THRESHOLD = 0.3
+
+
+def _dictionary(field):
+    """(колонка ссылки в занятии, таблица справочника) для поля запроса"""
+    return DICTIONARIES[SEARCH_FIELDS[field]]
+
+
+def _fts_table(table_name):
+    return f'{table_name}_fts'
+
+
+# ---------------------------------------------------------------------------
+# Создание и синхронизация индекса
+# ---------------------------------------------------------------------------
+
+def _existing_tables(connection, names):
+    """Какие из перечисленных таблиц существуют в БД"""
+    if connection.dialect.name == 'postgresql':
+        return [n for n in names
+                if connection.execute(text('SELECT to_regclass(:name)'), {'name': n}).scalar()]
+    return [n for n in names if connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {'name': n}).first()]
+
+
+def _dictionary_tables():
+    return [table_name for _, table_name in DICTIONARIES.values()]
+
+
+def ensure_index(connection):
+    """Создание поисковых индексов по справочникам (идемпотентно)"""
+    dialect = connection.dialect.name
+
+    if dialect == 'postgresql':
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for table in _existing_tables(connection, _dictionary_tables()):
+            connection.execute(text(
+                f'CREATE INDEX IF NOT EXISTS ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)'
+            ))
+
+    elif dialect == 'sqlite':
+        for table in _existing_tables(connection, _dictionary_tables()):
+            fts = _fts_table(table)
+            if _existing_tables(connection, [fts]):
+                continue
+            # Внешнее содержимое: FTS5 хранит только индекс, строки берутся из справочника
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5("
+                f"name, content='{table}', content_rowid='id', tokenize='trigram')"
+            ))
+            # Имена в справочниках не меняются и не удаляются — достаточно триггера на вставку
+            connection.execute(text(
+                f'CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN '
+                f'INSERT INTO {fts}(rowid, name) VALUES (new.id, new.name); END'
+            ))
+            connection.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def _drop_table_index(connection, table):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {_fts_table(table)}_insert'))
+        connection.execute(text(f'DROP TABLE IF EXISTS {_fts_table(table)}'))
+
+
+def drop_index(connection):
+    """Удаление вспомогательных таблиц FTS5 (и индекса до перехода на справочники)"""
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f'DROP TABLE IF EXISTS {LEGACY_FTS_TABLE}'))
+        for table in _dictionary_tables():
+            _drop_table_index(connection, table)
+
+
+def rebuild_index(connection):
+    """Полная перестройка индекса после массовых операций в обход ORM"""
+    drop_index(connection)
+    ensure_index(connection)
+
+
+def install(dictionary_tables):
+    """Подключение индекса к таблицам справочников: DDL при create_all и drop_all"""
+    for dictionary_table in dictionary_tables:
+
+        @event.listens_for(dictionary_table, 'after_create')
+        def _create_index(target, connection, **kw):
+            ensure_index(connection)
+
+        @event.listens_for(dictionary_table, 'before_drop')
+        def _drop_index(target, connection, **kw):
+            _drop_table_index(connection, target.name)
+
+
+# ---------------------------------------------------------------------------
+# Сопоставление строк
+# ---------------------------------------------------------------------------
+
+def _normalize(value):
+    return ' '.join((value or '').casefold().split())
+
+
+def trigrams(value):
+    """Набор триграмм строки по правилам pg_trgm (слова дополняются пробелами)"""
+    result = set()
+    for word in ''.join(ch if ch.isalnum() else ' ' for ch in _normalize(value)).split():
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a, b):
+    """Похожесть двух строк — доля общих триграмм (аналог similarity() из pg_trgm)"""
+    ta, tb = trigrams(a), trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
+
+
+def _fts_phrase(value):
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _fts_query(query, columns, mode):
+    """Выражение MATCH для FTS5"""
+    scope = '{' + ' '.join(columns) + '}'
+    if mode == 'fuzzy':
+        # Кандидаты — строки, разделяющие с запросом хотя бы одну триграмму слова
+        grams = set()
+        for word in _normalize(query).split():
+            grams.update(word[i:i + 3] for i in range(len(word) - 2))
+        if not grams:
+            return None
+        return f"{scope} : ({' OR '.join(_fts_phrase(g) for g in sorted(grams))})"
+    return f'{scope} : {_fts_phrase(_normalize(query))}'
+
+
+def rank_key(name, query, mode='prefix'):
+    """Порядок найденных имён: нечёткий поиск — по убыванию похожести, затем по имени"""
+    if mode == 'fuzzy':
+        return (-similarity(name, query), name)
+    return (name,)
+
+
+def _matches(value, query, mode):
+    if mode == 'fuzzy':
+        return similarity(value, query) >= SIMILARITY_THRESHOLD
+    return _normalize(value).startswith(_normalize(query))
+
+
+# ---------------------------------------------------------------------------
+# Запросы
+# ---------------------------------------------------------------------------
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _dialect_name(session):
+    """Диалект сессии ORM или соединения (шарда)"""
+    bind = session if isinstance(session, Connection) else session.get_bind()
+    return bind.dialect.name
+
+
+def matching_names(session, field, query, mode='prefix'):
+    """Подходящие под запрос имена справочника поля: список (id, имя); session — сессия или соединение"""
+    _, table = _dictionary(field)
+    query = (query or '').strip()
+    if len(query) < MIN_QUERY_LENGTH:
+        return []
+
+    if _dialect_name(session) == 'postgresql':
+        if mode == 'fuzzy':
+            rows = session.execute(text(
+                f'SELECT id, name FROM {table} WHERE name % :q ORDER BY similarity(name, :q) DESC'
+            ), {'q': query})
+        else:
+            rows = session.execute(text(
+                f'SELECT id, name FROM {table} WHERE name ILIKE :q ORDER BY name'
+            ), {'q': _escape_like(query)})
+        return [(row.id, row.name) for row in rows]
+
+    match = _fts_query(query, ['name'], mode)
+    if match is None:
+        return []
+    fts = _fts_table(table)
+    rows = session.execute(text(
+        f'SELECT t.id, t.name FROM {fts} f JOIN {table} t ON t.id = f.rowid WHERE {fts} MATCH :match'
+    ), {'match': match})
+    # Триграммный индекс отдаёт кандидатов, точное условие проверяем по ним
+    result = [(row.id, row.name) for row in rows if _matches(row.name, query, mode)]
+    result.sort(key=lambda item: rank_key(item[1], query, mode))
+    return result
+
+
+def _date_filter(date_from, date_to, alias):
+    conditions, params = [], {}
+    if date_from:
+        conditions.append(f'{alias}.lesson_date >= :date_from')
+        params['date_from'] = date_from
+    if date_to:
+        conditions.append(f'{alias}.lesson_date <= :date_to')
+        params['date_to'] = date_to
+    return conditions, params
+
+
+def _source(columns, include_archive):
+    """Таблица занятий для FROM: горячая или объединение с архивом"""
+    if not include_archive:
+        return 'lessons'
+    select_list = ', '.join(['id', 'lesson_date', 'start_time'] + columns)
+    return '(' + ' UNION ALL '.join(f'SELECT {select_list} FROM {t}' for t in LESSON_TABLES) + ')'
+
+
+def search_lesson_ids(session, query, fields=None, mode='prefix', date_from=None, date_to=None, limit=50,
+                      include_archive=False):
+    """
+    Поиск id занятий по преподавателю, группе или дисциплине.
+    mode: 'prefix' — совпадение начала строки, 'fuzzy' — нечёткое по триграммам.
+    include_archive — искать также в архиве прошедших семестров.
+    Результат упорядочен по дате, времени начала и id.
+    """
+    fields = list(fields or SEARCH_FIELDS)
+    conditions, params = [], {}
+    bind_names = []
+    for field in fields:
+        ids = [name_id for name_id, _ in matching_names(session, field, query, mode)]
+        if ids:
+            fk_column, _ = _dictionary(field)
+            conditions.append(f'l.{fk_column} IN :{fk_column}s')
+            params[f'{fk_column}s'] = ids
+            bind_names.append(f'{fk_column}s')
+    if not conditions:
+        return []
+
+    columns = [_dictionary(field)[0] for field in fields]
+    date_conditions, date_params = _date_filter(date_from, date_to, 'l')
+    params.update(date_params)
+    params['limit'] = limit
+    where = ' AND '.join(['(' + ' OR '.join(conditions) + ')'] + date_conditions)
+    statement = text(
+        f'SELECT l.id FROM {_source(columns, include_archive)} l WHERE {where} '
+        f'ORDER BY l.lesson_date, l.start_time, l.id LIMIT :limit'
+    ).bindparams(*[bindparam(name, expanding=True) for name in bind_names])
+    return [row.id for row in session.execute(statement, params)]
+
+
+def suggest(session, query, field, mode='prefix', limit=10):
+    """Подсказки для автодополнения: имена из справочника поля, подходящие под запрос"""
+    return [name for _, name in matching_names(session, field, query, mode)[:limit]]
+
+
+def merge_suggestions(results, query, mode='prefix', limit=10):
+    """
+    Подсказки по результатам matching_names нескольких БД (шардов): имена
+    без повторов в порядке rank_key, не больше limit.
+    """
+    names = {name for result in results for _, name in result}
+    return sorted(names, key=lambda name: rank_key(name, query, mode))[:limit]
@@ -0,0 +1,321 @@
+"""
+Информационная система учёта аудиторного фонда
+Выгрузка снимка аудиторий и занятий в Parquet для аналитики
+
+Структура каталога выгрузки:
+    classrooms.parquet                — полный снимок аудиторий
+    lessons/YYYY-MM-DD/part-0.parquet — занятия, по разделу на день
+
+Колонка lesson_date хранится внутри файлов (тип date32), поэтому каталоги
+разделов названы без hive-префикса «lesson_date=» — иначе pyarrow и pandas
+добавили бы одноимённую строковую колонку из пути.
+
+Занятия читаются из БД порциями и пишутся группами строк (row groups), поэтому
+вся таблица никогда не держится в памяти. Повторный запуск без параметров
+дописывает только новые дни (и перезаписывает последний выгруженный день), а
+также перевыгружает более ранние дни, занятия которых изменились после
+прошлой выгрузки: курсор журнала изменений (change_feed) хранится в
+_export_state.json. Если курсора нет или журнал уже сжат дальше него,
+перевыгружаются все дни.
+
+При шардировании по корпусам (SHARDS) аудитории и занятия читаются из всех
+шардов сразу: потоки строк шардов сливаются по дню и id в те же дневные
+разделы, а журнал изменений читается из общей БД.
+
+Запуск: python parquet_export.py exports/ [--from 2024-09-01] [--to 2024-12-31] [--full]
+"""
+
+import argparse
+import heapq
+import json
+import os
+import sys
+from contextlib import ExitStack
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import select, union_all
+from sqlalchemy.exc import SQLAlchemyError
+
+import change_feed
+from lesson_dictionary import DICTIONARIES
+
+CLASSROOM_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('number', pa.string()),
+    ('floor', pa.int32()),
+    ('building', pa.string()),
+    ('capacity', pa.int32()),
+    ('area', pa.float64()),
+    ('has_projector', pa.bool_()),
+    ('has_computers', pa.bool_()),
+    ('has_board', pa.bool_()),
+    ('has_air_conditioner', pa.bool_()),
+    ('computers_count', pa.int32()),
+])
+
+LESSON_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('classroom_id', pa.int64()),
+    ('lesson_date', pa.date32()),
+    ('start_time', pa.time32('s')),
+    ('end_time', pa.time32('s')),
+    ('group_name', pa.string()),
+    ('teacher_name', pa.string()),
+    ('subject_name', pa.string()),
+])
+
+CHUNK_SIZE = 50000
+ROW_GROUP_SIZE = 100000
+
+STATE_FILE = '_export_state.json'
+
+
+def _write_atomic(tables, path, schema):
+    """Запись файла через временное имя, чтобы читатели не видели полузаписанный файл"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with pq.ParquetWriter(tmp_path, schema, compression='zstd') as writer:
+        for table in tables:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+
+def _to_table(rows, schema):
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    return pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema
+    )
+
+
+def partition_path(out_dir, day):
+    return os.path.join(out_dir, 'lessons', day.isoformat(), 'part-0.parquet')
+
+
+def exported_dates(out_dir):
+    """Дни, для которых раздел уже выгружен"""
+    root = os.path.join(out_dir, 'lessons')
+    if not os.path.isdir(root):
+        return []
+    days = []
+    for name in os.listdir(root):
+        if os.path.exists(os.path.join(root, name, 'part-0.parquet')):
+            days.append(datetime.strptime(name, '%Y-%m-%d').date())
+    return sorted(days)
+
+
+def read_cursor(out_dir):
+    """Курсор журнала изменений, до которого выгрузка актуальна, или None"""
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)['cursor']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_cursor(out_dir, cursor):
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'cursor': cursor}, f)
+    os.replace(path + '.tmp', path)
+
+
+def exported_lesson_days(out_dir, days):
+    """{id занятия: день} по разделам days (читается только колонка id)"""
+    located = {}
+    for day in days:
+        for lesson_id in pq.read_table(partition_path(out_dir, day), columns=['id']).column('id').to_pylist():
+            located[lesson_id] = day
+    return located
+
+
+def changed_days(connection, change_table, meta_table, out_dir, since):
+    """
+    Выгруженные дни, которые нужно перевыгрузить из-за изменений занятий после
+    курсора since: новый день занятия из журнала и день, в разделе которого
+    оно лежит сейчас (перенос на другую дату, удаление).
+    None — журнал сжат дальше курсора, нужна полная перевыгрузка.
+    """
+    changes = change_feed.entity_changes(connection, change_table, meta_table, 'lesson', since)
+    if changes is None:
+        return None
+    if not changes:
+        return set()
+    located = exported_lesson_days(out_dir, exported_dates(out_dir))
+    days = set()
+    for lesson_id, data in changes:
+        if lesson_id in located:
+            days.add(located[lesson_id])
+        if data and data.get('lesson_date'):
+            days.add(datetime.strptime(data['lesson_date'], '%Y-%m-%d').date())
+    return days
+
+
+def export_classrooms(connections, classrooms_table, out_dir):
+    """Полный снимок аудиторий (таблица небольшая) из соединений connections (шардов) по порядку id"""
+    columns = [classrooms_table.c[name] for name in CLASSROOM_SCHEMA.names]
+    query = select(*columns).order_by(classrooms_table.c.id)
+    rows = list(heapq.merge(*[connection.execute(query).all() for connection in connections],
+                            key=lambda row: row.id))
+    _write_atomic([_to_table(rows, CLASSROOM_SCHEMA)], os.path.join(out_dir, 'classrooms.parquet'), CLASSROOM_SCHEMA)
+    return len(rows)
+
+
+def _lesson_select(table, dictionary_tables):
+    """Колонки занятия в порядке LESSON_SCHEMA; имена — из справочников"""
+    columns, joined = [], table
+    for name in LESSON_SCHEMA.names:
+        if name in dictionary_tables:
+            fk_column, _ = DICTIONARIES[name]
+            dictionary = dictionary_tables[name].alias(f'{table.name}_{name}')
+            joined = joined.outerjoin(dictionary, dictionary.c.id == table.c[fk_column])
+            columns.append(dictionary.c.name.label(name))
+        else:
+            columns.append(table.c[name])
+    return select(*columns).select_from(joined)
+
+
+def export_lessons(connections, lesson_tables, dictionary_tables, out_dir, date_from=None, date_to=None,
+                   chunk_size=CHUNK_SIZE, row_group_size=ROW_GROUP_SIZE, days=None):
+    """
+    Выгрузка занятий по дневным разделам.
+    connections — соединения с БД занятий (шардов); их упорядоченные потоки строк сливаются;
+    lesson_tables — горячая таблица занятий и (при наличии) архив прошедших семестров;
+    dictionary_tables — справочники имён {поле занятия: таблица};
+    days — только эти дни (вместо диапазона).
+    Возвращает словарь {день: число строк} для записанных разделов.
+    """
+    selects = []
+    for table in lesson_tables:
+        part = _lesson_select(table, dictionary_tables)
+        if days is not None:
+            part = part.where(table.c.lesson_date.in_(days))
+        if date_from:
+            part = part.where(table.c.lesson_date >= date_from)
+        if date_to:
+            part = part.where(table.c.lesson_date <= date_to)
+        selects.append(part)
+    query = union_all(*selects).subquery()
+    query = select(query).order_by(query.c.lesson_date, query.c.id)
+
+    results = [connection.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+               for connection in connections]
+    written = {}
+    current_day, writer, tmp_path, buffer = None, None, None, []
+
+    def flush():
+        if buffer:
+            writer.write_table(_to_table(buffer, LESSON_SCHEMA))
+            buffer.clear()
+
+    def close():
+        flush()
+        writer.close()
+        os.replace(tmp_path, partition_path(out_dir, current_day))
+
+    # Строки читаются порциями по chunk_size (yield_per) из всех потоков сразу
+    for row in heapq.merge(*results, key=lambda row: (row.lesson_date, row.id)):
+        day = row.lesson_date
+        if day != current_day:
+            if writer is not None:
+                close()
+            current_day = day
+            path = partition_path(out_dir, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            writer = pq.ParquetWriter(tmp_path, LESSON_SCHEMA, compression='zstd')
+            written[day] = 0
+        buffer.append(tuple(row))
+        written[day] += 1
+        if len(buffer) >= row_group_size:
+            flush()
+
+    if writer is not None:
+        close()
+
+    # Дни, в которых занятий больше нет, не должны оставаться в выгрузке
+    for day in exported_dates(out_dir):
+        if day in written or (days is not None and day not in days):
+            continue
+        if (date_from is None or day >= date_from) and (date_to is None or day <= date_to):
+            path = partition_path(out_dir, day)
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+    return written
+
+
+def export_snapshot(connection, classrooms_table, lesson_tables, dictionary_tables, out_dir,
+                    date_from=None, date_to=None, full=False, change_tables=None, sources=None):
+    """
+    Снимок для аналитики: аудитории целиком и занятия по дням.
+    Без явного диапазона выгружаются дни начиная с последнего уже выгруженного;
+    с change_tables (журнал изменений и его служебная таблица) — ещё и более
+    ранние дни с изменёнными после прошлой выгрузки занятиями.
+    sources — соединения шардов с аудиториями и занятиями (по умолчанию — connection).
+    """
+    sources = sources or [connection]
+    incremental = not full and date_from is None and date_to is None
+    cursor = stale = None
+    if change_tables is not None and (full or incremental):
+        # Курсор берётся до чтения занятий: изменения во время выгрузки попадут и в следующую
+        cursor = change_feed.latest_cursor(connection, *change_tables)
+    if incremental:
+        days = exported_dates(out_dir)
+        if days:
+            date_from = days[-1]
+            if change_tables is not None:
+                since = read_cursor(out_dir)
+                changed = None if since is None else changed_days(connection, *change_tables, out_dir, since)
+                if changed is None:
+                    date_from = None
+                else:
+                    stale = sorted(day for day in changed if day < date_from)
+
+    classrooms_count = export_classrooms(sources, classrooms_table, out_dir)
+    partitions = export_lessons(sources, lesson_tables, dictionary_tables, out_dir,
+                                date_from=date_from, date_to=date_to)
+    if stale:
+        partitions.update(export_lessons(sources, lesson_tables, dictionary_tables, out_dir, days=stale))
+    if cursor is not None:
+        write_cursor(out_dir, cursor)
+    return classrooms_count, partitions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Выгрузка аудиторий и занятий в Parquet')
+    parser.add_argument('out_dir', help='каталог выгрузки')
+    parser.add_argument('--from', dest='date_from', help='первый день занятий (ГГГГ-ММ-ДД)')
+    parser.add_argument('--to', dest='date_to', help='последний день занятий (ГГГГ-ММ-ДД)')
+    parser.add_argument('--full', action='store_true', help='перевыгрузить все дни')
+    args = parser.parse_args(argv)
+
+    date_from = datetime.strptime(args.date_from, '%Y-%m-%d').date() if args.date_from else None
+    date_to = datetime.strptime(args.date_to, '%Y-%m-%d').date() if args.date_to else None
+
+    from app import app, db, shard_map, Classroom, Lesson, ArchivedLesson, ChangeLog, ChangeLogMeta, LESSON_DICTIONARY_TABLES
+
+    try:
+        with app.app_context(), db.engine.connect() as connection, ExitStack() as stack:
+            sources = None
+            if shard_map is not None:
+                sources = [stack.enter_context(shard_map.engines[name].connect()) for name in shard_map.names]
+            classrooms_count, partitions = export_snapshot(
+                connection, Classroom.__table__, [Lesson.__table__, ArchivedLesson.__table__],
+                LESSON_DICTIONARY_TABLES, args.out_dir,
+                date_from=date_from, date_to=date_to, full=args.full,
+                change_tables=(ChangeLog.__table__, ChangeLogMeta.__table__), sources=sources
+            )
+    except (SQLAlchemyError, OSError, pa.ArrowException) as e:
+        print(f"❌ Ошибка выгрузки: {e}")
+        return False
+
+    print(f"✅ Аудиторий: {classrooms_count}")
+    print(f"✅ Разделов занятий: {len(partitions)}, строк: {sum(partitions.values())}")
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
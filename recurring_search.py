@@ -0,0 +1,67 @@
+"""
+Информационная система учёта аудиторного фонда
+Поиск аудиторий, свободных в повторяющееся окно (например, каждый вторник
+9:00–10:30 с сентября по декабрь)
+
+Все занятия, пересекающие окно в нужные дни, выбираются одним запросом по
+диапазону дат; дальше на сервере множества: аудитория свободна во все дни,
+если её нет среди занятых ни в одну из дат. С порогом N% возвращаются и
+аудитории, свободные не реже чем в N% повторений, вместе с датами конфликтов.
+"""
+
+from datetime import timedelta
+
+# Не больше года повторений: защита от случайно огромного диапазона
+MAX_RANGE_DAYS = 366
+
+
+def parse_weekdays(value):
+    """Дни недели (Пн=0 … Вс=6) из списка или строки «0,2»; ValueError при ошибке"""
+    if isinstance(value, str):
+        value = value.split(',')
+    if isinstance(value, int):
+        value = [value]
+    if not value:
+        raise ValueError('Не указаны дни недели')
+    try:
+        weekdays = sorted({int(day) for day in value})
+    except (TypeError, ValueError):
+        raise ValueError('Дни недели должны быть числами от 0 (Пн) до 6 (Вс)')
+    if weekdays[0] < 0 or weekdays[-1] > 6:
+        raise ValueError('Дни недели должны быть числами от 0 (Пн) до 6 (Вс)')
+    return weekdays
+
+
+def occurrences(date_from, date_to, weekdays):
+    """Даты диапазона (включительно), приходящиеся на дни недели weekdays"""
+    wanted = set(weekdays)
+    days = []
+    day = date_from
+    while day <= date_to:
+        if day.weekday() in wanted:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def clash_dates(busy_rows):
+    """Строки (classroom_id, lesson_date) -> {classroom_id: множество занятых дат}"""
+    clashes = {}
+    for classroom_id, lesson_date in busy_rows:
+        clashes.setdefault(classroom_id, set()).add(lesson_date)
+    return clashes
+
+
+def availability(room_ids, clashes, total, min_free_percent=100):
+    """
+    Аудитории, свободные не менее чем в min_free_percent процентов из total
+    повторений: список (id, число свободных повторений, занятые даты по порядку).
+    При 100% это пересечение множеств свободных аудиторий всех дат.
+    """
+    result = []
+    for room_id in room_ids:
+        busy = clashes.get(room_id, ())
+        free = total - len(busy)
+        if total and free * 100 >= min_free_percent * total:
+            result.append((room_id, free, sorted(busy)))
+    return result
@@ -0,0 +1,221 @@
+"""
+Информационная система учёта аудиторного фонда
+Фоновое выполнение тяжёлых отчётов
+
+Отчёт ставится в очередь, выполняется на ограниченном пуле потоков, а
+результат сохраняется на диск и хранится до истечения срока. Состояние
+задач тоже лежит на диске, поэтому опрашивать статус и скачивать результат
+можно через любой процесс-воркер.
+
+Одинаковые запросы, пришедшие, пока задача ещё выполняется, получают ту же
+задачу: десять нажатий «скачать» дают одно вычисление. Занятость ключа
+отмечается файлом с id задачи: он пишется под временным именем и
+атомарно ставится на место через os.link, который не перезаписывает
+существующий файл, поэтому это работает и между процессами, а метку без
+id никто не увидит.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class ReportJobs:
+    """Очередь фоновых отчётов с результатами на диске"""
+
+    def __init__(self, directory, max_workers=2, ttl=3600, stale_after=1800, purge_interval=60):
+        self.directory = directory
+        self.ttl = ttl
+        # Метка занятости ключа старше этого считается оставшейся от упавшего процесса
+        self.stale_after = stale_after
+        # Каталог просматривается в поисках устаревших задач не чаще раза в purge_interval секунд
+        self.purge_interval = purge_interval
+        self._purged_at = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report-job')
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    # -- файлы --------------------------------------------------------------
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _meta_path(self, job_id):
+        return self._path(f'{job_id}.json')
+
+    def _result_path(self, job_id):
+        return self._path(f'{job_id}.result')
+
+    def _claim_path(self, key):
+        return self._path(f'claim-{key}')
+
+    def _write_json(self, path, data):
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _update(self, job_id, **changes):
+        meta = self.get(job_id)
+        meta.update(changes)
+        self._write_json(self._meta_path(job_id), meta)
+        return meta
+
+    # -- API ----------------------------------------------------------------
+
+    @staticmethod
+    def make_key(params):
+        raw = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, job_id):
+        """Состояние задачи или None, если её нет (или срок хранения истёк)"""
+        if not job_id or not all(ch in '0123456789abcdef' for ch in job_id):
+            return None
+        try:
+            with open(self._meta_path(job_id), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        if meta.get('expires') and meta['expires'] < time.time():
+            return None
+        return meta
+
+    def result_path(self, job_id):
+        """Путь к файлу результата готовой задачи"""
+        meta = self.get(job_id)
+        if meta is None or meta['status'] != DONE:
+            return None
+        return self._result_path(job_id)
+
+    def submit(self, params, func):
+        """
+        Постановка отчёта в очередь. func(**params) возвращает (имя файла, bytes).
+        Если такой же отчёт уже ставится или выполняется — возвращается его задача.
+        """
+        key = self.make_key(params)
+
+        with self._lock:
+            now = time.time()
+            if now - self._purged_at >= self.purge_interval:
+                self._purged_at = now
+                self.purge_expired()
+
+            running = self._running_job(key)
+            if running is not None:
+                return running
+
+            job_id = uuid.uuid4().hex
+            meta = {
+                'id': job_id,
+                'key': key,
+                'params': params,
+                'status': QUEUED,
+                'error': None,
+                'filename': None,
+                'created': time.time(),
+                'finished': None,
+                'expires': None,
+            }
+            # Сначала состояние задачи, потом метка: метка всегда указывает на существующую задачу
+            self._write_json(self._meta_path(job_id), meta)
+            if not self._claim(key, job_id):
+                # Другой процесс успел занять ключ между проверкой и созданием
+                os.remove(self._meta_path(job_id))
+                running = self._running_job(key)
+                if running is not None:
+                    return running
+                return self.submit(params, func)
+
+        self._executor.submit(self._run, job_id, key, params, func)
+        return meta
+
+    def _claim(self, key, job_id):
+        """Атомарное создание метки занятости с уже записанным id; False — ключ занят"""
+        tmp_path = f'{self._claim_path(key)}.{job_id}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(job_id)
+        try:
+            os.link(tmp_path, self._claim_path(key))
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+
+    def _running_job(self, key):
+        """Незавершённая задача с этим ключом (по метке занятости)"""
+        claim = self._claim_path(key)
+        try:
+            with open(claim, 'r') as f:
+                job_id = f.read().strip()
+            claimed_at = os.path.getmtime(claim)
+        except FileNotFoundError:
+            return None
+
+        meta = self.get(job_id) if job_id else None
+        if meta is not None and meta['status'] in (QUEUED, RUNNING) and time.time() - claimed_at < self.stale_after:
+            return meta
+        # Метка осталась от завершённой задачи или упавшего процесса
+        try:
+            os.remove(claim)
+        except FileNotFoundError:
+            pass
+        return None
+
+    def _run(self, job_id, key, params, func):
+        self._update(job_id, status=RUNNING)
+        try:
+            filename, data = func(**params)
+            tmp_path = f'{self._result_path(job_id)}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._result_path(job_id))
+            now = time.time()
+            self._update(job_id, status=DONE, filename=filename, finished=now, expires=now + self.ttl)
+        except Exception as e:
+            now = time.time()
+            self._update(job_id, status=FAILED, error=str(e), finished=now, expires=now + self.ttl)
+        finally:
+            self._release(key, job_id)
+
+    def _release(self, key, job_id):
+        """Снятие метки занятости, если она всё ещё принадлежит этой задаче"""
+        claim = self._claim_path(key)
+        try:
+            with open(claim, 'r') as f:
+                if f.read().strip() != job_id:
+                    return
+            os.remove(claim)
+        except FileNotFoundError:
+            pass
+
+    def purge_expired(self):
+        """Удаление задач и результатов с истёкшим сроком хранения"""
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            if meta.get('expires') and meta['expires'] < now:
+                for path in (entry.path, self._result_path(meta['id'])):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,325 @@
+"""
+Информационная система учёта аудиторного фонда
+Профилирование отдельных запросов по требованию
+
+Общие метрики не показывают, на что ушло время одного медленного запроса:
+SQL, создание ORM-объектов, to_dict, шаблоны Jinja или кодирование CSV.
+Запрос администратора с заголовком X-Profile: 1 (или параметром profile=1)
+выполняется под детерминированным профилировщиком (sys.setprofile, только в
+потоке этого запроса) и сохраняет:
+
+    * дерево вызовов: время с вложенными вызовами и собственное, число
+      вызовов; к узлам кода приложения привязаны выполненные в них SQL;
+    * разбивку собственного времени по категориям (приложение, ORM,
+      SQLAlchemy, драйвер БД, Jinja, CSV, Flask) и самые затратные функции.
+
+Профили хранятся в памяти процесса (последние keep штук); diff() сравнивает
+два профиля по категориям и функциям.
+"""
+
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+
+from slow_query import normalize
+
+# Глубже этого уровня узлы не создаются (время учитывается в последнем узле)
+MAX_DEPTH = 150
+# Узлы короче порога не выводятся, если в них не выполнялся SQL
+MIN_NODE_MS = 0.2
+MAX_SQL_LENGTH = 300
+HOTSPOTS = 15
+
+# Категория по пути файла или модулю встроенной функции (первое совпадение)
+CATEGORIES = [
+    ('sqlalchemy/orm', 'ORM'),
+    ('sqlalchemy', 'SQLAlchemy'),
+    ('flask_sqlalchemy', 'SQLAlchemy'),
+    ('sqlite3', 'Драйвер БД'),
+    ('psycopg2', 'Драйвер БД'),
+    ('jinja2', 'Jinja'),
+    ('markupsafe', 'Jinja'),
+    ('csv', 'CSV'),
+    ('werkzeug', 'Flask'),
+    ('flask', 'Flask'),
+]
+
+_local = threading.local()
+
+
+def requested(headers, args):
+    """Просит ли запрос профилирования (X-Profile: 1 или profile=1)"""
+    return headers.get('X-Profile') == '1' or args.get('profile') == '1'
+
+
+class _Node:
+    __slots__ = ('label', 'category', 'project', 'calls', 'total', 'children', 'sql')
+
+    def __init__(self, label, category, project):
+        self.label = label
+        self.category = category
+        self.project = project
+        self.calls = 0
+        self.total = 0.0
+        self.children = {}
+        self.sql = []
+
+
+class CallTreeTracer:
+    """Дерево вызовов текущего потока между start() и stop()"""
+
+    def __init__(self, root_dir, label='<запрос>'):
+        self.root_dir = os.path.normcase(os.path.abspath(root_dir)) + os.sep
+        self.root = _Node(label, 'Приложение', True)
+        self._stack = []
+        self._skipped = 0
+        self._labels = {}
+
+    def start(self):
+        self._stack = [(self.root, time.perf_counter())]
+        self.root.calls = 1
+        sys.setprofile(self._callback)
+
+    def stop(self):
+        sys.setprofile(None)
+        now = time.perf_counter()
+        # Незавершённые узлы (например, сам обработчик after_request) закрываются сейчас
+        while self._stack:
+            node, started = self._stack.pop()
+            node.total += now - started
+        return self.root
+
+    def current_project_node(self):
+        """Ближайший к вершине стека узел кода приложения"""
+        for node, _ in reversed(self._stack):
+            if node.project:
+                return node
+        return self.root
+
+    def _describe(self, key, filename, name, line):
+        """Подпись, категория и принадлежность приложению (кэш по объекту кода)"""
+        described = self._labels.get(key)
+        if described is None:
+            # Встроенные функции и модули без файла (<frozen …>) — только по имени
+            path = os.path.normcase(filename) if filename and not filename.startswith('<') else ''
+            project = bool(path) and path.startswith(self.root_dir) and 'site-packages' not in path
+            if project:
+                label = f'{os.path.relpath(path, self.root_dir)}:{name}:{line}'
+            elif path:
+                short = path.split('site-packages' + os.sep)[-1] if 'site-packages' in path else os.path.basename(path)
+                label = f'{short}:{name}:{line}'
+            else:
+                label = f'{filename}:{name}' if filename else name
+            described = (label, 'Приложение' if project else category_of(label), project)
+            self._labels[key] = described
+        return described
+
+    def _callback(self, frame, event_name, arg):
+        if event_name == 'call':
+            code = frame.f_code
+            # Собственные функции профилировщика (обработчики событий SQL) не показываются
+            if code.co_filename == __file__:
+                return
+            info = (code, code.co_filename, getattr(code, 'co_qualname', code.co_name), code.co_firstlineno)
+        elif event_name == 'c_call':
+            module = getattr(arg, '__module__', None) or type(getattr(arg, '__self__', None)).__module__
+            name = getattr(arg, '__qualname__', repr(arg))
+            info = ((module, name), '', f'{module}.{name}', 0)
+        else:
+            if event_name == 'return' and frame.f_code.co_filename == __file__:
+                return
+            if self._skipped:
+                self._skipped -= 1
+                return
+            # Возврат из кадров, начатых до start(), не снимает корень
+            if len(self._stack) > 1:
+                node, started = self._stack.pop()
+                node.total += time.perf_counter() - started
+            return
+
+        if len(self._stack) >= MAX_DEPTH:
+            self._skipped += 1
+            return
+        parent = self._stack[-1][0]
+        label, category, project = self._describe(*info)
+        node = parent.children.get(label)
+        if node is None:
+            node = parent.children[label] = _Node(label, category, project)
+        node.calls += 1
+        self._stack.append((node, time.perf_counter()))
+
+
+def category_of(label):
+    for marker, category in CATEGORIES:
+        if marker in label:
+            return category
+    return 'Прочее'
+
+
+def _self_ms(node):
+    return max(0.0, node.total - sum(child.total for child in node.children.values())) * 1000
+
+
+def tree_to_dict(node, min_ms=MIN_NODE_MS):
+    """Узел дерева в виде словаря; короткие ветви без SQL отбрасываются"""
+    children = [tree_to_dict(child, min_ms) for child in
+                sorted(node.children.values(), key=lambda n: n.total, reverse=True)]
+    children = [c for c in children if c['total_ms'] >= min_ms or c['sql_count']]
+    return {
+        'name': node.label,
+        'category': node.category,
+        'calls': node.calls,
+        'total_ms': round(node.total * 1000, 3),
+        'self_ms': round(_self_ms(node), 3),
+        'sql': node.sql,
+        'sql_count': len(node.sql) + sum(c['sql_count'] for c in children),
+        'children': children,
+    }
+
+
+def _walk(node):
+    yield node
+    for child in node.children.values():
+        yield from _walk(child)
+
+
+def summarize(root):
+    """Собственное время по категориям и самые затратные функции"""
+    categories = {}
+    functions = {}
+    for node in _walk(root):
+        self_ms = _self_ms(node)
+        categories[node.category] = categories.get(node.category, 0.0) + self_ms
+        entry = functions.setdefault(node.label, {'name': node.label, 'category': node.category,
+                                                  'calls': 0, 'self_ms': 0.0})
+        entry['calls'] += node.calls
+        entry['self_ms'] += self_ms
+    hotspots = sorted(functions.values(), key=lambda f: f['self_ms'], reverse=True)
+    for entry in hotspots:
+        entry['self_ms'] = round(entry['self_ms'], 3)
+    return ({name: round(ms, 3) for name, ms in sorted(categories.items(), key=lambda c: -c[1])},
+            hotspots)
+
+
+def diff(a, b, limit=HOTSPOTS * 2):
+    """Сравнение двух профилей: итоги, категории и функции по модулю разницы"""
+    def delta(a_value, b_value):
+        return {'a': a_value, 'b': b_value, 'delta': round(b_value - a_value, 3)}
+
+    a_functions = {f['name']: f for f in a['functions']}
+    b_functions = {f['name']: f for f in b['functions']}
+    functions = []
+    for name in set(a_functions) | set(b_functions):
+        a_ms = a_functions[name]['self_ms'] if name in a_functions else 0.0
+        b_ms = b_functions[name]['self_ms'] if name in b_functions else 0.0
+        functions.append(dict(delta(a_ms, b_ms), name=name))
+    functions.sort(key=lambda f: abs(f['delta']), reverse=True)
+
+    categories = sorted(set(a['categories']) | set(b['categories']))
+    return {
+        'a': {key: a[key] for key in ('id', 'method', 'path', 'started')},
+        'b': {key: b[key] for key in ('id', 'method', 'path', 'started')},
+        'total_ms': delta(a['total_ms'], b['total_ms']),
+        'sql_count': delta(a['sql_count'], b['sql_count']),
+        'sql_ms': delta(a['sql_ms'], b['sql_ms']),
+        'categories': {name: delta(a['categories'].get(name, 0.0), b['categories'].get(name, 0.0))
+                       for name in categories},
+        'functions': functions[:limit],
+    }
+
+
+class RequestProfiler:
+    """Профили запросов этого процесса; SQL привязывается к узлам дерева"""
+
+    def __init__(self, root_dir, keep=50):
+        self.root_dir = root_dir
+        self._profiles = deque(maxlen=keep)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            if getattr(_local, 'tracer', None) is not None:
+                conn.info.setdefault('profile_start', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            tracer = getattr(_local, 'tracer', None)
+            starts = conn.info.get('profile_start')
+            if tracer is None or not starts:
+                return
+            elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+            # Нормализация текста — после остановки, чтобы не попасть в дерево вызовов
+            tracer.current_project_node().sql.append({
+                'statement': statement,
+                'ms': round(elapsed_ms, 3),
+                'rows': cursor.rowcount,
+            })
+
+    @staticmethod
+    def active():
+        return getattr(_local, 'tracer', None) is not None
+
+    def start(self, method, path):
+        """Начало профилирования запроса в текущем потоке"""
+        tracer = CallTreeTracer(self.root_dir, f'{method} {path}')
+        _local.tracer = tracer
+        _local.request = (method, path, datetime.now())
+        tracer.start()
+
+    def stop(self, status=None):
+        """Окончание профилирования; id сохранённого профиля или None"""
+        tracer = getattr(_local, 'tracer', None)
+        if tracer is None:
+            return None
+        root = tracer.stop()
+        _local.tracer = None
+        method, path, started = _local.request
+
+        sql = [span for node in _walk(root) for span in node.sql]
+        for span in sql:
+            shape = normalize(span['statement'])
+            span['statement'] = shape if len(shape) <= MAX_SQL_LENGTH else shape[:MAX_SQL_LENGTH] + '…'
+        tree = tree_to_dict(root)
+        categories, functions = summarize(root)
+        profile = {
+            'id': next(self._ids),
+            'method': method,
+            'path': path,
+            'status': status,
+            'started': started.isoformat(timespec='seconds'),
+            'total_ms': tree['total_ms'],
+            'sql_count': len(sql),
+            'sql_ms': round(sum(span['ms'] for span in sql), 3),
+            'categories': categories,
+            'hotspots': functions[:HOTSPOTS],
+            'functions': functions,
+            'tree': tree,
+        }
+        with self._lock:
+            self._profiles.append(profile)
+        return profile['id']
+
+    def get(self, profile_id):
+        with self._lock:
+            for profile in self._profiles:
+                if profile['id'] == profile_id:
+                    return profile
+        return None
+
+    def recent(self):
+        """Сводка последних профилей, новые первыми (без деревьев)"""
+        keys = ('id', 'method', 'path', 'status', 'started', 'total_ms', 'sql_count', 'sql_ms', 'categories')
+        with self._lock:
+            return [{key: p[key] for key in keys} for p in reversed(self._profiles)]
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
@@ -0,0 +1,96 @@
+"""
+Информационная система учёта аудиторного фонда
+Подбор наиболее подходящих свободных аудиторий (top-K по оценке соответствия)
+
+Оценка — штраф, чем меньше, тем лучше:
+    * лишние места: (вместимость - нужно мест) / нужно мест;
+    * неиспользуемое оборудование: проектор, компьютеры, кондиционер,
+      которые не запрошены, но заняли бы редкую аудиторию;
+    * удалённость от предпочтительного корпуса и этажа.
+
+Аудитории хранятся в индексе, отсортированном по вместимости. Штраф за лишние
+места растёт вместе с вместимостью, а остальные слагаемые неотрицательны,
+поэтому перебор останавливается, как только штраф за места очередной
+аудитории не меньше худшей оценки среди уже отобранных K.
+"""
+
+import heapq
+from bisect import bisect_left
+
+SURPLUS_WEIGHT = 1.0
+EQUIPMENT_WEIGHTS = {
+    'has_projector': 0.3,
+    'has_computers': 0.5,
+    'has_air_conditioner': 0.2,
+}
+OTHER_BUILDING_PENALTY = 1.0
+FLOOR_PENALTY = 0.1
+
+
+class RoomIndex:
+    """Аудитории, отсортированные по вместимости (строки с атрибутами Classroom)"""
+
+    def __init__(self, rooms):
+        self.rooms = sorted(rooms, key=lambda r: (r.capacity or 0, r.id))
+        self.capacities = [r.capacity or 0 for r in self.rooms]
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def from_capacity(self, seats):
+        """Аудитории вместимостью не меньше seats в порядке возрастания вместимости"""
+        for i in range(bisect_left(self.capacities, seats), len(self.rooms)):
+            yield self.rooms[i]
+
+
+def surplus_penalty(capacity, seats):
+    return SURPLUS_WEIGHT * ((capacity or 0) - seats) / max(seats, 1)
+
+
+def fit_score(room, seats, required=(), preferred_building=None, preferred_floor=None):
+    """Штраф соответствия аудитории запросу и его составляющие"""
+    surplus = surplus_penalty(room.capacity, seats)
+    equipment = sum(weight for flag, weight in EQUIPMENT_WEIGHTS.items()
+                    if flag not in required and getattr(room, flag))
+
+    distance = 0.0
+    if preferred_building and room.building != preferred_building:
+        distance = OTHER_BUILDING_PENALTY
+    elif preferred_floor is not None and room.floor is not None:
+        distance = FLOOR_PENALTY * abs(room.floor - preferred_floor)
+
+    return surplus + equipment + distance, {
+        'surplus': round(surplus, 3),
+        'equipment': round(equipment, 3),
+        'distance': round(distance, 3),
+    }
+
+
+def recommend(index, seats, busy_ids, top_k, required=(), building=None,
+              preferred_building=None, preferred_floor=None):
+    """
+    Лучшие top_k свободных аудиторий: список (штраф, составляющие, аудитория)
+    по возрастанию штрафа. required — обязательное оборудование, building —
+    обязательный корпус; занятые аудитории (busy_ids) пропускаются.
+    """
+    # Куча из худших отобранных: (-штраф, -id) — наверху самый плохой кандидат
+    best = []
+    scanned = 0
+    for room in index.from_capacity(seats):
+        if len(best) >= top_k and surplus_penalty(room.capacity, seats) >= -best[0][0]:
+            break
+        scanned += 1
+        if room.id in busy_ids or (building and room.building != building):
+            continue
+        if any(not getattr(room, flag) for flag in required):
+            continue
+
+        score, details = fit_score(room, seats, required, preferred_building, preferred_floor)
+        item = (-score, -room.id, details, room)
+        if len(best) < top_k:
+            heapq.heappush(best, item)
+        elif item[:2] > best[0][:2]:
+            heapq.heapreplace(best, item)
+
+    ranked = sorted(best, key=lambda item: (-item[0], -item[1]))
+    return [(-neg_score, details, room) for neg_score, _, details, room in ranked], scanned
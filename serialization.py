@@ -0,0 +1,84 @@
+"""
+Информационная система учёта аудиторного фонда
+Быстрая сериализация ответов JSON API
+
+Данные выбираются из БД только нужными колонками в виде простых строк
+(без создания ORM-объектов), кодируются orjson, если он установлен,
+и сжимаются gzip, когда клиент это поддерживает.
+"""
+
+import gzip
+import json
+
+from flask import Response, request
+from werkzeug.http import parse_accept_header
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Ответы меньше этого размера не сжимаются: выигрыш меньше накладных расходов
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+
+def dumps(payload):
+    """Кодирование в JSON (bytes, UTF-8)"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def parse_fields(value, allowed):
+    """
+    Разбор параметра fields (строка «a,b,c» или список) в список полей.
+    Пустое значение — все поля. Неизвестные поля — ValueError.
+    """
+    if not value:
+        return list(allowed)
+    if isinstance(value, str):
+        value = value.split(',')
+    fields = [f.strip() for f in value if f and f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+    return fields
+
+
+def format_date(value):
+    return value.strftime('%Y-%m-%d') if value is not None else None
+
+
+def format_time(value):
+    return value.strftime('%H:%M') if value is not None else None
+
+
+def rows_to_dicts(rows, fields, formatters=None):
+    """Строки результата запроса -> список словарей с полями fields в том же порядке"""
+    formatters = formatters or {}
+    converters = [(i, name, formatters.get(name)) for i, name in enumerate(fields)]
+    result = []
+    for row in rows:
+        item = {}
+        for i, name, convert in converters:
+            item[name] = convert(row[i]) if convert else row[i]
+        result.append(item)
+    return result
+
+
+def accepts_gzip(accept_encoding):
+    """Разрешает ли заголовок Accept-Encoding ответ gzip (с учётом q=0 и «*»)"""
+    return parse_accept_header(accept_encoding).quality('gzip') > 0
+
+
+def json_response(payload, status=200):
+    """Ответ JSON с быстрым кодированием и gzip-сжатием по Accept-Encoding"""
+    body = dumps(payload)
+    response = Response(body, status=status, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+
+    if len(body) >= GZIP_MIN_SIZE and accepts_gzip(request.headers.get('Accept-Encoding')):
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,36 @@
+"""
+Информационная система учёта аудиторного фонда
+Запуск сервера разработки: python serve.py [init-db] (или python app.py)
+
+Приложение импортируется только внутри main(). Дочерние процессы пула
+моделирования (spawn) заново выполняют главный модуль родителя; когда
+главный модуль — этот файл, им достаются две строки импорта, а не всё
+приложение с движком БД, очередями и потоками.
+"""
+
+import sys
+
+
+def main(argv=None):
+    from app import app, init_db, schema_ready
+
+    argv = sys.argv[1:] if argv is None else argv
+    print("=" * 60)
+    print("ЗАПУСК ПРИЛОЖЕНИЯ")
+    print("=" * 60)
+
+    # Инициализация базы данных — отдельной командой: python app.py init-db
+    if argv == ['init-db']:
+        return init_db()
+
+    if not schema_ready():
+        print("❌ Таблицы не созданы: выполните python app.py init-db")
+        return False
+    print("🚀 Сервер запущен на http://127.0.0.1:5000")
+    print("=" * 60)
+    app.run(debug=True, host='127.0.0.1', port=5000)
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
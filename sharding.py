@@ -0,0 +1,430 @@
+"""
+Информационная система учёта аудиторного фонда
+Шардирование аудиторий и занятий по корпусам
+
+Когда одна инсталляция обслуживает несколько кампусов, аудитории и занятия
+каждого корпуса хранятся в своей БД (шарде), и поиск с проверкой
+пересечений в одном корпусе не конкурирует с остальными. Карта шардов
+ShardMap сопоставляет корпусу (Classroom.building) имя шарда:
+
+    * запрос по одному корпусу выполняется только в его шарде;
+    * запрос по всем корпусам рассылается шардам параллельно (fan_out), а
+      упорядоченные результаты сливаются (merge_sorted);
+    * занятие (и его архивная копия) хранится в шарде своей аудитории,
+      поэтому проверка пересечений и вставка идут в одной транзакции шарда;
+    * справочники преподавателей, групп и дисциплин есть в каждом шарде.
+
+Транзакция записи begin() сразу берёт блокировку записи шарда (SQLite —
+BEGIN IMMEDIATE, PostgreSQL — advisory-блокировка), поэтому проверки и
+выдача id внутри неё не пересекаются с записями других процессов.
+
+id новых строк, в том числе строк справочников, выдаются из диапазона шарда
+(номер шарда * SHARD_ID_STRIDE) счётчиком shard_sequences, поэтому они
+уникальны во всей инсталляции и не переиспользуются после удаления или
+архивирования. Строки, перенесённые из общей БД командой split, сохраняют
+прежние id.
+
+Для проверки на одной машине шардами служат несколько файлов SQLite:
+    SHARDS='{"shards": {"north": "sqlite:///north.db", "south": "sqlite:///south.db"},
+             "buildings": {"A": "north", "B": "south"}, "default": "north"}'
+    python sharding.py          # создание схемы шардов и перенос данных из общей БД
+"""
+
+import argparse
+import heapq
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from sqlalchemy import (
+    BigInteger, Column, MetaData, String, Table, create_engine, delete, event, exists, func, insert,
+    or_, select, update,
+)
+
+import classroom_batch
+import lesson_archive
+from lesson_dictionary import DICTIONARIES, normalize_name
+
+# Ширина диапазона id одного шарда; перенесённые из общей БД id должны быть меньше
+SHARD_ID_STRIDE = 10 ** 9
+
+# Последний выданный id каждой таблицы шарда
+SEQUENCES = Table(
+    'shard_sequences', MetaData(),
+    Column('name', String(50), primary_key=True),
+    Column('value', BigInteger, nullable=False),
+)
+
+# Ключ advisory-блокировки записи в шард PostgreSQL
+WRITE_LOCK_KEY = 4404
+
+
+def _immediate_writes(engine):
+    """SQLite: транзакции записи begin() открываются BEGIN IMMEDIATE, чтения — обычным BEGIN"""
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        # Транзакциями управляет SQLAlchemy (событие begin), а не модуль sqlite3
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, 'begin')
+    def _on_begin(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE' if conn.get_execution_options().get('shard_write') else 'BEGIN')
+
+
+class ShardMap:
+    """
+    Карта шардов: shards — {имя: URL БД}, buildings — {корпус: имя шарда},
+    default — шард для корпусов, которых нет в карте (None — такие корпуса запрещены).
+    """
+
+    def __init__(self, shards, buildings, default=None, max_workers=8, engine_options=None):
+        unknown = (set(buildings.values()) | ({default} if default else set())) - set(shards)
+        if unknown:
+            raise ValueError(f'Неизвестные шарды: {", ".join(sorted(unknown))}')
+        self.names = sorted(shards)
+        self.buildings = dict(buildings)
+        self.default = default
+        self.engines = {name: create_engine(url, **(engine_options or {})) for name, url in shards.items()}
+        for engine in self.engines.values():
+            if engine.dialect.name == 'sqlite':
+                _immediate_writes(engine)
+        # Номер шарда задаёт его диапазон id; нумерация по имени не зависит от порядка в конфигурации
+        self.numbers = {name: i + 1 for i, name in enumerate(self.names)}
+        self._write_locks = {name: threading.Lock() for name in self.names}
+        self._executor = ThreadPoolExecutor(max_workers=min(max_workers, len(self.names)),
+                                            thread_name_prefix='shard')
+
+    @classmethod
+    def from_config(cls, config, **options):
+        """Карта из словаря или строки JSON с ключами shards, buildings, default"""
+        if isinstance(config, str):
+            config = json.loads(config)
+        return cls(config['shards'], config.get('buildings', {}), config.get('default'), **options)
+
+    def for_building(self, building):
+        name = self.buildings.get(building, self.default)
+        if name is None:
+            raise ValueError(f'Корпус {building} не сопоставлен ни одному шарду')
+        return name
+
+    def shards_for(self, building=None):
+        """Шарды, которые нужно опросить: один для корпуса, все — без корпуса"""
+        return [self.for_building(building)] if building else list(self.names)
+
+    @contextmanager
+    def begin(self, name):
+        """
+        Транзакция записи в шард с блокировкой записи с первого оператора.
+        Потоки этого процесса ждут друг друга на замке, другие процессы — на блокировке БД.
+        """
+        with self._write_locks[name], self.engines[name].connect() as connection:
+            connection.execution_options(shard_write=True)
+            with connection.begin():
+                if connection.dialect.name == 'postgresql':
+                    connection.execute(select(func.pg_advisory_xact_lock(WRITE_LOCK_KEY)))
+                yield connection
+
+    @contextmanager
+    def begin_all(self, names):
+        """Транзакции записи в несколько шардов: {имя: соединение}; шарды блокируются в порядке имён"""
+        with ExitStack() as stack:
+            yield {name: stack.enter_context(self.begin(name)) for name in sorted(set(names))}
+
+    def fan_out(self, func, names=None):
+        """
+        func(connection) в каждом из шардов names (по умолчанию — во всех)
+        параллельно; {имя шарда: результат}. Один шард опрашивается без пула потоков.
+        """
+        names = list(self.names if names is None else names)
+
+        def run(name):
+            with self.engines[name].connect() as connection:
+                return func(connection)
+
+        if len(names) == 1:
+            return {names[0]: run(names[0])}
+        futures = {name: self._executor.submit(run, name) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def locate(self, table, row_id):
+        """Шард, в котором есть строка table с этим id, или None"""
+        return self.locate_all(table, [row_id]).get(row_id)
+
+    def locate_all(self, table, row_ids):
+        """{id: шард} для тех из row_ids, что есть в table одного из шардов"""
+        row_ids = set(row_ids)
+        if not row_ids:
+            return {}
+        found = self.fan_out(lambda c: c.execute(select(table.c.id).where(table.c.id.in_(row_ids))).scalars().all())
+        return {row_id: name for name in self.names for row_id in found[name]}
+
+    def allocate_ids(self, connection, name, table, count=1):
+        """count новых id таблицы в диапазоне шарда (вызывается внутри begin()); range"""
+        low = self.numbers[name] * SHARD_ID_STRIDE
+        current = connection.execute(select(SEQUENCES.c.value).where(SEQUENCES.c.name == table.name)).scalar()
+        if current is None:
+            # Первая выдача в шарде: счётчик продолжает id, уже записанные в диапазон шарда
+            current = connection.execute(select(func.max(table.c.id)).where(
+                table.c.id > low, table.c.id < low + SHARD_ID_STRIDE)).scalar() or low
+            connection.execute(insert(SEQUENCES).values(name=table.name, value=current + count))
+        else:
+            connection.execute(update(SEQUENCES).where(SEQUENCES.c.name == table.name)
+                               .values(value=current + count))
+        if current + count >= low + SHARD_ID_STRIDE:
+            raise ValueError(f'Исчерпан диапазон id таблицы {table.name} в шарде {name}')
+        return range(current + 1, current + count + 1)
+
+    def create_all(self, tables):
+        """Создание таблиц (и счётчика id) во всех шардах"""
+        for engine in self.engines.values():
+            for table in list(tables) + [SEQUENCES]:
+                table.create(engine, checkfirst=True)
+
+    def dispose(self):
+        self._executor.shutdown(wait=False)
+        for engine in self.engines.values():
+            engine.dispose()
+
+
+def merge_sorted(results, key):
+    """Слияние упорядоченных по key списков строк разных шардов"""
+    return list(heapq.merge(*results, key=key))
+
+
+def _intern(connection, shard_map, name, table, value):
+    """id имени в справочнике шарда name; отсутствующее имя добавляется с id из диапазона шарда"""
+    value = normalize_name(value)
+    if value is None:
+        return None
+    name_id = connection.execute(select(table.c.id).where(table.c.name == value)).scalar()
+    if name_id is None:
+        name_id = shard_map.allocate_ids(connection, name, table)[0]
+        connection.execute(insert(table).values(id=name_id, name=value))
+    return name_id
+
+
+def _has_lessons(connection, lesson_tables, classroom_id):
+    """Есть ли у аудитории занятия в любой из таблиц занятий шарда"""
+    return connection.execute(select(or_(
+        *[exists().where(table.c.classroom_id == classroom_id) for table in lesson_tables]
+    ))).scalar()
+
+
+def add_classroom(shard_map, classrooms, values):
+    """Новая аудитория в шарде своего корпуса; (имя шарда, id)"""
+    name = shard_map.for_building(values.get('building'))
+    with shard_map.begin(name) as connection:
+        row_id = shard_map.allocate_ids(connection, name, classrooms)[0]
+        connection.execute(insert(classrooms).values(dict(values, id=row_id)))
+    return name, row_id
+
+
+def update_classroom(shard_map, classrooms, lesson_tables, classroom_id, values):
+    """
+    Изменение аудитории. Если новый корпус относится к другому шарду,
+    аудитория без занятий переносится туда с тем же id.
+    Возвращает 'updated', 'not_found' или 'busy' (перенос аудитории с занятиями).
+    """
+    name = shard_map.locate(classrooms, classroom_id)
+    if name is None:
+        return 'not_found'
+    target = shard_map.for_building(values['building']) if 'building' in values else name
+    if target == name:
+        with shard_map.begin(name) as connection:
+            connection.execute(update(classrooms).where(classrooms.c.id == classroom_id).values(values))
+        return 'updated'
+
+    with shard_map.begin_all([name, target]) as connections:
+        source = connections[name]
+        if _has_lessons(source, lesson_tables, classroom_id):
+            return 'busy'
+        row = source.execute(select(classrooms).where(classrooms.c.id == classroom_id)).mappings().one()
+        connections[target].execute(insert(classrooms).values(dict(row, **values)))
+        source.execute(delete(classrooms).where(classrooms.c.id == classroom_id))
+    return 'updated'
+
+
+def delete_classroom(shard_map, classrooms, lesson_tables, classroom_id):
+    """Удаление аудитории без занятий; 'deleted', 'not_found' или 'busy'"""
+    name = shard_map.locate(classrooms, classroom_id)
+    if name is None:
+        return 'not_found'
+    with shard_map.begin(name) as connection:
+        if _has_lessons(connection, lesson_tables, classroom_id):
+            return 'busy'
+        connection.execute(delete(classrooms).where(classrooms.c.id == classroom_id))
+    return 'deleted'
+
+
+def apply_batch(shard_map, classrooms, lesson_tables, creates, updates, deletes, atomic=False):
+    """
+    Разобранный пакет classroom_batch по шардам: создания — в шард корпуса,
+    обновления и удаления — в шард аудитории, все шарды пакета — в begin_all.
+    Смена корпуса на корпус другого шарда в пакете не допускается.
+    Возвращает (результаты, изменения для журнала); при atomic и ошибке в
+    любом шарде — BatchRejected, и не применяется ни один шард.
+    """
+    located = shard_map.locate_all(classrooms, {i for _, i, _ in updates} | {i for _, i in deletes})
+    results = []
+    parts = {}
+
+    def part(name):
+        return parts.setdefault(name, ([], [], []))
+
+    for index, values in creates:
+        try:
+            part(shard_map.for_building(values['building']))[0].append((index, values))
+        except ValueError as e:
+            results.append(classroom_batch.rejected(index, 'create', None, str(e)))
+    # Аудитории, которой нет ни в одном шарде, первый шард ответит not_found
+    for index, classroom_id, values in updates:
+        name = located.get(classroom_id, shard_map.names[0])
+        try:
+            if classroom_id in located and 'building' in values and shard_map.for_building(values['building']) != name:
+                raise ValueError('Перенос аудитории в корпус другого шарда — только по одной аудитории')
+        except ValueError as e:
+            results.append(classroom_batch.rejected(index, 'update', classroom_id, str(e)))
+            continue
+        part(name)[1].append((index, classroom_id, values))
+    for index, classroom_id in deletes:
+        part(located.get(classroom_id, shard_map.names[0]))[2].append((index, classroom_id))
+
+    changes = []
+    with shard_map.begin_all(parts) as connections:
+        for name, (shard_creates, shard_updates, shard_deletes) in parts.items():
+            connection = connections[name]
+
+            def allocate(count, connection=connection, name=name):
+                return shard_map.allocate_ids(connection, name, classrooms, count)
+
+            applied, shard_changes = classroom_batch.apply(
+                connection, classrooms, lesson_tables, shard_creates, shard_updates, shard_deletes, allocate)
+            results += applied
+            changes += shard_changes
+        results.sort(key=lambda r: r['index'])
+        if atomic and any(r['status'] in ('error', 'not_found') for r in results):
+            raise classroom_batch.BatchRejected(results)
+    return results, changes
+
+
+def book_lesson(shard_map, classrooms, lessons, archive, dictionary_tables, values):
+    """
+    Занятие в шарде аудитории values['classroom_id']: проверка архива и
+    пересечений и вставка в одной транзакции. values содержит group_name,
+    teacher_name, subject_name строками. Возвращает (статус, id): статус
+    'added', 'conflict' или 'archived' (семестр уже в архиве шарда);
+    ValueError — аудитории нет ни в одном шарде.
+    """
+    name = shard_map.locate(classrooms, values['classroom_id'])
+    if name is None:
+        raise ValueError('Аудитория не найдена')
+    row = {k: v for k, v in values.items() if k not in DICTIONARIES}
+
+    with shard_map.begin(name) as connection:
+        boundary = lesson_archive.archive_boundary(connection, archive)
+        if boundary is not None and values['lesson_date'] < lesson_archive.term_bounds(boundary)[1]:
+            return 'archived', None
+        clash = connection.execute(select(exists().where(
+            lessons.c.classroom_id == values['classroom_id'],
+            lessons.c.lesson_date == values['lesson_date'],
+            lessons.c.start_time < values['end_time'],
+            lessons.c.end_time > values['start_time'],
+        ))).scalar()
+        if clash:
+            return 'conflict', None
+        for field, (fk_column, _) in DICTIONARIES.items():
+            row[fk_column] = _intern(connection, shard_map, name, dictionary_tables[field], values.get(field))
+        row['id'] = shard_map.allocate_ids(connection, name, lessons)[0]
+        connection.execute(insert(lessons).values(row))
+    return 'added', row['id']
+
+
+def delete_lesson(shard_map, lessons, lesson_id):
+    """Удаление занятия из шарда его аудитории; дата удалённого занятия или None, если его нет"""
+    name = shard_map.locate(lessons, lesson_id)
+    if name is None:
+        return None
+    with shard_map.begin(name) as connection:
+        return connection.execute(
+            delete(lessons).where(lessons.c.id == lesson_id).returning(lessons.c.lesson_date)
+        ).scalar()
+
+
+def split(source, shard_map, classrooms, lessons, archive, dictionary_tables):
+    """
+    Перенос аудиторий, занятий и архива занятий из общей БД (source —
+    соединение) в шарды по корпусам; содержимое шардов заменяется.
+    Справочники копируются в каждый шард целиком. Занятия несуществующих
+    аудиторий (SQLite без foreign_keys=ON их допускает) не переносятся:
+    ValueError со списком их id до изменения шардов.
+    Возвращает {имя шарда: (аудиторий, занятий, занятий в архиве)}.
+    """
+    shard_map.create_all(list(dictionary_tables.values()) + [classrooms, lessons, archive])
+    dictionaries = {table: [dict(r._mapping) for r in source.execute(select(table))]
+                    for table in dictionary_tables.values()}
+    rooms = [dict(r._mapping) for r in source.execute(select(classrooms).order_by(classrooms.c.id))]
+    room_shard = {room['id']: shard_map.for_building(room['building']) for room in rooms}
+
+    by_shard = {name: ([], {lessons: [], archive: []}) for name in shard_map.names}
+    for room in rooms:
+        by_shard[room_shard[room['id']]][0].append(room)
+    orphans = {}
+    for table in (lessons, archive):
+        for lesson in source.execute(select(table).order_by(table.c.id)):
+            lesson = dict(lesson._mapping)
+            if lesson['classroom_id'] not in room_shard:
+                orphans.setdefault(table.name, []).append(lesson['id'])
+                continue
+            by_shard[room_shard[lesson['classroom_id']]][1][table].append(lesson)
+    if orphans:
+        raise ValueError('Занятия без аудитории, удалите или исправьте их: ' + '; '.join(
+            f'{name} — id {", ".join(map(str, ids))}' for name, ids in orphans.items()))
+
+    counts = {}
+    for name, (shard_rooms, shard_lessons) in by_shard.items():
+        with shard_map.begin(name) as connection:
+            for table in [archive, lessons, classrooms] + list(dictionary_tables.values()):
+                connection.execute(delete(table))
+            for table, rows in dictionaries.items():
+                if rows:
+                    connection.execute(insert(table), rows)
+            if shard_rooms:
+                connection.execute(insert(classrooms), shard_rooms)
+            for table, rows in shard_lessons.items():
+                if rows:
+                    connection.execute(insert(table), rows)
+        counts[name] = (len(shard_rooms), len(shard_lessons[lessons]), len(shard_lessons[archive]))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Создание шардов по корпусам и перенос в них данных из общей БД')
+    parser.add_argument('--config', help='карта шардов JSON (по умолчанию — переменная окружения SHARDS)')
+    args = parser.parse_args(argv)
+
+    from app import app, db, ArchivedLesson, Classroom, Lesson, LESSON_DICTIONARY_TABLES
+
+    config = args.config or app.config['SHARDS']
+    if not config:
+        print("❌ Карта шардов не задана: переменная окружения SHARDS или --config")
+        return False
+    shard_map = ShardMap.from_config(config)
+    try:
+        with app.app_context(), db.engine.connect() as source:
+            counts = split(source, shard_map, Classroom.__table__, Lesson.__table__, ArchivedLesson.__table__,
+                           LESSON_DICTIONARY_TABLES)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return False
+    finally:
+        shard_map.dispose()
+    for name, (rooms, lessons, archived) in counts.items():
+        print(f"✅ Шард {name}: аудиторий {rooms}, занятий {lessons}, в архиве {archived}")
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,188 @@
+"""
+Информационная система учёта аудиторного фонда
+Журнал медленных запросов
+
+Время каждого SQL-запроса измеряется событиями движка SQLAlchemy
+(before/after_cursor_execute). Запросы дольше порога записываются в файл с
+ротацией одной строкой JSON: нормализованный текст (литералы и параметры
+заменены на ?), параметры, маршрут, из которого выполнен запрос, и время.
+
+План выполнения (EXPLAIN, в SQLite — EXPLAIN QUERY PLAN) снимается один раз
+на «форму» запроса — нормализованный текст — и хранится вместе со
+статистикой формы: число, суммарное и наибольшее время. Статистика живёт в
+памяти процесса и показывается на странице администратора.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+# Длинные значения параметров обрезаются, чтобы не раздувать журнал
+MAX_PARAM_LENGTH = 200
+MAX_PARAMS = 50
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\([^)]+\)s|%s|:\w+|\$\d+|\?')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACES = re.compile(r'\s+')
+
+_EXPLAINABLE = ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT')
+
+
+def normalize(statement):
+    """Форма запроса: литералы и параметры -> ?, списки IN (?, ?, …) -> (?...), пробелы схлопнуты"""
+    shape = _STRING.sub('?', statement)
+    shape = _PLACEHOLDER.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = _IN_LIST.sub('(?...)', shape)
+    return _SPACES.sub(' ', shape).strip()
+
+
+def _short(value):
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= MAX_PARAM_LENGTH else text[:MAX_PARAM_LENGTH] + '…'
+
+
+def format_params(parameters, executemany=False):
+    """Параметры запроса в виде, пригодном для JSON (обрезанные)"""
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    if isinstance(parameters, dict):
+        return {key: _short(value) for key, value in list(parameters.items())[:MAX_PARAMS]}
+    return [_short(value) for value in list(parameters or ())[:MAX_PARAMS]]
+
+
+def current_route():
+    """Маршрут, из которого выполняется запрос: «GET /schedule», иначе 'background'"""
+    if not has_request_context():
+        return 'background'
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    return f'{request.method} {rule}'
+
+
+class SlowQueryLog:
+    """Запись медленных запросов движка и статистика по формам запросов"""
+
+    def __init__(self, threshold_ms=200, log_path=None, max_bytes=5 * 1024 * 1024,
+                 backup_count=3, explain=True, max_shapes=500):
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.max_shapes = max_shapes
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+        self.logger = logging.getLogger(f'slow_query.{id(self)}')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if log_path:
+            handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count,
+                                          encoding='utf-8', delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+
+    def install(self, engine):
+        """Подключение к движку (или классу Engine — тогда ко всем движкам)"""
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_start', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('slow_query_start')
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000
+        if elapsed_ms < self.threshold_ms:
+            return
+        self.record(conn, statement, parameters, executemany, elapsed_ms)
+
+    def record(self, conn, statement, parameters, executemany, elapsed_ms):
+        shape = normalize(statement)
+        route = current_route()
+        with self._lock:
+            stats = self._shapes.get(shape)
+            if stats is None:
+                if len(self._shapes) >= self.max_shapes:
+                    # Вытесняется форма с наименьшим суммарным временем
+                    del self._shapes[min(self._shapes, key=lambda s: self._shapes[s]['total_ms'])]
+                stats = self._shapes[shape] = {
+                    'shape': shape, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'routes': {}, 'plan': None, 'last_params': None,
+                }
+                capture_plan = self.explain
+            else:
+                capture_plan = False
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['routes'][route] = stats['routes'].get(route, 0) + 1
+            stats['last_params'] = format_params(parameters, executemany)
+
+        # План снимается вне блокировки: это ещё один запрос к БД
+        if capture_plan:
+            plan = self._explain(conn, statement, parameters, executemany)
+            with self._lock:
+                stats['plan'] = plan
+
+        self.logger.info(json.dumps({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'duration_ms': round(elapsed_ms, 2),
+            'route': route,
+            'shape': shape,
+            'params': format_params(parameters, executemany),
+            'plan': stats['plan'],
+        }, ensure_ascii=False, default=str))
+
+    def _explain(self, conn, statement, parameters, executemany):
+        """
+        План запроса в текущей транзакции. Выполняется курсором DBAPI напрямую,
+        поэтому события движка (и этот журнал) его не видят.
+        """
+        if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        dialect = conn.dialect.name
+        prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+
+        cursor = conn.connection.cursor()
+        try:
+            if dialect == 'postgresql':
+                # Ошибка в PostgreSQL прерывает транзакцию, поэтому — внутри точки сохранения
+                cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute(prefix + statement, parameters)
+                rows = cursor.fetchall()
+            except Exception as e:
+                if dialect == 'postgresql':
+                    cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                return [f'Не удалось получить план: {e}']
+            finally:
+                if dialect == 'postgresql':
+                    cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return [' | '.join(str(value) for value in row) for row in rows]
+        finally:
+            cursor.close()
+
+    def stats(self):
+        """Формы запросов по убыванию суммарного времени"""
+        with self._lock:
+            items = [dict(s, routes=dict(s['routes'])) for s in self._shapes.values()]
+        for item in items:
+            item['total_ms'] = round(item['total_ms'], 2)
+            item['max_ms'] = round(item['max_ms'], 2)
+            item['avg_ms'] = round(item['total_ms'] / item['count'], 2)
+        items.sort(key=lambda s: s['total_ms'], reverse=True)
+        return items
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
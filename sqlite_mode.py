@@ -0,0 +1,150 @@
+"""
+Информационная система учёта аудиторного фонда
+Рабочий режим SQLite: WAL, настройки соединений и единственный писатель
+
+В SQLite одновременно пишет только одно соединение. Если писателей много,
+они мешают друг другу до ошибки «database is locked», а в режиме журнала
+по умолчанию читатели ещё и ждут писателя. Рабочий режим:
+
+    * каждое соединение получает PRAGMA: WAL (читатели не блокируются
+      писателем), synchronous=NORMAL (в WAL это безопасно при сбое
+      приложения), кэш страниц, mmap и busy_timeout;
+    * транзакции открываются явно (BEGIN), как рекомендует SQLAlchemy для
+      pysqlite, — иначе не работают точки сохранения;
+    * все записи выполняет один поток-писатель из очереди WriteQueue. Он
+      забирает накопившиеся задания и фиксирует их одним коммитом (group
+      commit); каждое задание — в своей точке сохранения, так что ошибка
+      одного не отменяет остальные.
+"""
+
+import queue
+import threading
+from concurrent.futures import Future
+
+from sqlalchemy import event
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,          # ~64 МБ кэша страниц на соединение
+    'mmap_size': 268435456,        # 256 МБ файла БД отображаются в память
+    'busy_timeout': 5000,          # мс ожидания блокировки вместо немедленной ошибки
+    'temp_store': 'MEMORY',
+    'wal_autocheckpoint': 1000,
+}
+
+_writer = threading.local()
+
+
+def in_writer_thread():
+    return getattr(_writer, 'active', False)
+
+
+def configure_engine(engine, pragmas=None):
+    """Настройки рабочего режима для всех соединений движка SQLite"""
+    pragmas = dict(PRAGMAS, **(pragmas or {}))
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_connection, connection_record):
+        # Транзакциями управляет SQLAlchemy (событие begin), а не модуль sqlite3
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def _on_begin(conn):
+        # Писатель сразу берёт блокировку записи: без повышения блокировки посреди транзакции
+        conn.exec_driver_sql('BEGIN IMMEDIATE' if in_writer_thread() else 'BEGIN')
+
+    return _on_connect, _on_begin
+
+
+class _Job:
+    def __init__(self, func):
+        self.func = func
+        self.future = Future()
+
+
+class WriteQueue:
+    """
+    Очередь записей с единственным потоком-писателем.
+    func задания выполняется в потоке писателя с его сессией session
+    (scoped_session) и не вызывает commit сам; результат func — простое
+    значение (например, id), а не объекты сессии писателя.
+    """
+
+    def __init__(self, session, context_factory=None, max_batch=100, max_wait_ms=2):
+        self.session = session
+        self.context_factory = context_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='sqlite-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, func):
+        """Постановка записи в очередь; Future с результатом func после коммита"""
+        job = _Job(func)
+        self._queue.put(job)
+        return job.future
+
+    def shutdown(self, timeout=None):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        job = self._queue.get()
+        if job is None:
+            return None
+        batch = [job]
+        # Задания, пришедшие за время ожидания, уходят в тот же коммит
+        while len(batch) < self.max_batch:
+            try:
+                job = self._queue.get(timeout=self.max_wait)
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _loop(self):
+        _writer.active = True
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if self.context_factory is not None:
+                with self.context_factory():
+                    self._commit_batch(batch)
+            else:
+                self._commit_batch(batch)
+
+    def _commit_batch(self, batch):
+        session = self.session
+        done = []
+        try:
+            for job in batch:
+                try:
+                    with session.begin_nested():
+                        result = job.func()
+                except Exception as e:
+                    job.future.set_exception(e)
+                else:
+                    done.append((job, result))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for job, _ in done:
+                job.future.set_exception(e)
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            return
+        finally:
+            session.remove()
+        for job, result in done:
+            job.future.set_result(result)
@@ -0,0 +1,136 @@
+"""
+Информационная система учёта аудиторного фонда
+Быстрый холодный старт
+
+Обслуживающий процесс при запуске не обращается к БД (таблицы, миграции и
+тестовые данные создаёт однократная команда `flask --app app init-db`) и
+не импортирует тяжёлые библиотеки отчётов: модули из HEAVY_MODULES
+подключаются через lazy_import() и загружаются при первом обращении к
+атрибуту, то есть при первом запросе соответствующего отчёта. Загрузка
+идёт под замком: потоки, одновременно обратившиеся к ещё не загруженному
+модулю, ждут её окончания и не видят модуль инициализированным наполовину.
+
+Замер времени до первого ответа (запуск процесса -> первый HTTP 200):
+    python startup.py [--runs 5] [--path /] [--command "uvicorn asgi:application --port {port}"]
+"""
+
+import argparse
+import importlib.util
+import os
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import types
+import urllib.error
+import urllib.request
+
+# Библиотеки, которые не должны загружаться при старте обслуживающего процесса
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'openpyxl')
+
+DEFAULT_COMMAND = '{python} -m flask --app app run --port {port}'
+
+
+# Замок загрузки ленивых модулей; повторный вход нужен для вложенных ленивых импортов
+_LOAD_LOCK = threading.RLock()
+# id модулей, которые сейчас выполняются (загружающий поток читает их атрибуты напрямую)
+_loading = set()
+
+
+class _LazyModule(types.ModuleType):
+    """Модуль, код которого выполняется при первом обращении к атрибуту"""
+
+    def __getattribute__(self, attr):
+        if type(self) is _LazyModule:
+            with _LOAD_LOCK:
+                # Повторная проверка: модуль мог загрузить поток, который держал замок
+                if type(self) is _LazyModule and id(self) not in _loading:
+                    _loading.add(id(self))
+                    try:
+                        object.__getattribute__(self, '__spec__').loader.exec_module(self)
+                        self.__class__ = types.ModuleType
+                    finally:
+                        _loading.discard(id(self))
+        return object.__getattribute__(self, attr)
+
+
+def lazy_import(name):
+    """Модуль name, который выполнится при первом обращении к его атрибуту"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'Модуль {name} не найден')
+    module = importlib.util.module_from_spec(spec)
+    module.__class__ = _LazyModule
+    sys.modules[name] = module
+    return module
+
+
+def loaded_heavy_modules():
+    """Какие из тяжёлых библиотек уже загружены в этом процессе"""
+    return [name for name in HEAVY_MODULES if name in sys.modules]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_request(command=DEFAULT_COMMAND, path='/', timeout=30.0, cwd=None):
+    """Секунды от запуска процесса сервера до первого успешного ответа на path"""
+    port = _free_port()
+    args = [part.format(python=sys.executable, port=port) for part in shlex.split(command)]
+    url = f'http://127.0.0.1:{port}{path}'
+    started = time.perf_counter()
+    process = subprocess.Popen(args, cwd=cwd or os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f'Сервер завершился с кодом {process.returncode}')
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError(f'Нет ответа от {url} за {timeout} с')
+    finally:
+        process.terminate()
+        try:
+            process.wait(5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замер времени до первого ответа сервера')
+    parser.add_argument('--runs', type=int, default=5, help='число запусков (по умолчанию 5)')
+    parser.add_argument('--path', default='/', help='адрес первого запроса (по умолчанию /)')
+    parser.add_argument('--command', default=DEFAULT_COMMAND,
+                        help='команда запуска сервера; {python} и {port} подставляются')
+    args = parser.parse_args(argv)
+
+    timings = []
+    for run in range(1, args.runs + 1):
+        try:
+            seconds = time_to_first_request(args.command, args.path)
+        except (OSError, RuntimeError, TimeoutError) as e:
+            print(f"❌ {e}")
+            return False
+        timings.append(seconds)
+        print(f"Запуск {run}: {seconds * 1000:.0f} мс")
+
+    print(f"✅ Время до первого ответа: медиана {statistics.median(timings) * 1000:.0f} мс, "
+          f"минимум {min(timings) * 1000:.0f} мс")
+    return True
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
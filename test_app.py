@@ -4,7 +4,7 @@
 """
 
 import pytest
-from app import app, db, Classroom, Lesson
+from app import app, db, admission_control, Classroom, Lesson, ArchivedLesson
 from datetime import date, time, timedelta
 
 @pytest.fixture
@@ -13,6 +13,7 @@ def client():
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['WTF_CSRF_ENABLED'] = False
+    admission_control.reset()
     
     with app.app_context():
         db.create_all()
@@ -122,5 +123,1181 @@ def test_generate_report(client):
     print("✓ Отчёты генерируются успешно")
 
 
+def test_search_lessons(client):
+    """Тест 6: Поиск занятий по преподавателю и автодополнение"""
+    with app.app_context():
+        classroom = Classroom.query.first()
+        db.session.add_all([
+            Lesson(classroom_id=classroom.id, lesson_date=date.today(),
+                   start_time=time(9, 0), end_time=time(10, 30),
+                   group_name='ИС-21', teacher_name='Иванов И.И.', subject_name='Математика'),
+            Lesson(classroom_id=classroom.id, lesson_date=date.today() + timedelta(days=1),
+                   start_time=time(9, 0), end_time=time(10, 30),
+                   group_name='П-31', teacher_name='Петрова А.С.', subject_name='Физика'),
+        ])
+        db.session.commit()
+
+    response = client.get(f'/api/lessons/search?q=иван&by=teacher&date_from={date.today().isoformat()}')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert [l['teacher_name'] for l in result] == ['Иванов И.И.']
+    assert result[0]['classroom_number'] == '101'
+
+    # Прежний параметр fields= для области поиска продолжает работать
+    response = client.get(f'/api/lessons/search?q=иван&fields=teacher&date_from={date.today().isoformat()}')
+    assert response.get_json() == result
+
+    # Нечёткий поиск находит фамилию с опечаткой
+    response = client.get('/api/lessons/search?q=Петрава&mode=fuzzy')
+    assert [l['teacher_name'] for l in response.get_json()] == ['Петрова А.С.']
+
+    response = client.get('/api/lessons/suggest?q=физ&field=subject')
+    assert response.get_json() == ['Физика']
+    print("✓ Поиск занятий работает")
+
+
+def test_occupancy_heatmap(client):
+    """Тест 7: Тепловая карта загруженности по дням недели и слотам"""
+    monday = date.today() - timedelta(days=date.today().weekday())
+    with app.app_context():
+        classroom = Classroom.query.first()
+        db.session.add(Lesson(classroom_id=classroom.id, lesson_date=monday,
+                              start_time=time(9, 0), end_time=time(10, 15),
+                              group_name='ИС-21', teacher_name='Иванов И.И.', subject_name='Математика'))
+        db.session.commit()
+
+    response = client.get(f'/api/reports/heatmap?date_from={monday.isoformat()}'
+                          f'&day_start=08:00&day_end=12:00&slot_minutes=30')
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result['rows'] == ['A-101']
+    assert result['shape'] == [1, 7, 8]
+    # Понедельник: 08:00 и 08:30 свободны, 09:00 и 09:30 заняты, 10:00 — на половину
+    assert result['values'][:8] == [0, 0, 100, 100, 50, 0, 0, 0]
+    assert sum(result['values'][8:]) == 0
+    print("✓ Тепловая карта строится")
+
+
+def test_parquet_export(client, tmp_path):
+    """Тест 8: Выгрузка в Parquet с разделами по дням"""
+    import pyarrow.parquet as pq
+    from parquet_export import export_snapshot, exported_dates
+    from app import ChangeLog, ChangeLogMeta, LESSON_DICTIONARY_TABLES
+
+    today = date.today()
+    with app.app_context():
+        classroom = Classroom.query.first()
+        for offset in (0, 1):
+            db.session.add(Lesson(classroom_id=classroom.id, lesson_date=today + timedelta(days=offset),
+                                  start_time=time(9, 0), end_time=time(10, 30),
+                                  group_name='ИС-21', teacher_name='Иванов И.И.', subject_name='Математика'))
+        db.session.commit()
+
+        change_tables = (ChangeLog.__table__, ChangeLogMeta.__table__)
+        with db.engine.connect() as connection:
+            classrooms_count, partitions = export_snapshot(
+                connection, Classroom.__table__, [Lesson.__table__], LESSON_DICTIONARY_TABLES, str(tmp_path),
+                change_tables=change_tables)
+        assert classrooms_count == 1
+        assert exported_dates(str(tmp_path)) == [today, today + timedelta(days=1)]
+
+        # Повторный запуск дописывает последний и новые дни, а также изменённые ранее выгруженные
+        db.session.add(Lesson(classroom_id=classroom.id, lesson_date=today + timedelta(days=2),
+                              start_time=time(9, 0), end_time=time(10, 30),
+                              group_name='П-31', teacher_name='Петрова А.С.', subject_name='Физика'))
+        Lesson.query.filter_by(lesson_date=today).one().teacher_name = 'Сидоров П.П.'
+        db.session.commit()
+        with db.engine.connect() as connection:
+            _, partitions = export_snapshot(
+                connection, Classroom.__table__, [Lesson.__table__], LESSON_DICTIONARY_TABLES, str(tmp_path),
+                change_tables=change_tables)
+        assert sorted(partitions) == [today, today + timedelta(days=1), today + timedelta(days=2)]
+
+        # Без новых изменений ранние дни не перевыгружаются
+        with db.engine.connect() as connection:
+            _, partitions = export_snapshot(
+                connection, Classroom.__table__, [Lesson.__table__], LESSON_DICTIONARY_TABLES, str(tmp_path),
+                change_tables=change_tables)
+        assert sorted(partitions) == [today + timedelta(days=2)]
+
+    table = pq.read_table(str(tmp_path / 'lessons'))
+    assert table.num_rows == 3
+    assert table.column('teacher_name').to_pylist().count('Иванов И.И.') == 1
+    assert table.column('teacher_name').to_pylist().count('Сидоров П.П.') == 1
+    print("✓ Выгрузка в Parquet работает")
+
+
+def test_archive_past_terms(client):
+    """Тест 9: Архивирование прошедших семестров и чтение архива"""
+    from lesson_archive import archive_before, term_bounds
+
+    past_day = term_bounds(date.today())[0] - timedelta(days=30)
+    with app.app_context():
+        classroom = Classroom.query.first()
+        db.session.add_all([
+            Lesson(classroom_id=classroom.id, lesson_date=past_day,
+                   start_time=time(9, 0), end_time=time(10, 30),
+                   group_name='ИС-21', teacher_name='Иванов И.И.', subject_name='Математика'),
+            Lesson(classroom_id=classroom.id, lesson_date=date.today(),
+                   start_time=time(9, 0), end_time=time(10, 30),
+                   group_name='П-31', teacher_name='Петрова А.С.', subject_name='Физика'),
+        ])
+        db.session.commit()
+
+        with db.engine.begin() as connection:
+            moved = archive_before(connection, Lesson.__table__, ArchivedLesson.__table__, date.today())
+        assert moved == 1
+        assert Lesson.query.count() == 1
+        assert ArchivedLesson.query.count() == 1
+
+    # Архив читается, только когда диапазон его задевает
+    response = client.get(f'/schedule?date={past_day.isoformat()}')
+    assert 'Математика' in response.get_data(as_text=True)
+    response = client.get(f'/api/lessons/search?q=иванов&date_from={past_day.isoformat()}')
+    assert [l['lesson_date'] for l in response.get_json()] == [past_day.isoformat()]
+
+    # В архивный семестр занятие добавить нельзя, в том числе после его последнего занятия
+    for day in (past_day, term_bounds(date.today())[0] - timedelta(days=1)):
+        client.post('/schedule/add', data={
+            'classroom_id': '1', 'lesson_date': day.isoformat(),
+            'start_time': '12:00', 'end_time': '13:00',
+            'group_name': 'ИС-21', 'teacher_name': 'Иванов И.И.', 'subject_name': 'Математика'
+        })
+    with app.app_context():
+        assert Lesson.query.count() == 1
+    print("✓ Архивирование семестров работает")
+
+
+def test_json_fields_and_gzip(client):
+    """Тест 10: Выбор полей и gzip-сжатие JSON API"""
+    import gzip
+    import json
+
+    data = {
+        'date': date.today().isoformat(),
+        'start_time': '09:00',
+        'end_time': '10:30',
+        'fields': ['id', 'number']
+    }
+    response = client.post('/api/search-free-classrooms', json=data)
+    assert response.status_code == 200
+    assert response.get_json() == [{'id': 1, 'number': '101'}]
+
+    response = client.get('/api/classrooms/occupancy-preview?fields=number,lessons_count,occupancy_rate')
+    assert response.get_json() == [{'number': '101', 'lessons_count': 0, 'occupancy_rate': 0.0}]
+
+    response = client.get('/api/classrooms/occupancy-preview?fields=unknown')
+    assert response.status_code == 400
+
+    with app.app_context():
+        db.session.add_all([
+            Classroom(number=str(200 + i), floor=2, building='B', capacity=30, area=40.0)
+            for i in range(30)
+        ])
+        db.session.commit()
+    del data['fields']
+    response = client.post('/api/search-free-classrooms', json=data, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.data))) == 31
+    print("✓ Выбор полей и сжатие ответов работают")
+
+
+def test_fragment_cache(client):
+    """Тест 11: Кэш фрагментов расписания сбрасывается маршрутами записи"""
+    today = date.today().isoformat()
+    assert 'Математика' not in client.get(f'/schedule?date={today}').get_data(as_text=True)
+
+    # Вставка в обход ORM и журнала изменений не сбрасывает кэш — фрагмент берётся из кэша
+    with app.app_context():
+        from app import Subject, names
+        db.session.execute(Lesson.__table__.insert().values(
+            classroom_id=1, lesson_date=date.today(), start_time=time(9, 0), end_time=time(10, 30),
+            subject_id=names.intern(db.session, Subject.__table__, 'Математика')))
+        db.session.commit()
+    assert 'Математика' not in client.get(f'/schedule?date={today}').get_data(as_text=True)
+
+    # Запись другого воркера видна по журналу изменений, хотя версии этого процесса не менялись
+    with app.app_context():
+        db.session.add(Lesson(classroom_id=1, lesson_date=date.today(), start_time=time(15, 0),
+                              end_time=time(16, 30), group_name='ИС-22', subject_name='Химия'))
+        db.session.commit()
+    page = client.get(f'/schedule?date={today}').get_data(as_text=True)
+    assert 'Математика' in page and 'Химия' in page
+
+    # Маршрут добавления занятия повышает версию данных
+    client.post('/schedule/add', data={
+        'classroom_id': '1', 'lesson_date': today, 'start_time': '12:00', 'end_time': '13:00',
+        'group_name': 'П-31', 'teacher_name': 'Петрова А.С.', 'subject_name': 'Физика'
+    })
+    page = client.get(f'/schedule?date={today}').get_data(as_text=True)
+    assert 'Математика' in page and 'Физика' in page
+    print("✓ Кэш фрагментов работает")
+
+
+def test_report_jobs(client, tmp_path, monkeypatch):
+    """Тест 12: Фоновая генерация отчёта и объединение одинаковых запросов"""
+    import threading
+    import time as time_module
+    from app import report_queue
+    from report_jobs import ReportJobs
+
+    # Задачи приложения тоже пишутся во временный каталог, а не в instance/
+    jobs_dir = tmp_path / 'app-jobs'
+    jobs_dir.mkdir()
+    monkeypatch.setitem(app.config, 'REPORT_JOBS_DIR', str(jobs_dir))
+    monkeypatch.setattr(report_queue, 'directory', str(jobs_dir))
+
+    # Десять одинаковых запросов во время выполнения дают одно вычисление
+    release, calls = threading.Event(), []
+
+    def slow_report(report_type):
+        calls.append(report_type)
+        release.wait(5)
+        return 'report.csv', b'data'
+
+    queue = ReportJobs(str(tmp_path / 'jobs'), max_workers=1)
+    jobs = [queue.submit({'report_type': 'occupancy'}, slow_report) for _ in range(10)]
+    assert len({j['id'] for j in jobs}) == 1
+    release.set()
+    queue.shutdown()
+    assert calls == ['occupancy']
+    assert open(queue.result_path(jobs[0]['id']), 'rb').read() == b'data'
+
+    response = client.post('/api/reports/jobs', json={'type': 'occupancy'})
+    assert response.status_code == 202
+    job = response.get_json()
+
+    for _ in range(100):
+        job = client.get(job['status_url']).get_json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time_module.sleep(0.05)
+    assert job['status'] == 'done'
+
+    response = client.get(job['download_url'])
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == 'text/csv; charset=utf-8'
+    assert '101' in response.data.decode('utf-8-sig')
+
+    assert (jobs_dir / f"{job['id']}.result").exists()
+
+    assert client.post('/api/reports/jobs', json={'type': 'unknown'}).status_code == 400
+    assert client.get('/api/reports/jobs/0123abcd').status_code == 404
+    print("✓ Фоновые отчёты работают")
+
+
+def test_recommend_classrooms(client):
+    """Тест 13: Подбор лучших свободных аудиторий с ограничением top-K"""
+    from app import room_index
+    import room_ranking
+
+    with app.app_context():
+        db.session.add_all([
+            Classroom(number='201', floor=2, building='A', capacity=20, area=30.0),
+            Classroom(number='301', floor=3, building='A', capacity=60, area=90.0),
+            Classroom(number='302', floor=3, building='A', capacity=100, area=120.0),
+            Classroom(number='102', floor=1, building='B', capacity=25, area=30.0),
+        ])
+        db.session.commit()
+
+    data = {
+        'date': date.today().isoformat(),
+        'start_time': '09:00',
+        'end_time': '10:30',
+        'min_capacity': 15,
+        'recommend': True,
+        'top_k': 2,
+        'preferred_building': 'A',
+        'fields': ['number']
+    }
+    response = client.post('/api/search-free-classrooms', json=data)
+    assert response.status_code == 200
+    result = response.get_json()
+    # 201: мало лишних мест; 101: лишние места и проектор; 102 — в другом корпусе
+    assert [r['number'] for r in result] == ['201', '101']
+    assert result[0]['fit_score'] < result[1]['fit_score']
+
+    # Перебор по индексу вместимости останавливается, не доходя до больших аудиторий
+    with app.app_context():
+        ranked, scanned = room_ranking.recommend(room_index(), 15, set(), 2, preferred_building='A')
+    assert scanned < 5
+
+    # Запись в обход маршрутов (другой процесс, SQL) тоже сбрасывает индекс
+    with app.app_context():
+        db.session.execute(db.delete(Classroom).where(Classroom.number == '201'))
+        db.session.commit()
+    result = client.post('/api/search-free-classrooms', json=data).get_json()
+    assert [r['number'] for r in result] == ['101', '102']
+    print("✓ Подбор аудиторий работает")
+
+
+def test_change_feed(client):
+    """Тест 14: Журнал изменений и инкрементальная синхронизация"""
+    from datetime import datetime as datetime_module
+    from app import ChangeLog, ChangeLogMeta
+    import change_feed
+
+    start = client.get('/api/changes?since=0').get_json()
+    cursor = start['cursor']
+
+    with app.app_context():
+        room = Classroom(number='202', floor=2, building='A', capacity=40, area=50.0)
+        db.session.add(room)
+        db.session.commit()
+        room.capacity = 45
+        db.session.commit()
+        room_id = room.id
+        db.session.delete(room)
+        db.session.commit()
+
+    result = client.get(f'/api/changes?since={cursor}').get_json()
+    assert [(c['entity'], c['id'], c['op']) for c in result['changes']] == [
+        ('classroom', room_id, 'upsert'), ('classroom', room_id, 'upsert'), ('classroom', room_id, 'delete')
+    ]
+    assert result['changes'][1]['data']['capacity'] == 45
+    assert result['has_more'] is False
+
+    # Постраничное чтение продолжается с возвращённого курсора
+    page = client.get(f'/api/changes?since={cursor}&limit=2').get_json()
+    assert page['has_more'] is True and len(page['changes']) == 2
+    rest = client.get(f"/api/changes?since={page['cursor']}").get_json()
+    assert [c['op'] for c in rest['changes']] == ['delete']
+
+    # Сжатие: перекрытые записи удаляются, старые — с границей для пересинхронизации
+    with app.app_context():
+        db.session.query(ChangeLog).update({'created_at': datetime_module(2000, 1, 1)})
+        db.session.commit()
+        with db.engine.begin() as connection:
+            superseded, truncated = change_feed.compact(
+                connection, ChangeLog.__table__, ChangeLogMeta.__table__, retention_days=30
+            )
+    assert superseded >= 2 and truncated >= 1
+
+    # Клиент с курсором после границы получает итог без перекрытых записей
+    compacted = client.get(f'/api/changes?since={cursor}').get_json()
+    assert [c['op'] for c in compacted['changes']] == ['delete']
+    assert compacted['cursor'] == result['cursor']
+
+    response = client.get('/api/changes?since=0')
+    assert response.status_code == 410
+    assert response.get_json()['resync_required'] is True
+    assert response.get_json()['cursor'] == result['cursor']
+    assert client.get('/api/changes?since=abc').status_code == 400
+    print("✓ Журнал изменений работает")
+
+
+def test_batch_classrooms(client):
+    """Тест 15: Пакетное изменение аудиторий в одной транзакции"""
+    with app.app_context():
+        rooms = [Classroom(number=f'2{i:02d}', floor=2, building='B', capacity=30, area=40.0) for i in range(3)]
+        db.session.add_all(rooms)
+        db.session.commit()
+        ids = [room.id for room in rooms]
+        busy_id = Classroom.query.filter_by(number='101').first().id
+        db.session.add(Lesson(classroom_id=busy_id, lesson_date=date.today(),
+                              start_time=time(9, 0), end_time=time(10, 30)))
+        db.session.commit()
+
+    cursor = client.get('/api/changes?since=0').get_json()['cursor']
+    operations = [
+        {'op': 'create', 'data': {'number': '301', 'building': 'B', 'capacity': 50}},
+        {'op': 'update', 'id': ids[0], 'data': {'has_projector': True}},
+        {'op': 'update', 'id': ids[1], 'data': {'has_projector': True}},
+        {'op': 'delete', 'id': ids[2]},
+        {'op': 'delete', 'id': busy_id},
+        {'op': 'update', 'id': 99999, 'data': {'capacity': 10}},
+        {'op': 'create', 'data': {'building': 'B'}},
+    ]
+    response = client.post('/api/classrooms/batch', json={'operations': operations})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [r['status'] for r in results] == [
+        'created', 'updated', 'updated', 'deleted', 'error', 'not_found', 'error'
+    ]
+
+    with app.app_context():
+        assert Classroom.query.filter_by(number='301').count() == 1
+        assert db.session.get(Classroom, ids[0]).has_projector
+        assert db.session.get(Classroom, ids[2]) is None
+        assert db.session.get(Classroom, busy_id) is not None
+
+    # В журнал изменений попадают все применённые операции
+    changes = client.get(f'/api/changes?since={cursor}').get_json()['changes']
+    assert sorted((c['id'], c['op']) for c in changes) == sorted(
+        [(results[0]['id'], 'upsert'), (ids[0], 'upsert'), (ids[1], 'upsert'), (ids[2], 'delete')]
+    )
+
+    # atomic: пакет с ошибкой не применяется
+    response = client.post('/api/classrooms/batch', json={'atomic': True, 'operations': [
+        {'op': 'update', 'id': ids[0], 'data': {'capacity': 99}},
+        {'op': 'delete', 'id': busy_id},
+    ]})
+    assert response.status_code == 409
+    with app.app_context():
+        assert db.session.get(Classroom, ids[0]).capacity == 30
+    assert client.post('/api/classrooms/batch', json={'operations': []}).status_code == 400
+
+    # Повторные обновления одной аудитории применяются в порядке пакета
+    response = client.post('/api/classrooms/batch', json={'operations': [
+        {'op': 'update', 'id': ids[1], 'data': {'capacity': 45}},
+        {'op': 'update', 'id': ids[0], 'data': {'capacity': 40, 'floor': 3}},
+        {'op': 'update', 'id': ids[0], 'data': {'capacity': 45}},
+    ]})
+    assert [r['status'] for r in response.get_json()['results']] == ['updated'] * 3
+    with app.app_context():
+        room = db.session.get(Classroom, ids[0])
+        assert (room.capacity, room.floor) == (45, 3)
+    print("✓ Пакетное изменение аудиторий работает")
+
+
+def test_recurring_free_classrooms(client):
+    """Тест 16: Поиск аудиторий, свободных каждую неделю в одно и то же время"""
+    first = date.today() + timedelta(days=(1 - date.today().weekday()) % 7 + 7)  # вторник
+    with app.app_context():
+        room = Classroom(number='102', floor=1, building='A', capacity=30, area=40.0)
+        db.session.add(room)
+        db.session.commit()
+        db.session.add_all([
+            Lesson(classroom_id=room.id, lesson_date=first + timedelta(days=7),
+                   start_time=time(10, 0), end_time=time(11, 0)),
+            # Среда и другое время — не мешают
+            Lesson(classroom_id=room.id, lesson_date=first + timedelta(days=1),
+                   start_time=time(9, 0), end_time=time(10, 30)),
+            Lesson(classroom_id=room.id, lesson_date=first,
+                   start_time=time(11, 0), end_time=time(12, 0)),
+        ])
+        db.session.commit()
+
+    data = {
+        'date_from': first.isoformat(),
+        'date_to': (first + timedelta(days=27)).isoformat(),
+        'weekdays': [1],
+        'start_time': '09:00',
+        'end_time': '10:30',
+        'fields': ['number']
+    }
+    response = client.post('/api/search-recurring-free-classrooms', json=data)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert len(result['occurrences']) == 4
+    assert [r['number'] for r in result['classrooms']] == ['101']
+
+    data['min_free_percent'] = 75
+    result = client.post('/api/search-recurring-free-classrooms', json=data).get_json()
+    assert [r['number'] for r in result['classrooms']] == ['101', '102']
+    assert result['classrooms'][1]['free_percent'] == 75.0
+    assert result['classrooms'][1]['clash_dates'] == [(first + timedelta(days=7)).isoformat()]
+
+    data['weekdays'] = [7]
+    assert client.post('/api/search-recurring-free-classrooms', json=data).status_code == 400
+    print("✓ Поиск по повторяющемуся окну работает")
+
+
+def test_slow_query_log(client, tmp_path):
+    """Тест 17: Журнал медленных запросов с планом выполнения"""
+    import json
+    import slow_query
+    from sqlalchemy import event
+
+    assert slow_query.normalize("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x'") == \
+        'SELECT * FROM t WHERE id IN (?...) AND name = ?'
+
+    log = slow_query.SlowQueryLog(threshold_ms=0, log_path=str(tmp_path / 'slow.log'))
+    with app.app_context():
+        log.install(db.engine)
+        try:
+            with app.test_request_context('/api/search-free-classrooms', method='POST'):
+                for capacity in (10, 20):
+                    db.session.query(Classroom.id).filter(Classroom.capacity >= capacity).all()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', log._before)
+            event.remove(db.engine, 'after_cursor_execute', log._after)
+
+    shapes = [s for s in log.stats() if 'classrooms.capacity >= ?' in s['shape']]
+    assert len(shapes) == 1 and shapes[0]['count'] == 2
+    assert any('SCAN' in line or 'SEARCH' in line for line in shapes[0]['plan'])
+    assert 'POST /api/search-free-classrooms' in shapes[0]['routes']
+
+    samples = [json.loads(line) for line in (tmp_path / 'slow.log').read_text(encoding='utf-8').splitlines()]
+    assert any(sample['shape'] == shapes[0]['shape'] for sample in samples)
+
+    response = client.get('/admin/slow-queries?format=json')
+    assert response.status_code == 200
+    assert 'shapes' in response.get_json()
+    assert client.get('/admin/slow-queries').status_code == 200
+    print("✓ Журнал медленных запросов работает")
+
+
+def test_lesson_dictionaries(client, tmp_path):
+    """Тест 18: Справочники преподавателей, групп и дисциплин"""
+    from sqlalchemy import create_engine, text
+    from app import Teacher, names, LESSON_DICTIONARY_TABLES
+    import lesson_dictionary
+
+    with app.app_context():
+        classroom = Classroom.query.first()
+        for hour in (9, 11):
+            db.session.add(Lesson(classroom_id=classroom.id, lesson_date=date.today(),
+                                  start_time=time(hour, 0), end_time=time(hour + 1, 30),
+                                  group_name='ИС-21', teacher_name=' Иванов  И.И. ', subject_name='Математика'))
+        db.session.commit()
+
+        # Одно имя — одна строка справочника, занятия ссылаются на неё целым ключом
+        assert Teacher.query.count() == 1
+        lessons = Lesson.query.all()
+        assert lessons[0].teacher_id == lessons[1].teacher_id
+        assert lessons[0].to_dict()['teacher_name'] == 'Иванов И.И.'
+
+        # Откат не оставляет в кэше id несуществующего имени
+        db.session.add(Lesson(classroom_id=classroom.id, lesson_date=date.today(),
+                              start_time=time(14, 0), end_time=time(15, 0), teacher_name='Петров П.П.'))
+        db.session.rollback()
+        lesson = Lesson(classroom_id=classroom.id, lesson_date=date.today(),
+                        start_time=time(14, 0), end_time=time(15, 0), teacher_name='Петров П.П.')
+        db.session.add(lesson)
+        db.session.commit()
+        assert db.session.get(Teacher, lesson.teacher_id).name == 'Петров П.П.'
+
+        # Откат точки сохранения (задание очереди писателя) забывает только вставленные в ней имена
+        with db.session.begin_nested():
+            db.session.add(Lesson(classroom_id=classroom.id, lesson_date=date.today(),
+                                  start_time=time(18, 0), end_time=time(19, 0), teacher_name='Орлова О.О.'))
+        assert ('teachers', 'Орлова О.О.') not in names._ids
+        try:
+            with db.session.begin_nested():
+                db.session.add(Lesson(classroom_id=classroom.id, lesson_date=date.today(),
+                                      start_time=time(16, 0), end_time=time(17, 0), teacher_name='Сидоров С.С.'))
+                raise ValueError
+        except ValueError:
+            pass
+        db.session.commit()
+        assert ('teachers', 'Орлова О.О.') in names._ids
+        assert ('teachers', 'Сидоров С.С.') not in names._ids
+        lesson = Lesson(classroom_id=classroom.id, lesson_date=date.today(),
+                        start_time=time(16, 0), end_time=time(17, 0), teacher_name='Сидоров С.С.')
+        db.session.add(lesson)
+        db.session.commit()
+        assert db.session.get(Teacher, lesson.teacher_id).name == 'Сидоров С.С.'
+
+    # Миграция старой БД со строковыми колонками
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE lessons (id INTEGER PRIMARY KEY, classroom_id INTEGER, lesson_date DATE, '
+            'start_time TIME, end_time TIME, group_name VARCHAR(50), teacher_name VARCHAR(100), '
+            'subject_name VARCHAR(100))'
+        ))
+        connection.execute(text(
+            "INSERT INTO lessons VALUES (1, 1, '2024-09-02', '09:00:00', '10:30:00', 'ИС-21', 'Иванов И.И.', 'Физика'),"
+            "(2, 1, '2024-09-03', '09:00:00', '10:30:00', 'ИС-21', 'Иванов  И.И.', 'Физика'),"
+            "(3, 1, '2024-09-04', '09:00:00', '10:30:00', 'П-31', NULL, 'Химия')"
+        ))
+        legacy_lessons = db.Table('lessons', db.MetaData(), db.Column('id', db.Integer, primary_key=True))
+        added = lesson_dictionary.migrate(connection, [legacy_lessons], LESSON_DICTIONARY_TABLES)
+        assert added == 5
+        rows = connection.execute(text(
+            'SELECT l.id, t.name FROM lessons l LEFT JOIN teachers t ON t.id = l.teacher_id ORDER BY l.id'
+        )).all()
+        assert [tuple(r) for r in rows] == [(1, 'Иванов И.И.'), (2, 'Иванов И.И.'), (3, None)]
+        columns = {row[1] for row in connection.execute(text('PRAGMA table_info(lessons)'))}
+        assert 'teacher_name' not in columns and 'teacher_id' in columns
+        assert lesson_dictionary.migrate(connection, [legacy_lessons], LESSON_DICTIONARY_TABLES) == 0
+    engine.dispose()
+    print("✓ Справочники имён работают")
+
+
+def test_sqlite_production_mode(client, tmp_path):
+    """Тест 19: Рабочий режим SQLite — PRAGMA соединений и очередь писателя"""
+    import threading
+    import app as app_module
+    import sqlite_mode
+    from sqlalchemy import create_engine
+
+    # WAL сохраняется в файле БД, поэтому PRAGMA проверяются на отдельной временной БД
+    engine = create_engine(f"sqlite:///{tmp_path / 'production.db'}")
+    sqlite_mode.configure_engine(engine)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar().lower() == 'wal'
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == 5000
+    engine.dispose()
+
+    queue = sqlite_mode.WriteQueue(db.session, context_factory=app.app_context)
+    app_module.write_queue = queue
+    try:
+        # Параллельные записи уходят в общий коммит; ошибка одной не отменяет остальные
+        futures = []
+
+        def add_room(number):
+            futures.append(queue.submit(lambda: db.session.add(Classroom(number=number, building='C'))))
+
+        threads = [threading.Thread(target=add_room, args=(f'9{i:02d}',)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        failing = queue.submit(lambda: db.session.add(Classroom(number=None, building='C')))
+        for future in futures:
+            future.result(timeout=10)
+        try:
+            failing.result(timeout=10)
+            assert False, 'ожидалась ошибка NOT NULL'
+        except Exception as e:
+            assert 'NOT NULL' in str(e)
+
+        # Маршруты записи идут через очередь писателя
+        response = client.post('/classrooms/add', data={'number': '999', 'building': 'C'})
+        assert response.status_code == 302
+        with app.app_context():
+            assert Classroom.query.filter_by(building='C').count() == 21
+    finally:
+        app_module.write_queue = None
+        queue.shutdown(timeout=5)
+    print("✓ Рабочий режим SQLite работает")
+
+
+def test_admission_control(client):
+    """Тест 20: Контроль допуска — очередь с 503 и ограничение частоты с 429"""
+    import threading
+    import admission
+
+    # Предел одновременности: лишний запрос при полной очереди сразу отклоняется
+    limiter = admission.ConcurrencyLimiter(limit=1, queue_size=1, queue_timeout=0.2)
+    assert limiter.acquire()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire()))
+    waiter.start()
+    while limiter.waiting == 0:
+        threading.Event().wait(0.01)
+    assert limiter.acquire() is False
+    limiter.release()
+    waiter.join()
+    assert results == [True]
+
+    bucket = admission.TokenBucket(rate=1, burst=2)
+    assert bucket.take('a', now=0) == 0 and bucket.take('a', now=0) == 0
+    assert bucket.take('a', now=0) == 1.0
+    assert bucket.take('b', now=0) == 0
+    assert bucket.take('a', now=1.0) == 0
+
+    # Занятый пул отчётов отвечает 503 с Retry-After, дешёвые маршруты не затронуты
+    pool = admission_control.pools['reports']
+    for _ in range(pool.limiter.limit):
+        pool.limiter.acquire()
+    saved_queue = pool.limiter.queue_size
+    pool.limiter.queue_size = 0
+    try:
+        response = client.get('/api/classrooms/equipment-preview')
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) >= 1
+        assert client.get('/').status_code == 200
+        assert client.post('/api/search-free-classrooms', json={
+            'date': date.today().isoformat(), 'start_time': '09:00', 'end_time': '10:30'
+        }).status_code == 200
+    finally:
+        pool.limiter.queue_size = saved_queue
+        for _ in range(pool.limiter.limit):
+            pool.limiter.release()
+
+    # Фоновая задача отчёта ждёт места в пуле и занимает его наравне с запросами
+    for _ in range(pool.limiter.limit):
+        pool.limiter.acquire()
+    entered = []
+
+    def background():
+        with admission_control.slot('reports'):
+            entered.append(pool.limiter.active)
+
+    worker = threading.Thread(target=background)
+    worker.start()
+    worker.join(0.2)
+    assert entered == []
+    for _ in range(pool.limiter.limit):
+        pool.limiter.release()
+    worker.join(5)
+    assert entered == [1] and pool.limiter.active == 0
+
+    # Частота на клиента
+    statuses = [client.get('/api/classrooms/equipment-preview').status_code for _ in range(pool.bucket.burst + 1)]
+    assert statuses[-1] == 429 and 200 in statuses
+    print("✓ Контроль допуска работает")
+
+
+
+def test_async_read_path(client):
+    """Тест 21: Асинхронный путь чтения совпадает с синхронными маршрутами"""
+    from starlette.testclient import TestClient
+    import asgi
+    import serialization
+
+    day = date.today() + timedelta(days=3)
+    with app.app_context():
+        room = Classroom.query.filter_by(number='101').first()
+        db.session.add(Classroom(number='102', floor=1, building='A', capacity=20, area=30.0))
+        db.session.add(Lesson(classroom_id=room.id, lesson_date=day, start_time=time(9, 0),
+                              end_time=time(10, 30), group_name='ИВТ-21', teacher_name='Петров П.П.',
+                              subject_name='Базы данных'))
+        db.session.commit()
+
+    search = {'date': day.isoformat(), 'start_time': '09:30', 'end_time': '11:00'}
+    with TestClient(asgi.application) as async_client:
+        response = async_client.post('/api/search-free-classrooms', json=search)
+        assert response.status_code == 200
+        assert [r['number'] for r in response.json()] == ['102']
+        assert response.json() == client.post('/api/search-free-classrooms', json=search).get_json()
+
+        response = async_client.post('/api/search-free-classrooms', json=dict(search, fields='number,capacity'))
+        assert response.json() == [{'number': '102', 'capacity': 20}]
+        recommended = async_client.post('/api/search-free-classrooms', json=dict(search, recommend=True))
+        assert recommended.json() == client.post(
+            '/api/search-free-classrooms', json=dict(search, recommend=True)).get_json()
+
+        url = f'/api/schedule?date={day.isoformat()}&fields=classroom_number,start_time,teacher_name'
+        assert async_client.get(url).json() == [
+            {'classroom_number': '101', 'start_time': '09:00', 'teacher_name': 'Петров П.П.'}]
+        assert async_client.get(url).json() == client.get(url).get_json()
+        assert async_client.get('/api/schedule?date=завтра').status_code == 400
+
+        for url in ('/api/classrooms/occupancy-preview', '/api/classrooms/equipment-preview'):
+            assert async_client.get(url).json() == client.get(url).get_json()
+
+        # Пул допуска общий с синхронными маршрутами: занятый пул отчётов — 503
+        pool = admission_control.pools['reports']
+        for _ in range(pool.limiter.limit):
+            pool.limiter.acquire()
+        saved_queue, pool.limiter.queue_size = pool.limiter.queue_size, 0
+        try:
+            response = async_client.get('/api/classrooms/equipment-preview')
+            assert response.status_code == 503 and int(response.headers['Retry-After']) >= 1
+        finally:
+            pool.limiter.queue_size = saved_queue
+            for _ in range(pool.limiter.limit):
+                pool.limiter.release()
+        assert pool.limiter.active == 0
+
+        # Остальные маршруты и записи обслуживает приложение Flask
+        assert async_client.get('/classrooms').status_code == 200
+        response = async_client.post('/classrooms/add', data={
+            'number': '103', 'floor': '1', 'building': 'B', 'capacity': '40', 'area': '50'
+        }, follow_redirects=False)
+        assert response.status_code == 302
+        numbers = [r['number'] for r in async_client.post('/api/search-free-classrooms', json=search).json()]
+        assert numbers == ['102', '103']
+
+    # Сжатие по тем же правилам Accept-Encoding, что и в синхронных ответах
+    assert serialization.accepts_gzip('gzip, deflate') and serialization.accepts_gzip('*')
+    assert not serialization.accepts_gzip('gzip;q=0') and not serialization.accepts_gzip('x-gzip-ish')
+    print("✓ Асинхронный путь чтения работает")
+
+
+def test_request_profiler(client):
+    """Тест 22: Профилирование запроса по требованию администратора"""
+    import request_profiler
+    from app import profiler
+
+    profiler.clear()
+    assert 'X-Profile-Id' not in client.get('/schedule').headers
+
+    # Дата, ещё не попавшая в кэш фрагментов: таблица расписания рендерится с запросом
+    first = client.get('/schedule?date=2030-01-07&profile=1')
+    assert first.status_code == 200
+    second = client.get('/api/generate-report?type=occupancy', headers={'X-Profile': '1'})
+    assert second.status_code == 200
+    a, b = int(first.headers['X-Profile-Id']), int(second.headers['X-Profile-Id'])
+
+    profile = client.get(f'/admin/profiles/{a}?format=json').get_json()
+    assert profile['path'].startswith('/schedule') and profile['status'] == 200
+    assert profile['sql_count'] >= 1 and 'Jinja' in profile['categories']
+
+    def nodes(node):
+        yield node
+        for child in node['children']:
+            yield from nodes(child)
+    # SQL привязан к узлам кода приложения
+    with_sql = [n for n in nodes(profile['tree']) if n['sql']]
+    assert with_sql and all(n['category'] == 'Приложение' for n in with_sql)
+    assert any('schedule' in n['name'] for n in with_sql)
+    assert sum(len(n['sql']) for n in with_sql) == profile['sql_count']
+
+    listing = client.get('/admin/profiles?format=json').get_json()
+    assert [p['id'] for p in listing['profiles']] == [b, a]
+    comparison = client.get(f'/admin/profiles?a={a}&b={b}&format=json').get_json()['diff']
+    assert comparison['total_ms']['delta'] == round(comparison['total_ms']['b'] - comparison['total_ms']['a'], 3)
+    assert comparison['functions']
+
+    assert client.get('/admin/profiles').status_code == 200
+    assert client.get(f'/admin/profiles?a={a}&b={b}').status_code == 200
+    assert client.get(f'/admin/profiles/{a}').status_code == 200
+    assert client.get('/admin/profiles/999999').status_code == 404
+
+    # Без прав администратора профиль не снимается
+    app.config['ADMIN_TOKEN'] = 'secret'
+    try:
+        assert 'X-Profile-Id' not in client.get('/schedule?profile=1').headers
+        assert 'X-Profile-Id' in client.get('/schedule?profile=1', headers={'X-Admin-Token': 'secret'}).headers
+        # Токен в адресе не принимается: он попал бы в журналы
+        assert client.get('/admin/profiles?admin_token=secret').status_code == 403
+    finally:
+        app.config['ADMIN_TOKEN'] = ''
+    assert not request_profiler.RequestProfiler.active()
+    print("✓ Профилирование запросов работает")
+
+
+def test_fast_cold_start(client, tmp_path):
+    """Тест 23: Старт без обращения к БД и тяжёлых импортов, init-db отдельной командой"""
+    import subprocess
+    import sys
+    import startup
+
+    # Импорт приложения не загружает NumPy и другие библиотеки отчётов
+    code = 'import json, app, startup; print(json.dumps(startup.loaded_heavy_modules()))'
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == '[]'
+
+    lazy = startup.lazy_import('json.decoder')
+    assert lazy.JSONDecodeError is not None
+
+    # Потоки, одновременно обратившиеся к ленивому модулю, видят его загруженным целиком
+    import threading
+    (tmp_path / 'slow_lazy_module.py').write_text('import time\nFIRST = 1\ntime.sleep(0.2)\nSECOND = 2\n')
+    sys.path.insert(0, str(tmp_path))
+    try:
+        slow = startup.lazy_import('slow_lazy_module')
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append((slow.FIRST, slow.SECOND))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert seen == [(1, 2)] * 4
+    finally:
+        sys.path.remove(str(tmp_path))
+        sys.modules.pop('slow_lazy_module', None)
+
+    # Однократная подготовка БД: таблицы и тестовые данные
+    with app.app_context():
+        db.drop_all()
+    result = app.test_cli_runner().invoke(args=['init-db'])
+    assert result.exit_code == 0, result.output
+    with app.app_context():
+        assert Classroom.query.count() > 1
+    assert app.test_cli_runner().invoke(args=['init-db']).exit_code == 0
+    print("✓ Быстрый холодный старт работает")
+
+
+def test_building_sharding(client, tmp_path, monkeypatch):
+    """Тест 24: Шардирование по корпусам на нескольких файлах SQLite"""
+    import sys
+    import pytest
+    import pyarrow.parquet as pq
+    from sqlalchemy import exc, select
+    from starlette.testclient import TestClient
+    import asgi
+    import sharding
+    from app import ChangeLog, Teacher, LESSON_DICTIONARY_TABLES
+
+    stride = sharding.SHARD_ID_STRIDE
+    day = date.today() + timedelta(days=5)
+    past_day = date.today() - timedelta(days=400)
+    with app.app_context():
+        room_a = Classroom.query.filter_by(number='101').first()
+        room_b = Classroom(number='201', floor=2, building='B', capacity=50, area=70.0, has_projector=True)
+        db.session.add(room_b)
+        db.session.flush()
+        db.session.add(Lesson(classroom_id=room_a.id, lesson_date=day, start_time=time(9, 0),
+                              end_time=time(10, 30), group_name='ИС-21', teacher_name='Иванов И.И.',
+                              subject_name='Математика'))
+        db.session.add(ArchivedLesson(id=900, classroom_id=room_b.id, lesson_date=past_day, start_time=time(9, 0),
+                                      end_time=time(10, 30), group_name='ИС-11', teacher_name='Иванов И.И.',
+                                      subject_name='Математика'))
+        db.session.commit()
+        room_a_id, room_b_id = room_a.id, room_b.id
+        main_counts = (Classroom.query.count(), Lesson.query.count())
+        expected_preview = client.get('/api/classrooms/occupancy-preview').get_json()
+
+        shard_map = sharding.ShardMap(
+            {'north': f'sqlite:///{tmp_path / "north.db"}', 'south': f'sqlite:///{tmp_path / "south.db"}'},
+            {'A': 'north', 'B': 'south'})
+        with db.engine.connect() as source:
+            counts = sharding.split(source, shard_map, Classroom.__table__, Lesson.__table__,
+                                    ArchivedLesson.__table__, LESSON_DICTIONARY_TABLES)
+    assert counts == {'north': (1, 1, 0), 'south': (1, 0, 1)}
+
+    # Занятие удалённой аудитории: перенос останавливается со списком id, шарды не меняются
+    with app.app_context():
+        db.session.add(ArchivedLesson(id=901, classroom_id=999999, lesson_date=past_day, start_time=time(9, 0),
+                                      end_time=time(10, 30), group_name='ИС-11'))
+        db.session.commit()
+        with db.engine.connect() as source, pytest.raises(ValueError, match='lessons_archive — id 901'):
+            sharding.split(source, shard_map, Classroom.__table__, Lesson.__table__,
+                           ArchivedLesson.__table__, LESSON_DICTIONARY_TABLES)
+        db.session.delete(db.session.get(ArchivedLesson, 901))
+        db.session.commit()
+    archived_rows = select(ArchivedLesson.id)
+    assert shard_map.fan_out(lambda connection: connection.execute(archived_rows).scalars().all()) == {
+        'north': [], 'south': [900]}
+
+    # Ответы общей БД до включения шардов — эталон для маршрутов, сливающих результаты шардов
+    recurring = [{'date_from': first.isoformat(), 'date_to': (first + timedelta(days=14)).isoformat(),
+                  'weekdays': [first.weekday()], 'start_time': '09:00', 'end_time': '10:00',
+                  'min_free_percent': 50, 'fields': 'id,number'} for first in (day, past_day)]
+    fan_out_urls = [
+        f'/api/lessons/search?q=Иванов&by=teacher&date_from={past_day.isoformat()}'
+        f'&fields=id,lesson_date,classroom_number,group_name',
+        f'/api/lessons/search?q=Иванов&by=teacher&date_from={past_day.isoformat()}&fields=id&limit=1',
+        '/api/lessons/search?q=Иваноф&mode=fuzzy&fields=id',
+        '/api/lessons/suggest?q=Иван&field=teacher',
+        '/api/lessons/suggest?q=ИС-1&field=group&mode=fuzzy',
+        f'/api/reports/heatmap?date_from={past_day.isoformat()}&date_to={day.isoformat()}',
+        f'/api/reports/heatmap?date_from={past_day.isoformat()}&date_to={day.isoformat()}&group_by=building',
+        f'/api/reports/heatmap?date_from={day.isoformat()}&building=B',
+    ]
+    expected_recurring = [client.post('/api/search-recurring-free-classrooms', json=data).get_json()
+                          for data in recurring]
+    expected_fan_out = [client.get(url).get_json() for url in fan_out_urls]
+    assert [r['number'] for r in expected_recurring[0]['classrooms']] == ['201', '101']
+    assert [r['group_name'] for r in expected_fan_out[0]] == ['ИС-11', 'ИС-21']
+    assert expected_fan_out[2] == [{'id': r['id']} for r in expected_fan_out[0]]
+    assert expected_fan_out[1] == [{'id': 900}] and expected_fan_out[3] == ['Иванов И.И.']
+    assert expected_fan_out[6]['rows'] == ['A', 'B'] and sum(expected_fan_out[6]['values']) > 0
+    with app.app_context(), db.engine.connect() as connection:
+        import parquet_export
+        from app import ChangeLog, ChangeLogMeta
+        parquet_export.export_snapshot(
+            connection, Classroom.__table__, [Lesson.__table__, ArchivedLesson.__table__],
+            LESSON_DICTIONARY_TABLES, str(tmp_path / 'main_export'),
+            change_tables=(ChangeLog.__table__, ChangeLogMeta.__table__))
+
+    def shard_value(name, query):
+        return shard_map.fan_out(lambda connection: connection.execute(query).scalar(), [name])[name]
+
+    queried = []
+    fan_out = shard_map.fan_out
+    monkeypatch.setattr(shard_map, 'fan_out', lambda func, names=None: queried.append(names) or fan_out(func, names))
+    monkeypatch.setattr(sys.modules['app'], 'shard_map', shard_map)
+    # Тест делает больше поисковых запросов, чем допускает ограничение частоты пула search
+    monkeypatch.setattr(admission_control, 'enabled', False)
+    try:
+        search = {'date': day.isoformat(), 'start_time': '09:00', 'end_time': '10:00', 'fields': 'id,number'}
+        # Поиск по всем корпусам: оба шарда, результаты слиты по id
+        assert client.post('/api/search-free-classrooms', json=search).get_json() == [
+            {'id': room_b_id, 'number': '201'}]
+        assert queried[-1] == ['north', 'south']
+        # Поиск в одном корпусе — только его шард
+        response = client.post('/api/search-free-classrooms', json=dict(search, building='A', end_time='08:59'))
+        assert response.status_code == 400
+        later = dict(search, building='A', start_time='11:00', end_time='12:00')
+        assert client.post('/api/search-free-classrooms', json=later).get_json() == [
+            {'id': room_a_id, 'number': '101'}]
+        assert queried[-1] == ['north']
+
+        # Повторяющийся поиск, поиск занятий, подсказки и тепловая карта сливают ответы всех шардов
+        assert [client.post('/api/search-recurring-free-classrooms', json=data).get_json()
+                for data in recurring] == expected_recurring
+        assert queried[-1] == ['north', 'south']
+        assert client.post('/api/search-recurring-free-classrooms', json=dict(recurring[0], building='B')
+                           ).get_json()['classrooms'] == [{'id': room_b_id, 'number': '201', 'free_count': 3,
+                                                           'free_percent': 100.0, 'clash_dates': []}]
+        assert queried[-1] == ['south']
+        assert [client.get(url).get_json() for url in fan_out_urls] == expected_fan_out
+        # Выгрузка в Parquet: аудитории и занятия всех шардов в тех же дневных разделах
+        assert parquet_export.main([str(tmp_path / 'shard_export')])
+        for part in ['classrooms.parquet'] + [f'lessons/{d.isoformat()}/part-0.parquet' for d in (past_day, day)]:
+            assert pq.read_table(str(tmp_path / 'shard_export' / part)).equals(
+                pq.read_table(str(tmp_path / 'main_export' / part)))
+        assert parquet_export.exported_dates(str(tmp_path / 'shard_export')) == [past_day, day]
+
+        recommended = client.post('/api/search-free-classrooms', json=dict(search, recommend=True)).get_json()
+        assert [r['number'] for r in recommended] == ['201']
+
+        # Архив перенесён в шард аудитории и читается, когда дата его задевает
+        archived = dict(search, date=past_day.isoformat())
+        assert client.post('/api/search-free-classrooms', json=archived).get_json() == [
+            {'id': room_a_id, 'number': '101'}]
+        assert [r['number'] for r in client.post(
+            '/api/search-free-classrooms', json=dict(archived, recommend=True)).get_json()] == ['101']
+        assert client.get(f'/api/schedule?date={past_day.isoformat()}&fields=classroom_number,group_name'
+                          ).get_json() == [{'classroom_number': '201', 'group_name': 'ИС-11'}]
+
+        # Занятие записывается в шард аудитории, пересечение проверяется там же
+        form = {'classroom_id': room_b_id, 'lesson_date': day.isoformat(), 'start_time': '09:00',
+                'end_time': '10:30', 'group_name': 'П-31', 'teacher_name': 'Петрова А.С.', 'subject_name': 'Физика'}
+        assert client.post('/schedule/add', data=form).status_code == 302
+        assert client.post('/schedule/add', data=dict(form, start_time='10:00', end_time='11:00')).status_code == 302
+        assert client.post('/schedule/add', data=dict(form, lesson_date=past_day.isoformat())).status_code == 302
+        schedule_url = f'/api/schedule?date={day.isoformat()}&fields=id,classroom_number,start_time,teacher_name'
+        schedule = client.get(schedule_url).get_json()
+        assert [(r['classroom_number'], r['start_time'], r['teacher_name']) for r in schedule] == [
+            ('101', '09:00', 'Иванов И.И.'), ('201', '09:00', 'Петрова А.С.')]
+        lesson_id = schedule[1]['id']
+        assert lesson_id == 2 * stride + 1
+        # Новое имя справочника — тоже с id из диапазона шарда
+        assert shard_value('south', select(Teacher.id).where(Teacher.name == 'Петрова А.С.')) == 2 * stride + 1
+        assert client.post('/api/search-free-classrooms', json=search).get_json() == []
+        assert '201' in client.get(f'/schedule?date={day.isoformat()}').get_data(as_text=True)
+
+        # Удалённый id не выдаётся повторно
+        assert client.get(f'/schedule/delete/{lesson_id}').status_code == 302
+        assert client.post('/schedule/add', data=form).status_code == 302
+        assert [r['id'] for r in client.get(schedule_url).get_json()][1] == 2 * stride + 2
+        assert client.get(f'/schedule/delete/{lesson_id}').status_code == 404
+
+        # Аудитории: добавление, перенос между шардами без занятий, удаление — в шардах
+        room = {'number': '102', 'floor': '1', 'building': 'A', 'capacity': '20', 'area': '30'}
+        assert client.post('/classrooms/add', data=room).status_code == 302
+        new_room_id = stride + 1
+        assert shard_map.locate(Classroom.__table__, new_room_id) == 'north'
+        assert client.get(f'/classrooms/edit/{new_room_id}').status_code == 200
+        assert client.post(f'/classrooms/edit/{new_room_id}', data=dict(room, building='B')).status_code == 302
+        assert shard_map.locate(Classroom.__table__, new_room_id) == 'south'
+        client.post(f'/classrooms/edit/{room_b_id}', data=dict(room, number='201', building='A'))
+        assert shard_map.locate(Classroom.__table__, room_b_id) == 'south'
+        client.get(f'/classrooms/delete/{room_a_id}')
+        assert shard_map.locate(Classroom.__table__, room_a_id) == 'north'
+        assert client.get(f'/classrooms/delete/{new_room_id}').status_code == 302
+        assert shard_map.locate(Classroom.__table__, new_room_id) is None
+
+        # Пакет: создание в шарде корпуса, обновление в шарде аудитории
+        batch = client.post('/api/classrooms/batch', json={'operations': [
+            {'op': 'create', 'data': {'number': '202', 'building': 'B'}},
+            {'op': 'update', 'id': room_a_id, 'data': {'capacity': 35}},
+            {'op': 'update', 'id': 99999, 'data': {'capacity': 35}},
+            {'op': 'update', 'id': room_a_id, 'data': {'building': 'B'}},
+        ]}).get_json()
+        assert [r['status'] for r in batch['results']] == ['created', 'updated', 'not_found', 'error']
+        assert batch['results'][0]['id'] == 2 * stride + 1
+        assert shard_value('north', select(Classroom.capacity).where(Classroom.id == room_a_id)) == 35
+        rejected = client.post('/api/classrooms/batch', json={'atomic': True, 'operations': [
+            {'op': 'create', 'data': {'number': '103', 'building': 'A'}},
+            {'op': 'delete', 'id': room_b_id},
+        ]})
+        assert rejected.status_code == 409
+        assert shard_value('north', select(Classroom.id).where(Classroom.number == '103')) is None
+
+        preview = client.get('/api/classrooms/occupancy-preview?fields=number,lessons_count').get_json()
+        assert preview == [{'number': '101', 'lessons_count': 1}, {'number': '201', 'lessons_count': 1},
+                           {'number': '202', 'lessons_count': 0}]
+        assert [r['number'] for r in expected_preview] == ['101', '201']
+
+        # ASGI читает те же шарды
+        with TestClient(asgi.application) as async_client:
+            assert async_client.post('/api/search-free-classrooms', json=later).json() == client.post(
+                '/api/search-free-classrooms', json=later).get_json()
+            assert async_client.get(schedule_url).json() == client.get(schedule_url).get_json()
+            assert async_client.get('/api/classrooms/occupancy-preview').json() == client.get(
+                '/api/classrooms/occupancy-preview').get_json()
+
+        with app.app_context():
+            # Общая БД не менялась, журнал изменений — в ней
+            assert (Classroom.query.count(), Lesson.query.count()) == main_counts
+            logged = {(row.entity, row.entity_id, row.op) for row in ChangeLog.query}
+            assert {('lesson', lesson_id, 'upsert'), ('lesson', lesson_id, 'delete'),
+                    ('classroom', new_room_id, 'delete'), ('classroom', 2 * stride + 1, 'upsert')} <= logged
+
+        # Транзакция записи сразу блокирует шард и для других процессов (отдельная карта — отдельные соединения)
+        other = sharding.ShardMap({'north': f'sqlite:///{tmp_path / "north.db"}'}, {'A': 'north'},
+                                  engine_options={'connect_args': {'timeout': 0.1}})
+        try:
+            with shard_map.begin('north'):
+                with pytest.raises(exc.OperationalError):
+                    with other.begin('north'):
+                        pass
+        finally:
+            other.dispose()
+    finally:
+        shard_map.dispose()
+    print("✓ Шардирование по корпусам работает")
+
+
+def test_capacity_simulation(client):
+    """Тест 25: Моделирование фонда «что если» без изменения таблиц"""
+    day = date.today() + timedelta(days=1)
+    with app.app_context():
+        room_a = Classroom.query.filter_by(number='101').first()
+        room_b = Classroom(number='201', floor=2, building='B', capacity=40, area=60.0, has_projector=True)
+        db.session.add(room_b)
+        db.session.flush()
+        for start, end in ((time(9, 0), time(10, 30)), (time(10, 45), time(12, 15))):
+            db.session.add(Lesson(classroom_id=room_a.id, lesson_date=day, start_time=start, end_time=end,
+                                  group_name='ИС-21', teacher_name='Иванов И.И.', subject_name='Математика'))
+        db.session.add(Lesson(classroom_id=room_b.id, lesson_date=day, start_time=time(9, 0),
+                              end_time=time(10, 30), group_name='П-31', teacher_name='Петрова А.С.',
+                              subject_name='Физика'))
+        db.session.commit()
+        room_a_id, room_b_id = room_a.id, room_b.id
+        lessons_before = Lesson.query.count()
+
+    scenarios = [
+        {'name': 'Как есть'},
+        {'name': 'Ремонт корпуса A', 'remove_buildings': ['A']},
+        {'name': 'Ремонт A и новая аудитория', 'remove_buildings': ['A'],
+         'add_rooms': [{'number': '301', 'building': 'C', 'capacity': 35, 'has_projector': True}]},
+        {'name': 'Меньше мест в 201', 'capacity': {str(room_b_id): 20}, 'seat_ratio': 0.5},
+    ]
+    app.config['SIMULATION_WORKERS'] = 1
+    response = client.post('/api/simulations/capacity', json={'date': day.isoformat(), 'scenarios': scenarios})
+    assert response.status_code == 200
+    results = response.get_json()['scenarios']
+    as_is, closed, closed_plus, resized = results
+
+    assert as_is['kept'] == 3 and as_is['unplaceable_count'] == 0
+    # Без корпуса A первое занятие пересекается с занятием в 201, второе переносится туда
+    assert closed['rooms'] == 1 and closed['moved'] == 1 and closed['unplaceable_count'] == 1
+    assert closed['unplaceable'][0]['start_time'] == '09:00'
+    assert closed['unplaceable'][0]['classroom_id'] == room_a_id
+    assert closed_plus['moved'] == 2 and closed_plus['unplaceable_count'] == 0
+    assert set(closed_plus['utilization']['by_building']) == {'B', 'C'}
+    # Половина группы из 40 человек помещается в 20 мест
+    assert resized['kept'] == 3
+    assert as_is['utilization']['booked_hours'] == 4.5
+    assert 0 < as_is['utilization']['percent'] < 100
+
+    # Пул процессов даёт тот же результат
+    app.config['SIMULATION_WORKERS'] = 2
+    try:
+        parallel = client.post('/api/simulations/capacity', json={'date': day.isoformat(), 'scenarios': scenarios})
+        assert parallel.get_json()['scenarios'] == results
+    finally:
+        app.config['SIMULATION_WORKERS'] = 1
+
+    assert client.post('/api/simulations/capacity', json={'scenarios': []}).status_code == 400
+    assert client.post('/api/simulations/capacity', json={'scenarios': [{'rooms': 1}]}).status_code == 400
+    assert client.post('/api/simulations/capacity', json={'scenarios': [{'seat_ratio': 2}]}).status_code == 400
+    # Строка вместо списка не разбирается посимвольно, а отклоняется
+    for bad in ({'remove_buildings': 'Корпус А'}, {'remove_buildings': [1]}, {'remove_rooms': '12'},
+                {'add_rooms': ['A-101']}, {'add_rooms': {'capacity': 30}}):
+        response = client.post('/api/simulations/capacity', json={'scenarios': [bad]})
+        assert response.status_code == 400
+        assert 'должен быть списком' in response.get_json()['error']
+    with app.app_context():
+        assert Lesson.query.count() == lessons_before
+
+    # Фонд сценария передаётся процессу один раз на часть дней, а не с каждым днём
+    import os
+    import subprocess
+    import sys
+    import capacity_simulation
+
+    class RecordingExecutor:
+        def map(self, func, *arguments):
+            self.tasks = list(zip(*arguments))
+            return map(func, *arguments)
+
+    rooms = [capacity_simulation.Room(1, '101', 'A', 1, 30, True, False, False)]
+    lessons = [capacity_simulation.SimLesson(i, day + timedelta(days=i), 540, 630, 1, 20, (), 'A') for i in range(3)]
+    scenarios = [capacity_simulation.parse_scenario({}), capacity_simulation.parse_scenario({'remove_rooms': [1]}, 1)]
+    term_start, term_end = day, day + timedelta(days=7)
+    executor = RecordingExecutor()
+    results = capacity_simulation.run(rooms, lessons, scenarios, term_start, term_end, executor, workers=1)
+    assert [len(days) for _, days, _, _ in executor.tasks] == [3, 3]
+    assert results == capacity_simulation.run(rooms, lessons, scenarios, term_start, term_end)
+    assert [r['unplaceable_count'] for r in results] == [0, 3]
+    assert [len(part) for part in capacity_simulation.split_days(list(range(10)), 1, 4)] == [2] * 5
+
+    # Главный модуль запуска лёгкий: дочерние процессы spawn не импортируют приложение
+    check = subprocess.run([sys.executable, '-c', 'import sys, serve; print("app" in sys.modules)'],
+                           capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert check.stdout.strip() == 'False'
+    print("✓ Моделирование фонда аудиторий работает")
+
 if __name__ == '__main__':
     pytest.main(['-v'])
\ No newline at end of file